@@ -0,0 +1,94 @@
+"""
+Layout of the MOM6 open boundary segment files written by `obc.finalize_segment`
+(workflow/ocn/modules/obc.py).
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'workflow', 'ocn'))
+from modules import obc
+
+NZ, NT = 3, 2
+DZ = np.array([1.0, 2.5, 10.0])
+
+def write_hgrid(fname, nyp, nxp):
+    """ Supergrid strip with x = 100*j + i and y = -(100*j + i), so rows and columns are told apart """
+    x = 100.0*np.arange(nyp)[:, np.newaxis] + np.arange(nxp)[np.newaxis, :]
+    with Dataset(fname, 'w') as ds:
+        ds.createDimension('nyp', nyp)
+        ds.createDimension('nxp', nxp)
+        ds.createVariable('x', 'f8', ('nyp', 'nxp'))[:] = x
+        ds.createVariable('y', 'f8', ('nyp', 'nxp'))[:] = -x
+        ds['x'].units = 'degree_east'
+        ds['y'].units = 'degree_north'
+
+    return x
+
+def write_remapped(fname, segment, ny, nx):
+    """ Boundary file as written by run_ocn_prep.py before `finalize_segment` """
+    with Dataset(fname, 'w') as ds:
+        ds.createDimension('Layer', NZ)
+        ds.createDimension('Time', None)
+        ds.createDimension('yh', ny)
+        ds.createDimension('xh', nx)
+        ds.createVariable('Time', 'f4', ('Time',))[:] = np.arange(NT)
+        for field in ('temp', 'salt'):
+            var = ds.createVariable(f"{field}_segment_{segment}", 'f4', ('Time', 'Layer', 'yh', 'xh'))
+            var[:] = np.ones((NT, NZ, ny, nx))
+
+@pytest.mark.parametrize("segment, ny, nx", [('001', 1, 5), ('003', 4, 1)])
+@pytest.mark.parametrize("compact_dz", [False, True])
+def test_finalize_segment(tmp_path, segment, ny, nx, compact_dz):
+    hgrid_file = str(tmp_path / f"ocean_hgrid_{segment}.nc")
+    out_file = str(tmp_path / "obc.nc")
+    x = write_hgrid(hgrid_file, ny, nx)
+    write_remapped(out_file, segment, ny, nx)
+
+    with Dataset(out_file, 'a') as ds:
+        obc.finalize_segment(ds, segment, DZ, 'Layer', 'Time', hgrid_file, compact_dz=compact_dz)
+
+    with Dataset(out_file, 'r') as ds:
+        # Dimensions renamed to the segment dimensions
+        for dim in ('Layer', 'yh', 'xh'):
+            assert dim not in ds.dimensions
+        assert len(ds.dimensions[f"nz_segment_{segment}"]) == NZ
+        assert len(ds.dimensions[f"ny_segment_{segment}"]) == ny
+        assert len(ds.dimensions[f"nx_segment_{segment}"]) == nx
+
+        # Layer thickness of every field, constant in time and along the segment
+        assert obc.segment_fields(ds, segment) == ['temp', 'salt']
+        for field in ('temp', 'salt'):
+            dz = ds[f"dz_{field}_segment_{segment}"]
+            assert dz.dimensions == ('Time', f"nz_segment_{segment}", f"ny_segment_{segment}", f"nx_segment_{segment}")
+            assert dz.dtype == np.float32
+            np.testing.assert_array_equal(dz[:], np.broadcast_to(DZ[np.newaxis, :, np.newaxis, np.newaxis], (NT, NZ, ny, nx)))
+            assert ds[f"{field}_segment_{segment}"].dimensions == dz.dimensions
+
+        # Coordinates from the supergrid strip, along the segment
+        dim = f"nx_segment_{segment}" if segment == '001' else f"ny_segment_{segment}"
+        strip = x[0, :] if segment == '001' else x[:, 0]
+        assert ds[f"lon_segment_{segment}"].dimensions == (dim,)
+        np.testing.assert_array_equal(ds[f"lon_segment_{segment}"][:], strip)
+        np.testing.assert_array_equal(ds[f"lat_segment_{segment}"][:], -strip)
+        assert ds[f"lon_segment_{segment}"].units == 'degree_east'
+        assert ds[f"lat_segment_{segment}"].units == 'degree_north'
+
+def test_finalize_segment_mismatched_hgrid(tmp_path):
+    hgrid_file = str(tmp_path / "ocean_hgrid_001.nc")
+    out_file = str(tmp_path / "obc.nc")
+    write_hgrid(hgrid_file, 1, 6)
+    write_remapped(out_file, '001', 1, 5)
+
+    with Dataset(out_file, 'a') as ds, pytest.raises(ValueError):
+        obc.finalize_segment(ds, '001', DZ, 'Layer', 'Time', hgrid_file)
+
+def test_finalize_segment_unknown_segment(tmp_path):
+    out_file = str(tmp_path / "obc.nc")
+    write_remapped(out_file, '005', 1, 5)
+
+    with Dataset(out_file, 'a') as ds, pytest.raises(ValueError):
+        obc.finalize_segment(ds, '005', DZ, 'Layer', 'Time', None)
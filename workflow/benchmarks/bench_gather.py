@@ -0,0 +1,69 @@
+"""
+Script Name: bench_gather.py
+Description:
+    Compares the nearest-neighbour gather fast path of `RemapOperator` against the
+    general CSR sparse product on ARC12-sized synthetic `neareststod` weights.
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from scipy.sparse import csr_matrix
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from remapping.weights import RemapOperator
+
+def best_time(func, repeat):
+    """ Best wall time of `repeat` calls """
+    times = []
+    for __ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def main(args):
+    rng = np.random.default_rng(0)
+    na = args.src_nx * args.src_ny
+    nb = args.dst_nx * args.dst_ny
+
+    # One weight of 1.0 per destination row, as written by ESMF_RegridWeightGen -m neareststod.
+    # Destination points map to spatially coherent source points in the northern part of the source grid.
+    jj, ii = np.meshgrid(np.arange(args.dst_ny), np.arange(args.dst_nx), indexing='ij')
+    src_j = args.src_ny//2 + (jj * (args.src_ny//2)) // args.dst_ny
+    src_i = (ii * args.src_nx) // args.dst_nx
+    col = (src_j * args.src_nx + src_i).ravel().astype(np.int32)
+    indptr = np.arange(nb+1, dtype=np.int32)
+    S_mat = csr_matrix((np.ones(nb), col, indptr), shape=(nb, na))
+
+    operator = RemapOperator(S_mat)
+    block = rng.standard_normal((args.levels, na))
+
+    t_csr = best_time(lambda: np.ascontiguousarray(S_mat.dot(np.ascontiguousarray(block.T)).T), args.repeat)
+    t_gather = best_time(lambda: operator.apply(block), args.repeat)
+
+    ref = np.ascontiguousarray(S_mat.dot(np.ascontiguousarray(block.T)).T)
+    max_diff = np.max(np.abs(operator.apply(block) - ref))
+
+    print(f"Source grid:      {args.src_ny} x {args.src_nx} ({na} points)")
+    print(f"Destination grid: {args.dst_ny} x {args.dst_nx} ({nb} points)")
+    print(f"Levels:           {args.levels}")
+    print(f"CSR product:      {t_csr:.4f} s")
+    print(f"Index gather:     {t_gather:.4f} s")
+    print(f"Speedup:          {t_csr/t_gather:.1f}x (max abs diff {max_diff:.1e})")
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Benchmark gather vs. sparse product for neareststod weights")
+    parser.add_argument("--src_nx", type=int, default=1440, help="Source grid x size (default: mx025)")
+    parser.add_argument("--src_ny", type=int, default=1080, help="Source grid y size (default: mx025)")
+    parser.add_argument("--dst_nx", type=int, default=1280, help="Destination grid x size (default: ARC12-sized)")
+    parser.add_argument("--dst_ny", type=int, default=1080, help="Destination grid y size (default: ARC12-sized)")
+    parser.add_argument("--levels", type=int, default=75, help="Number of stacked levels")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timing repeats")
+
+    args = parser.parse_args()
+
+    main(args)
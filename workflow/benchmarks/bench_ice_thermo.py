@@ -0,0 +1,113 @@
+"""
+Script Name: bench_ice_thermo.py
+Description:
+    Compares the fused ice thermodynamic corrections of `ice/thermo.py` ('numpy' backend, and
+    'numba' when it is installed) against the original layer-by-layer expressions of
+    `run_ice_prep.py` on a synthetic (ncat, nj, ni) restart, and checks that they agree.
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ice'))
+import thermo
+from thermo import cp_ice, cp_ocn, Lfresh, rhoi, rhos
+
+def reference(fields, kmt, Tmltz):
+    """ Original corrections: one temporary array per expression, one layer at a time """
+    aicen, vicen, vsnon, Tsfcn = (fields[name].copy() for name in ('aicen', 'vicen', 'vsnon', 'Tsfcn'))
+    qice = fields['qice'].copy()
+
+    qsno = -rhos * (Lfresh - cp_ice * Tsfcn)
+    for l in range(len(Tmltz)):
+        q_lyr = qice[l]
+        T_lyr = Tmltz[l]
+        a = cp_ice
+        b = ((cp_ocn - cp_ice) * T_lyr) - (q_lyr / rhoi) - Lfresh
+        c = Lfresh * T_lyr
+        d = np.maximum(b**2 - 4.0*a*c, 0)
+        q2T = (-b - np.sqrt(d) ) / (2.0 * a)
+        q2T_fix = np.where( q2T > T_lyr, T_lyr, q2T)
+        qice[l] = -rhoi* ( cp_ice*(T_lyr-q2T_fix) + Lfresh*(1-(T_lyr/q2T_fix)) - cp_ocn*T_lyr )
+
+    aicen = np.where(kmt == 1, aicen, 0)
+    aicen = np.where(aicen > thermo.aice_min, aicen, 0)
+    vicen = np.where(aicen > 0, vicen, 0)
+    vsnon = np.where(aicen > 0, vsnon, 0)
+    qice = np.where(aicen > 0, qice, 0)
+
+    A = thermo.c1 / (rhos * cp_ice)
+    B = Lfresh / cp_ice
+    zTsn = A * qsno + B
+    Tmax = -qsno * thermo.puny_temp * thermo.rnslyr / (rhos * cp_ice * vsnon + thermo.puny_temp)
+    Qmax = rhos * cp_ice * (Tmax - Lfresh / cp_ice)
+    newq = np.where(zTsn <= Tmax, qsno, Qmax)
+    newf = np.where(vicen > thermo.vice_min, aicen, 0.0)
+    aicen = np.where(newf > 1.0, 1.0, newf)
+    qsno = np.where(vsnon == 0.0, qsno, newq)
+    iceumask = np.where(aicen.sum(axis=0) > thermo.iceumask_min, 1.0, 0.0)
+
+    return {'aicen': aicen, 'vicen': vicen, 'vsnon': vsnon, 'qice': qice, 'qsno': qsno, 'iceumask': iceumask}
+
+def fused(fields, kmt, Tmltz, backend):
+    """ `thermo.correct_ice_state` on copies of the fields """
+    out = {name: fields[name].copy() for name in ('aicen', 'vicen', 'vsnon', 'qice')}
+    out['qsno'], out['iceumask'] = thermo.correct_ice_state(out['aicen'], out['vicen'], out['vsnon'], fields['Tsfcn'],
+                                                            out['qice'], kmt, Tmltz, backend=backend)
+    return out
+
+def best_time(func, repeat):
+    """ Best wall time of `repeat` calls """
+    times = []
+    for __ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def main(args):
+    rng = np.random.default_rng(0)
+    dtype = np.dtype(args.dtype)
+    shape = (thermo.ncat, args.ny, args.nx)
+
+    fields = {'aicen': rng.uniform(0, 0.3, shape), 'vicen': rng.uniform(0, 1, shape),
+              'vsnon': np.where(rng.uniform(size=shape) > 0.3, rng.uniform(0, 0.5, shape), 0),
+              'Tsfcn': -rng.uniform(0, 20, shape), 'qice': -rng.uniform(1e8, 3.5e8, (thermo.nilyr,) + shape)}
+    fields = {name: data.astype(dtype) for name, data in fields.items()}
+    kmt = (rng.uniform(size=shape[1:]) > 0.2).astype(float)
+    Tmltz = thermo.melting_temperature()
+
+    backends = ['numpy']
+    try:
+        thermo.numba_kernels()
+        fused(fields, kmt, Tmltz, 'numba') # Compile before timing
+        backends.append('numba')
+    except ImportError:
+        print("numba is not installed, skipping the 'numba' backend")
+
+    ref = reference(fields, kmt, Tmltz)
+    t_ref = best_time(lambda: reference(fields, kmt, Tmltz), args.repeat)
+
+    print(f"Grid:             {thermo.ncat} x {args.ny} x {args.nx}, {thermo.nilyr} ice layers, {dtype}")
+    print(f"Layer loop:       {t_ref:.4f} s")
+    for backend in backends:
+        out = fused(fields, kmt, Tmltz, backend)
+        max_diff = max(np.max(np.abs(out[name] - ref[name].astype(out[name].dtype)) / (1 + np.abs(ref[name])))
+                       for name in ref)
+        t_fused = best_time(lambda: fused(fields, kmt, Tmltz, backend), args.repeat)
+        print(f"{backend + ':':17s} {t_fused:.4f} s ({t_ref/t_fused:.1f}x, max rel diff {max_diff:.1e})")
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the fused ice thermodynamic corrections")
+    parser.add_argument("--nx", type=int, default=1280, help="Grid x size (default: ARC12-sized)")
+    parser.add_argument("--ny", type=int, default=1080, help="Grid y size (default: ARC12-sized)")
+    parser.add_argument("--dtype", default="float64", choices=['float32', 'float64'],
+                        help="Precision of the remapped fields")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed repetitions (best is reported)")
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,91 @@
+"""
+Script Name: check_dtype.py
+Description:
+    Accuracy and timing check of the float32 remapping path against float64 on
+    ARC12-sized synthetic bilinear weights and ocean-like fields.
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from scipy.sparse import csr_matrix
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from remapping.weights import RemapOperator
+
+def best_time(func, repeat):
+    """ Best wall time of `repeat` calls """
+    times = []
+    for __ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def bilinear_operator(args, rng):
+    """ Four weights per destination row summing to 1, on neighbouring source points """
+    na = args.src_nx * args.src_ny
+    nb = args.dst_nx * args.dst_ny
+
+    jj, ii = np.meshgrid(np.arange(args.dst_ny), np.arange(args.dst_nx), indexing='ij')
+    src_j = np.minimum(args.src_ny//2 + (jj * (args.src_ny//2)) // args.dst_ny, args.src_ny-2).ravel()
+    src_i = np.minimum((ii * args.src_nx) // args.dst_nx, args.src_nx-2).ravel()
+
+    fx, fy = rng.random(nb), rng.random(nb)
+    col = np.stack([src_j*args.src_nx + src_i, src_j*args.src_nx + src_i+1,
+                    (src_j+1)*args.src_nx + src_i, (src_j+1)*args.src_nx + src_i+1], axis=1)
+    S = np.stack([(1-fx)*(1-fy), fx*(1-fy), (1-fx)*fy, fx*fy], axis=1)
+    indptr = np.arange(0, 4*nb+1, 4, dtype=np.int32)
+
+    return csr_matrix((S.ravel(), col.ravel().astype(np.int32), indptr), shape=(nb, na))
+
+def main(args):
+    rng = np.random.default_rng(0)
+    na = args.src_nx * args.src_ny
+
+    operator = RemapOperator(bilinear_operator(args, rng))
+    operator_f4 = operator.astype(np.float32)
+
+    # Representative ranges of the remapped fields (double precision, as in MOM6 restarts)
+    fields = {'Temp': (-2.0, 30.0), 'Salt': (30.0, 37.0), 'u': (-1.5, 1.5), 'h': (0.0, 250.0)}
+
+    print(f"Source grid:      {args.src_ny} x {args.src_nx} ({na} points)")
+    print(f"Destination grid: {args.dst_ny} x {args.dst_nx} ({operator.shape[0]} points)")
+    print(f"Levels:           {args.levels}")
+
+    for name, (lo, hi) in fields.items():
+        block = rng.uniform(lo, hi, (args.levels, na))
+
+        ref = operator.apply(block)
+        out = operator_f4.apply(block.astype(np.float32))
+
+        # Error of the float32 path, compared with the unavoidable rounding of the float64 result to 'f4' output
+        err = np.max(np.abs(out - ref))
+        rounding = np.max(np.abs(ref.astype(np.float32) - ref))
+        print(f"{name:5s} max abs error {err:.2e} (f4 output rounding {rounding:.2e}), "
+              f"relative to field range {err/(hi-lo):.1e}")
+
+    block = rng.standard_normal((args.levels, na))
+    block_f4 = block.astype(np.float32)
+    t_f8 = best_time(lambda: operator.apply(block), args.repeat)
+    t_f4 = best_time(lambda: operator_f4.apply(block_f4), args.repeat)
+
+    print(f"float64 product:  {t_f8:.4f} s ({block.nbytes/2**20:.0f} MiB per block)")
+    print(f"float32 product:  {t_f4:.4f} s ({block_f4.nbytes/2**20:.0f} MiB per block)")
+    print(f"Speedup:          {t_f8/t_f4:.1f}x")
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Check float32 vs. float64 remapping accuracy and speed")
+    parser.add_argument("--src_nx", type=int, default=1440, help="Source grid x size (default: mx025)")
+    parser.add_argument("--src_ny", type=int, default=1080, help="Source grid y size (default: mx025)")
+    parser.add_argument("--dst_nx", type=int, default=1280, help="Destination grid x size (default: ARC12-sized)")
+    parser.add_argument("--dst_ny", type=int, default=1080, help="Destination grid y size (default: ARC12-sized)")
+    parser.add_argument("--levels", type=int, default=75, help="Number of stacked levels")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timing repeats")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,116 @@
+"""
+Script Name: check_ice_memory.py
+Description:
+    Peak memory (max RSS) and wall time of the ice restart remapping in `run_ice_prep.py`,
+    with the default in-memory xarray path and with `--stream True`, on a synthetic
+    CICE restart. Each mode runs in its own process so the peak RSS is not shared.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+from argparse import Namespace
+import numpy as np
+from netCDF4 import Dataset
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'ice'))
+sys.path.insert(0, ROOT)
+
+import synthetic
+
+def write_inputs(workdir, args):
+    rng = np.random.default_rng(0)
+    files = {name: os.path.join(workdir, f"{name}.nc") for name in ('wgt', 'src', 'src_angl', 'msk', 'dst_angl')}
+
+    synthetic.write_ice_restart(files['src'], (args.src_ny, args.src_nx), args.ncat, rng)
+    synthetic.write_hgrid(files['src_angl'], (args.src_ny, args.src_nx), rng)
+    synthetic.write_hgrid(files['dst_angl'], (args.dst_ny, args.dst_nx), rng)
+    synthetic.write_mask(files['msk'], (args.dst_ny, args.dst_nx), rng)
+
+    # Nearest neighbour weights (one weight per destination point)
+    na, nb = args.src_ny*args.src_nx, args.dst_ny*args.dst_nx
+    with Dataset(files['wgt'], 'w', format='NETCDF4') as ds:
+        ds.createDimension('n_a', na)
+        ds.createDimension('n_b', nb)
+        ds.createDimension('n_s', nb)
+        ds.createDimension('rank', 2)
+        ds.createVariable('row', 'i4', ('n_s',))[:] = np.arange(1, nb+1)
+        ds.createVariable('col', 'i4', ('n_s',))[:] = rng.integers(1, na+1, nb)
+        ds.createVariable('S', 'f8', ('n_s',))[:] = np.ones(nb)
+        ds.createVariable('src_grid_dims', 'i4', ('rank',))[:] = [args.src_nx, args.src_ny]
+        ds.createVariable('dst_grid_dims', 'i4', ('rank',))[:] = [args.dst_nx, args.dst_ny]
+
+    return files
+
+def run_child(args):
+    """ Run one mode of `run_ice_prep.main` and print its wall time and peak RSS as JSON """
+    import run_ice_prep
+
+    files = json.loads(args.child_files)
+    run_args = Namespace(wgt_file=files['wgt'], src_file=files['src'], src_angl=files['src_angl'],
+                         msk_file=files['msk'], dst_angl=files['dst_angl'], msk_name='mask',
+                         out_file=files['out'], dtype='float64', stream=(args.child == 'stream'),
+                         chunk_rows=args.chunk_rows, backend='numpy', profile=None)
+
+    start = time.perf_counter()
+    run_ice_prep.main(run_args)
+    wall = time.perf_counter() - start
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KiB on Linux
+    print(json.dumps({'mode': args.child, 'wall_s': round(wall, 3), 'max_rss_mib': round(maxrss, 1)}))
+
+def main(args):
+    from remapping import weights
+
+    with tempfile.TemporaryDirectory() as workdir:
+        files = write_inputs(workdir, args)
+        weights.load_weights(files['wgt']) # Compile the weight cache before either run
+        restart_mib = os.path.getsize(files['src']) / 2**20
+
+        results = []
+        for mode in ('full', 'stream'):
+            child_files = dict(files, out=os.path.join(workdir, f"out_{mode}.nc"))
+            cmd = [sys.executable, os.path.abspath(__file__), '--child', mode, '--child_files', json.dumps(child_files),
+                   '--chunk_rows', str(args.chunk_rows)]
+            output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+        # Both modes must write the same output
+        with Dataset(os.path.join(workdir, 'out_full.nc')) as a, Dataset(os.path.join(workdir, 'out_stream.nc')) as b:
+            identical = all(np.array_equal(a[name][:], b[name][:]) for name in a.variables)
+
+    print(f"Source restart:   {args.ncat} x {args.src_ny} x {args.src_nx} ({restart_mib:.0f} MiB)")
+    print(f"Destination grid: {args.dst_ny} x {args.dst_nx}")
+    for result in results:
+        print(f"{result['mode']:6s} peak RSS {result['max_rss_mib']:8.1f} MiB, wall {result['wall_s']:6.2f} s")
+    print(f"Peak RSS ratio (full / stream): {results[0]['max_rss_mib'] / results[1]['max_rss_mib']:.1f}x")
+    print(f"Identical output: {identical}")
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'restart_mib': restart_mib, 'identical': identical, 'runs': results}, f, indent=2)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Compare peak memory of the ice remapping with and without --stream")
+    parser.add_argument("--src_nx", type=int, default=1440, help="Source grid x size (default: mx025)")
+    parser.add_argument("--src_ny", type=int, default=1080, help="Source grid y size (default: mx025)")
+    parser.add_argument("--dst_nx", type=int, default=1280, help="Destination grid x size (default: ARC12-sized)")
+    parser.add_argument("--dst_ny", type=int, default=1080, help="Destination grid y size (default: ARC12-sized)")
+    parser.add_argument("--ncat", type=int, default=5, help="Number of ice categories")
+    parser.add_argument("--chunk_rows", type=int, default=10, help="`--chunk_rows` of the streaming run")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--child", choices=['full', 'stream'], help=argparse.SUPPRESS)
+    parser.add_argument("--child_files", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args)
+    else:
+        main(args)
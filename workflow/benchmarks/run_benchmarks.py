@@ -0,0 +1,295 @@
+"""
+Script Name: run_benchmarks.py
+Description:
+    Benchmark suite for the ocean and ice prep on synthetic inputs (see synthetic.py), so
+    performance can be measured and tracked without the HPC input data. Times the weight loader,
+    `Remapper` (2D scalar, 3D scalar, 3D vector to centers and to edges), eta, vertical
+    interpolation and `run_ice_prep.remap`, and writes the results as JSON. With `--baseline`,
+    the results are compared against an earlier JSON report and slower cases are flagged.
+
+Example:
+    python run_benchmarks.py --size mx025-arc12 --json results.json
+    python run_benchmarks.py --size mx025-arc12 --baseline results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import argparse
+import datetime
+import tempfile
+import subprocess
+import numpy as np
+import scipy
+import netCDF4
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'ocn'))
+sys.path.insert(0, os.path.join(ROOT, 'ice'))
+sys.path.insert(0, ROOT)
+
+import synthetic
+from remapping import weights, rotation
+from modules import Remapper, utilities
+from modules.remapper import _Remapper3DBase
+from modules.manifest import PrepSession
+from modules.vertical import VerticalInterpolator
+
+CASES = ['weights_read', 'weights_cache_build', 'weights_cache_load',
+         'remap_2d_scalar', 'remap_3d_scalar', 'remap_3d_scalar_bilinear', 'remap_vector_center', 'remap_vector_edges',
+         'eta_levels', 'add_eta_script', 'interpolate_vertical', 'vertical_interpolator', 'ice_remap']
+
+##########################
+###       Inputs       ###
+##########################
+
+def write_inputs(workdir, size):
+    """ Write every synthetic input file for `size` (see `synthetic.SIZES`) to `workdir` """
+    rng = np.random.default_rng(0)
+    src, dst, levels = size['src'], size['dst'], size['levels']
+    files = {name: os.path.join(workdir, f"{name}.nc")
+             for name in ('w_h', 'w_bil', 'w_u', 'w_v', 'mom', 'iced', 'src_hgrid', 'dst_hgrid', 'mask')}
+
+    synthetic.write_weights(files['w_h'], src, dst, 'neareststod')
+    synthetic.write_weights(files['w_bil'], src, dst, 'bilinear')
+    synthetic.write_weights(files['w_u'], src, (dst[0], dst[1]+1), 'neareststod', offset=(0.0, -0.5))
+    synthetic.write_weights(files['w_v'], src, (dst[0]+1, dst[1]), 'neareststod', offset=(-0.5, 0.0))
+    synthetic.write_mom_restart(files['mom'], src, levels, rng)
+    synthetic.write_ice_restart(files['iced'], src, 5, rng)
+    synthetic.write_hgrid(files['src_hgrid'], src, rng)
+    synthetic.write_hgrid(files['dst_hgrid'], dst, rng)
+    synthetic.write_mask(files['mask'], dst, rng)
+
+    return files
+
+##########################
+###       Timing       ###
+##########################
+
+def time_case(func, repeat, setup=None):
+    """ Wall times of `repeat` calls of `func(state)`, where `state = setup()` is not timed.
+        Stages of `func` may be timed separately by returning a dict of stage times. """
+    times = []
+    stages = {}
+    for __ in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        result = func(state)
+        times.append(time.perf_counter() - start)
+        if isinstance(result, dict):
+            for stage, t in result.items():
+                stages.setdefault(stage, []).append(t)
+
+    summary = {'first_s': times[0], 'best_s': min(times), 'mean_s': float(np.mean(times))}
+    if stages:
+        summary['stages_best_s'] = {stage: min(t) for stage, t in stages.items()}
+
+    return summary
+
+def clear_operators():
+    """ Drop the in-process operator memo so the next load goes to the cache or weight file """
+    weights._loaded.clear()
+
+def remap_case(files, workdir, var_names, wgt_files, vector=False, add_eta=False):
+    """ Remap and write one field with `Remapper` in a fresh session and output file.
+        Returns the setup (read, weights, masks), remap and write times. """
+    out_file = os.path.join(workdir, 'out.nc')
+    if os.path.exists(out_file):
+        os.remove(out_file)
+
+    times = {}
+    start = time.perf_counter()
+    with PrepSession() as session:
+        variables = [session.read_variable(files['mom'], name) for name in var_names]
+        out_ds = session.open_output(session.read_variable(files['mom'], 'Layer'), 'Layer',
+                                     session.read_variable(files['mom'], 'Time'), 'Time', out_file)
+        kwargs = {}
+        if vector:
+            dst_angle = session.read_variable(files['dst_hgrid'], 'angle_dx')
+            if len(wgt_files) == 1: # Center weights: destination angle at every point
+                dst_angle = rotation.convert_angle_to_subgrid(dst_angle[:], 'center')
+            kwargs = dict(src_angle=session.read_variable(files['src_hgrid'], 'angle_dx'), dst_angle=dst_angle,
+                          src_ang_hgrid=True, dst_ang_hgrid=(len(wgt_files) == 2))
+        remapper = Remapper(*variables, depth_name='Layer', mask_cache=session.masks, add_eta=add_eta, **kwargs)
+
+        t0 = time.perf_counter()
+        remapper.remap_from_file(*[files[w] for w in wgt_files])
+        t1 = time.perf_counter()
+        remapper.write_to_file(out_ds, 'Layer', 'Time', 0, *var_names)
+        out_ds.sync()
+        t2 = time.perf_counter()
+
+    times['remap'] = t1 - t0
+    times['write'] = t2 - t1
+    times['setup'] = t0 - start
+
+    return times
+
+##########################
+###       Cases        ###
+##########################
+
+def run_case(name, files, workdir, size, repeat):
+    """ Time benchmark case `name` """
+    levels = size['levels']
+
+    if name == 'weights_read':
+        return time_case(lambda __: weights.read_esmf_weights(files['w_bil']), repeat)
+
+    elif name == 'weights_cache_build':
+        def setup():
+            clear_operators()
+            os.environ[weights.CACHE_DIR_ENV] = tempfile.mkdtemp(dir=workdir)
+        result = time_case(lambda __: weights.load_weights(files['w_bil']), repeat, setup)
+        os.environ[weights.CACHE_DIR_ENV] = os.path.join(workdir, 'cache')
+        return result
+
+    elif name == 'weights_cache_load':
+        weights.load_weights(files['w_bil']) # Build the cache entry
+        return time_case(lambda __: weights.load_weights(files['w_bil']), repeat, clear_operators)
+
+    elif name == 'remap_2d_scalar':
+        return time_case(lambda __: remap_case(files, workdir, ['sfc'], ['w_h']), repeat)
+
+    elif name == 'remap_3d_scalar':
+        return time_case(lambda __: remap_case(files, workdir, ['Temp'], ['w_h']), repeat)
+
+    elif name == 'remap_3d_scalar_bilinear':
+        return time_case(lambda __: remap_case(files, workdir, ['Temp'], ['w_bil']), repeat)
+
+    elif name == 'remap_vector_center':
+        return time_case(lambda __: remap_case(files, workdir, ['u', 'v'], ['w_h'], vector=True), repeat)
+
+    elif name == 'remap_vector_edges':
+        return time_case(lambda __: remap_case(files, workdir, ['u', 'v'], ['w_u', 'w_v'], vector=True), repeat)
+
+    elif name == 'eta_levels':
+        thk = np.random.default_rng(0).uniform(1, 20, (levels,) + size['dst']).astype('f4')
+        return time_case(lambda __: _Remapper3DBase.eta_levels(thk), repeat)
+
+    elif name == 'add_eta_script':
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('add_eta', os.path.join(ROOT, 'ocn', 'utils', 'add_eta.py'))
+        add_eta = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(add_eta)
+
+        out_file = os.path.join(workdir, 'out.nc')
+        remap_case(files, workdir, ['h'], ['w_h'])
+        os.rename(out_file, os.path.join(workdir, 'thk.nc'))
+        args = argparse.Namespace(file_name=os.path.join(workdir, 'thk.nc'), thickness_variable='h', time_dim='Time')
+        return time_case(lambda __: add_eta.main(args), repeat)
+
+    elif name == 'interpolate_vertical':
+        z_s = 5.0 + 10.0*np.arange(levels)
+        z_d = np.linspace(0, z_s[-1] + 20, levels)
+        v_s = np.random.default_rng(0).standard_normal(size['dst'] + (levels,))
+        return time_case(lambda __: utilities.interpolate_vertical(v_s, z_s, z_d), repeat)
+
+    elif name == 'vertical_interpolator':
+        z_s = 5.0 + 10.0*np.arange(levels)
+        z_d = np.linspace(0, z_s[-1] + 20, levels)
+        v_s = np.random.default_rng(0).standard_normal((levels,) + size['dst']).astype('f4')
+        interpolator = VerticalInterpolator(z_s, z_d)
+        return time_case(lambda __: interpolator(v_s), repeat)
+
+    elif name == 'ice_remap':
+        import xarray as xr
+        import run_ice_prep
+
+        with xr.open_dataset(files['iced']) as ds:
+            ds_in = ds.drop_vars([v for v in run_ice_prep.vars_to_drop if v in ds]).load()
+        return time_case(lambda __: run_ice_prep.remap(ds_in, files['w_h'], np.float64), repeat)
+
+    raise ValueError(f"Unknown benchmark case '{name}'. Must be one of {', '.join(CASES)}")
+
+##########################
+###      Reporting     ###
+##########################
+
+def environment():
+    """ Host and library versions recorded with the results """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'host': socket.gethostname(),
+            'cpus': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'scipy': scipy.__version__, 'netCDF4': netCDF4.__version__, 'commit': commit}
+
+def compare(results, baseline_file, tolerance):
+    """ Print the ratio of each case's best time to the baseline report's. Returns the slower cases. """
+    with open(baseline_file, 'r') as f:
+        baseline = {case['name']: case for case in json.load(f)['results']}
+
+    slower = []
+    print(f"\nCompared with {baseline_file}:")
+    for case in results:
+        if case['name'] not in baseline:
+            continue
+        ratio = case['best_s'] / baseline[case['name']]['best_s']
+        flag = ''
+        if ratio > tolerance:
+            flag = '  <-- slower'
+            slower.append(case['name'])
+        print(f"{case['name']:26s} {ratio:6.2f}x{flag}")
+
+    return slower
+
+def main(args):
+    size = dict(synthetic.SIZES[args.size])
+    if args.levels is not None:
+        size['levels'] = args.levels
+    cases = args.cases or CASES
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='prep_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    os.environ[weights.CACHE_DIR_ENV] = os.path.join(workdir, 'cache')
+
+    start = time.perf_counter()
+    files = write_inputs(workdir, size)
+    print(f"Inputs ({args.size}: {size['src']} -> {size['dst']}, {size['levels']} levels) "
+          f"written to {workdir} in {time.perf_counter() - start:.1f} s")
+
+    results = []
+    for name in cases:
+        clear_operators()
+        result = dict(name=name, repeat=args.repeat, **run_case(name, files, workdir, size, args.repeat))
+        results.append(result)
+
+        stages = ', '.join(f"{stage} {t:.3f}" for stage, t in result.get('stages_best_s', {}).items())
+        print(f"{name:26s} best {result['best_s']:8.3f} s, first {result['first_s']:8.3f} s"
+              + (f" ({stages})" if stages else ''))
+
+    report = {'size': dict(size, name=args.size), 'environment': environment(), 'results': results}
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline is not None and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ocean and ice prep on synthetic inputs")
+    parser.add_argument("--size", default="small", choices=list(synthetic.SIZES),
+                        help="Grid sizes (see synthetic.SIZES). Defaults to 'small'")
+    parser.add_argument("--levels", type=int, help="Number of ocean layers (default: from --size)")
+    parser.add_argument("--cases", nargs='+', choices=CASES, help="Cases to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed repetitions of each case")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare the results against")
+    parser.add_argument("--tolerance", type=float, default=1.2,
+                        help="Best time ratio to the baseline above which a case is flagged as slower (default: 1.2). "
+                             "The script exits with status 1 if any case is slower")
+    parser.add_argument("--workdir", help="Keep the synthetic inputs in this directory (default: a temporary directory)")
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,148 @@
+"""
+Synthetic inputs for the benchmarks, so they run without the HPC input data: ESMF weight files
+(`neareststod` and bilinear-like), MOM6-style `MOM.res.nc` restarts, CICE `iced.*.nc` restarts and
+`ocean_hgrid.nc` supergrid files. Fields are written one level at a time, so the generators
+themselves stay well below the memory of the benchmarked code.
+"""
+
+import numpy as np
+from netCDF4 import Dataset
+
+# NaN placeholder value written over land points (see remapping/batch.py)
+FILL_SENTINEL = 1.2676506e+30
+
+# Grid sizes: source (ny, nx), destination (ny, nx) and number of layers
+SIZES = {
+    'small':       {'src': (270, 360),   'dst': (240, 320),   'levels': 10},
+    'mx025-arc12': {'src': (1080, 1440), 'dst': (1080, 1280), 'levels': 75},
+    'large':       {'src': (1080, 1440), 'dst': (2160, 2560), 'levels': 75},
+}
+
+MOM_FIELDS_3D = ['Temp', 'Salt', 'h', 'u', 'v']
+MOM_FIELDS_2D = ['sfc']
+
+def source_positions(src_shape, dst_shape, offset=(0.0, 0.0)):
+    """ Fractional source (j, i) position of each destination point. Destination points map
+        smoothly onto the northern half of the source grid, like ARC12 on the mx025 tripole. """
+    (nys, nxs), (ny, nx) = src_shape, dst_shape
+    jj, ii = np.meshgrid(np.arange(ny) + offset[0], np.arange(nx) + offset[1], indexing='ij')
+    pos_j = (nys//2) + jj * (nys//2 - 1) / max(ny, 1)
+    pos_i = ii * (nxs - 1) / max(nx, 1)
+
+    return np.clip(pos_j, 0, nys-1).ravel(), np.clip(pos_i, 0, nxs-1).ravel()
+
+def write_weights(fname, src_shape, dst_shape, method='neareststod', offset=(0.0, 0.0)):
+    """ ESMF_RegridWeightGen-format weight file between two logically rectangular grids.
+
+    Parameters:
+        fname (str): Output weight file
+        src_shape, dst_shape (tuple): (ny, nx) of the source and destination grids
+        method (str): 'neareststod' (one weight of 1.0 per destination point) or 'bilinear'
+                      (four weights per destination point from the surrounding source cells)
+        offset (tuple): (j, i) shift of the destination points, e.g. (0, -0.5) for u points
+    """
+    (nys, nxs), (ny, nx) = src_shape, dst_shape
+    na, nb = nys*nxs, ny*nx
+    pos_j, pos_i = source_positions(src_shape, dst_shape, offset)
+
+    if method == 'neareststod':
+        row = np.arange(nb)
+        col = np.rint(pos_j).astype(np.int64) * nxs + np.rint(pos_i).astype(np.int64)
+        S = np.ones(nb)
+    elif method == 'bilinear':
+        j0 = np.minimum(np.floor(pos_j).astype(np.int64), nys-2)
+        i0 = np.minimum(np.floor(pos_i).astype(np.int64), nxs-2)
+        wj, wi = pos_j - j0, pos_i - i0
+        row = np.repeat(np.arange(nb), 4)
+        col = np.stack([j0*nxs + i0, j0*nxs + i0+1, (j0+1)*nxs + i0, (j0+1)*nxs + i0+1], axis=1).ravel()
+        S = np.stack([(1-wj)*(1-wi), (1-wj)*wi, wj*(1-wi), wj*wi], axis=1).ravel()
+    else:
+        raise ValueError(f"Unknown method '{method}'. Must be 'neareststod' or 'bilinear'")
+
+    with Dataset(fname, 'w', format='NETCDF4') as ds:
+        ds.createDimension('n_a', na)
+        ds.createDimension('n_b', nb)
+        ds.createDimension('n_s', len(S))
+        ds.createDimension('src_grid_rank', 2)
+        ds.createDimension('dst_grid_rank', 2)
+        ds.createVariable('row', 'i4', ('n_s',))[:] = row + 1
+        ds.createVariable('col', 'i4', ('n_s',))[:] = col + 1
+        ds.createVariable('S', 'f8', ('n_s',))[:] = S
+        ds.createVariable('frac_a', 'f8', ('n_a',))[:] = 1.0
+        ds.createVariable('frac_b', 'f8', ('n_b',))[:] = 1.0
+        ds.createVariable('src_grid_dims', 'i4', ('src_grid_rank',))[:] = [nxs, nys]
+        ds.createVariable('dst_grid_dims', 'i4', ('dst_grid_rank',))[:] = [nx, ny]
+        ds.title = f"Synthetic {method} weights"
+
+def write_hgrid(fname, shape, rng):
+    """ MOM6 supergrid file (`ocean_hgrid.nc`) with `angle_dx`, `x` and `y` for a (ny, nx) grid """
+    nyp, nxp = 2*shape[0]+1, 2*shape[1]+1
+    with Dataset(fname, 'w', format='NETCDF4') as ds:
+        ds.createDimension('nyp', nyp)
+        ds.createDimension('nxp', nxp)
+        ds.createVariable('angle_dx', 'f8', ('nyp', 'nxp'))[:] = rng.uniform(-30, 30, (nyp, nxp))
+        x = ds.createVariable('x', 'f8', ('nyp', 'nxp'))
+        y = ds.createVariable('y', 'f8', ('nyp', 'nxp'))
+        x.units, y.units = 'degrees_east', 'degrees_north'
+        for j, lat in enumerate(np.linspace(45, 90, nyp)):
+            x[j, :] = np.linspace(0, 360, nxp)
+            y[j, :] = lat
+
+def write_mom_restart(fname, shape, levels, rng):
+    """ MOM6-style restart (`MOM.res.nc`) on a (ny, nx) grid: 3D Temp, Salt, h, u and v on `levels`
+        layers and 2D sfc, with land (deeper than a random bathymetry) set to `FILL_SENTINEL`. """
+    ny, nx = shape
+    bottom = rng.integers(levels//2, levels+1, shape) # First land layer of each column
+    bottom[:ny//20] = 0 # Land band along the southern edge
+
+    with Dataset(fname, 'w', format='NETCDF4') as ds:
+        ds.createDimension('Time', None)
+        ds.createDimension('Layer', levels)
+        ds.createDimension('lath', ny)
+        ds.createDimension('lonh', nx)
+        time = ds.createVariable('Time', 'f8', ('Time',))
+        time.units = 'days since 0001-01-01 00:00:00'
+        time[:] = [0.0]
+        ds.createVariable('Layer', 'f8', ('Layer',))[:] = 5.0 + 10.0*np.arange(levels)
+
+        scale = {'Temp': (2.0, 5.0), 'Salt': (34.0, 1.0), 'h': (10.0, 2.0), 'u': (0.0, 0.2), 'v': (0.0, 0.2)}
+        for name in MOM_FIELDS_3D:
+            var = ds.createVariable(name, 'f8', ('Time', 'Layer', 'lath', 'lonh'))
+            mean, std = scale[name]
+            for k in range(levels):
+                data = mean + std*rng.standard_normal(shape)
+                data[bottom <= k] = FILL_SENTINEL
+                var[0, k] = data
+        for name in MOM_FIELDS_2D:
+            data = rng.standard_normal(shape)
+            data[bottom == 0] = FILL_SENTINEL
+            ds.createVariable(name, 'f8', ('Time', 'lath', 'lonh'))[0] = data
+
+def write_ice_restart(fname, shape, ncat, rng):
+    """ CICE-like restart (`iced.*.nc`) with (ncat, nj, ni) category fields and (nj, ni) fields """
+    fields3d = (['aicen', 'vicen', 'vsnon', 'Tsfcn', 'qsno001'] + [f'qice{l:03d}' for l in range(1, 8)]
+                + [f'sice{l:03d}' for l in range(1, 8)] + ['alvl', 'vlvl'])
+    fields2d = ['uvel', 'vvel', 'coszen', 'scale_factor', 'strocnxT', 'strocnyT', 'iceumask', 'frz_onset']
+    shape = (ncat,) + tuple(shape)
+
+    with Dataset(fname, 'w', format='NETCDF4') as ds:
+        ds.createDimension('ncat', ncat)
+        ds.createDimension('nj', shape[1])
+        ds.createDimension('ni', shape[2])
+        for name in fields3d:
+            if name.startswith('q'):
+                data = -rng.uniform(1e8, 3e8, shape)
+            elif name == 'Tsfcn':
+                data = -rng.uniform(0, 20, shape)
+            else:
+                data = rng.uniform(0, 0.3 if name == 'aicen' else 1, shape)
+            ds.createVariable(name, 'f8', ('ncat', 'nj', 'ni'))[:] = data
+        for name in fields2d:
+            ds.createVariable(name, 'f8', ('nj', 'ni'))[:] = rng.standard_normal(shape[1:])
+
+def write_mask(fname, shape, rng, name='mask'):
+    """ Destination land mask (`ocean_mask.nc`), 1 over ocean """
+    with Dataset(fname, 'w', format='NETCDF4') as ds:
+        ds.createDimension('ny', shape[0])
+        ds.createDimension('nx', shape[1])
+        ds.createVariable(name, 'f8', ('ny', 'nx'))[:] = rng.uniform(size=shape) > 0.2
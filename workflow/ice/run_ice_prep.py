@@ -1,7 +1,24 @@
+import os
+import sys
 import argparse
 import xarray as xr
 import numpy as np
-from scipy.sparse import coo_matrix
+from netCDF4 import Dataset
+
+# Remapping engine (operator loading and cache, batched application, rotation) shared with the ocean prep
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from remapping import weights, rotation, batch, profiling
+
+import thermo
+
+# Source variables that are not carried over to the output
+vars_to_drop = ['fsnow', 'iage', 'alvl', 'vlvl', 'apnd', 'hpnd', 'ipnd', 'dhs', 'ffrac']
+
+# Output variables that are set to zero
+vars_to_reset = ['coszen', 'scale_factor', 'strocnxT', 'strocnyT']
+
+# Vector rotations as `rotation.rotate_vector` grids ('dst': u*cos(a) + v*sin(a), 'src': u*cos(a) - v*sin(a))
+ROTATIONS = {'grid2NS': 'dst', 'NS2grid': 'src'}
 
 def main(args):
     wgt_file = args.wgt_file
@@ -11,201 +28,215 @@ def main(args):
     dst_angl = args.dst_angl
     out_file = args.out_file
     msk_name = args.msk_name
+    dtype    = np.dtype(args.dtype)
+
+    # Optional -- Report the time, bytes moved and peak memory of each stage
+    if args.profile is not None:
+        profiling.enable(args.profile)
+    else:
+        profiling.enable_from_env('run_ice_prep')
 
-    #define some constants
-    saltmax = 3.20
-    nsal    = 0.407
-    msal    = 0.573
-    rhoi    = 917.0
-    rhos    = 330.0
-    cp_ice  = 2106.0
-    cp_ocn  = 4218.0
-    Lvap    = 2.501e6
-    Lsub    = 2.835e6
-    Lfresh  = 3.34e5
-    puny    = 1.0e-3
-    nilyr   = 7
-    ncat    = 5
-
-    # Compute salinity and melting temperature per layer
-    salinz = np.zeros(nilyr, np.double)
-    for l in range(nilyr):
-        zn = (l + 1 - 0.5) / float(nilyr)
-        salinz[l] = (saltmax / 2.0) * (1.0 - np.cos(np.pi * zn**(nsal / (msal + zn))))
-
-    Tmltz = salinz / (-18.48 + (0.01848 * salinz))
+    if args.stream:
+        return main_stream(args)
+
+    Tmltz = thermo.melting_temperature()
 
     # --- Read Source Data ---
 #    print(f"Reading source file: {src_file}")
     ds_in = xr.open_dataset(src_file)
-    vars_to_drop = ['fsnow', 'iage', 'alvl', 'vlvl', 'apnd', 'hpnd', 'ipnd', 'dhs', 'ffrac']
     ds_in = ds_in.drop_vars([v for v in vars_to_drop if v in ds_in])
 
     # --- Rotate vectors (Source Grid -> North-South) ---
 #    print("Rotating vectors to N-S...")
     ang_ds = xr.open_dataset(src_angl)
-    angle = get_centers(ang_ds['angle_dx'])
-    ds_in['uvel'][:], ds_in['vvel'][:] = rotate(ds_in['uvel'][:], ds_in['vvel'][:], angle, 'grid2NS')
+    angle = rotation.convert_angle_to_subgrid(ang_ds['angle_dx'].values, 'center')
+    ds_in['uvel'][:], ds_in['vvel'][:] = rotation.rotate_vector(ds_in['uvel'].values, ds_in['vvel'].values, angle,
+                                                                ROTATIONS['grid2NS'])
 
     # --- Remap variables ---
 #    print(f"Remapping data using weights: {wgt_file}")
-    ds_out = remap(ds_in, wgt_file)
+    ds_out = remap(ds_in, wgt_file, dtype)
 
     # --- Rotate vectors (North-South -> Target Grid) ---
 #    print("Rotating vectors to grid...") 
     ang_ds = xr.open_dataset(dst_angl)
-    angle = get_centers(ang_ds['angle_dx'])
-    ds_out['uvel'][:], ds_out['vvel'][:] = rotate(ds_out['uvel'][:], ds_out['vvel'][:], angle, 'NS2grid')
+    angle = rotation.convert_angle_to_subgrid(ang_ds['angle_dx'].values, 'center')
+    ds_out['uvel'][:], ds_out['vvel'][:] = rotation.rotate_vector(ds_out['uvel'].values, ds_out['vvel'].values, angle,
+                                                                  ROTATIONS['NS2grid'])
 
     # Zero out certain arrays
-    for var in ['coszen', 'scale_factor', 'strocnxT', 'strocnyT']:
+    for var in vars_to_reset:
         if var in ds_out:
             ds_out[var][:] = 0
     
-    # --- Recompute Enthalpies ---
-#    print("Recomputing enthalpies...")
-
-    # Snow  enthalpy
-    ds_out['qsno001'][:] = -rhos * (Lfresh - cp_ice * ds_out['Tsfcn'][:].values)
-
-    # Ice enthalpy:
-    # First go through each layer
-    for l in range(nilyr):
-        var_name = f'qice{l+1:03d}'
-        if var_name in ds_out:
-            q_lyr = ds_out[var_name].values
-            T_lyr = Tmltz[l]
-
-            # Convert enthalpy to temperature (see eq 53: https://cice-consortium-icepack.readthedocs.io/en/icepack1.2.2/science_guide/sg_thermo.html#bitz-and-lipscomb-thermodynamics-ktherm-1)
-            a = cp_ice
-            b = ((cp_ocn - cp_ice) * T_lyr) - (q_lyr / rhoi) - Lfresh
-            c = Lfresh * T_lyr
-            d = np.maximum(b**2 - 4.0*a*c, 0)
-            q2T = (-b - np.sqrt(d) ) / (2.0 * a)
-
-            # Cap temperature to melting temp for each layer
-            q2T_fix = np.where( q2T > T_lyr, T_lyr, q2T)
-
-            # Convert temperature back to enthalpy
-            ds_out[var_name][:] = -rhoi* ( cp_ice*(T_lyr-q2T_fix) + Lfresh*(1-(T_lyr/q2T_fix)) - cp_ocn*T_lyr )
-    
-    # --- Apply Land Mask & Ice Fractions ---
-#    print("Applying masks...")
+    # --- Recompute Enthalpies, Apply Land Mask & Ice Fractions, Correct Snow Temperature ---
+#    print("Applying thermodynamic corrections...")
     ds_kmt = xr.open_dataset(msk_file)
     kmt = np.asarray(ds_kmt[msk_name].values, dtype=float)
 
-    # Set aicen to zero over land and zero out small ice fractions
-    ds_out['aicen'] = xr.where(kmt == 1, ds_out['aicen'], 0)
-    ds_out['aicen'] = xr.where(ds_out['aicen'] > 0.01, ds_out['aicen'], 0)
-
-    vars_to_zero = ['vicen', 'vsnon'] + [f'qice{l+1:03d}' for l in range(nilyr)]
-    for var in vars_to_zero:
-        if var in ds_out:
-            ds_out[var] = xr.where(ds_out['aicen'] > 0, ds_out[var], 0)
-
-    # --- Correct Snow Temperature (using Icepack formulas) ---
-#    print("Correcting snow temperatures...")
-    puny_temp = 1.0E-012
-    rnslyr = 1.0
-    c1 = 1.0
-
-    A = c1 / (rhos * cp_ice)
-    B = Lfresh / cp_ice
-
-    qsno = ds_out['qsno001'][:].values
-    vsnon = ds_out['vsnon'][:].values
-    aicen = ds_out['aicen'][:].values
-    vicen = ds_out['vicen'][:].values
-
-    zTsn = A * qsno + B
-    Tmax = -qsno * puny_temp * rnslyr / (rhos * cp_ice * vsnon + puny_temp)
-    Qmax = rhos * cp_ice * (Tmax - Lfresh / cp_ice)
-
-    newq = np.where(zTsn <= Tmax, qsno, Qmax)
-    newf = np.where(vicen > 0.00001, aicen, 0.0)
-    newf2 = np.where(newf > 1.0, 1.0, newf)
+    # Ice enthalpy layers stacked as (nlyr, ncat, nj, ni), see thermo.py
+    layers = [l for l in range(thermo.nilyr) if f'qice{l+1:03d}' in ds_out]
+    qice = np.stack([ds_out[f'qice{l+1:03d}'].values for l in layers]) if layers else None
 
-    # Fill in snow enthalpy (0) where there is no snow
-    newq2 = np.where(vsnon == 0.0, qsno, newq)
-    
-    ds_out['qsno001'][:] = newq2
-    ds_out['aicen'][:] = newf2
+    with profiling.stage('thermo'):
+        qsno, iceumask = thermo.correct_ice_state(ds_out['aicen'].values, ds_out['vicen'].values, ds_out['vsnon'].values,
+                                                  ds_out['Tsfcn'].values, qice, kmt, Tmltz[layers], backend=args.backend)
 
-    # --- Recompute Ice Fraction Mask ---
-    aice = ds_out['aicen'].sum(dim='ncat')
-    ds_out['iceumask'][:] = xr.where(aice > 0.1, 1.0, 0.0)
+    for k, l in enumerate(layers):
+        ds_out[f'qice{l+1:03d}'][:] = qice[k]
+    ds_out['qsno001'][:] = qsno
+    ds_out['iceumask'][:] = iceumask
 
     # --- Save Output ---
 #    print(f"Writing output to {out_file}...")
 #    ds_out = ds_out.expand_dims('Time')
-    ds_out.to_netcdf(out_file) #, unlimited_dims='Time')
+    with profiling.stage('write') as stage:
+        ds_out.to_netcdf(out_file) #, unlimited_dims='Time')
+        stage.add(written=ds_out.nbytes)
 #    print("Interpolation complete.")
 
-def remap(ds_in, wgt_file):
-    S_mat, dst_dims, nb = unpack(wgt_file)
-
+def main_stream(args):
+    """ Memory-lean version of `main` (`--stream True`) with the same output.
+
+    Instead of materializing every remapped variable and its intermediate copies, the fields
+    needed by the ice fraction and snow corrections (aicen, vicen, vsnon, Tsfcn) are remapped and
+    corrected in place first. The other variables are then read, remapped and corrected
+    `chunk_rows` category layers at a time through preallocated buffers, and each variable is
+    written to the output file as soon as it is complete. Peak memory is bounded by those few
+    fields and one chunk rather than by several copies of the whole restart.
+    """
+    dtype = np.dtype(args.dtype)
+    Tmltz = thermo.melting_temperature()
+
+    S_mat, dst_dims, nb = weights.load_weights(args.wgt_file)
+    S_mat = S_mat.astype(dtype)
     dims = (dst_dims[1], dst_dims[0])
-    N = 1.2676506e+30 # NaN placeholder value
 
-    remapped = {}
+    ds_kmt = xr.open_dataset(args.msk_file)
+    kmt = np.asarray(ds_kmt[args.msk_name].values, dtype=float)
+    src_angle = rotation.convert_angle_to_subgrid(xr.open_dataset(args.src_angl)['angle_dx'].values, 'center')
+    dst_angle = rotation.convert_angle_to_subgrid(xr.open_dataset(args.dst_angl)['angle_dx'].values, 'center')
+
+    with Dataset(args.src_file, 'r') as src, Dataset(args.out_file, 'w', format='NETCDF4') as out:
+        # Same output layout as `remap` + `to_netcdf`: (ncat,) nj, ni in the remap dtype, NaN fill
+        names = [name for name, var in src.variables.items()
+                 if name not in src.dimensions and name not in vars_to_drop]
+        nlevs = {name: (1 if src[name].ndim == 2 else src[name].shape[0]) for name in names}
+        if any(src[name].ndim != 2 for name in names):
+            out.createDimension('ncat', max(nlevs[name] for name in names if src[name].ndim != 2))
+        for dim, size in zip(('nj', 'ni'), dims):
+            out.createDimension(dim, size)
+        for name in names:
+            out_dims = ("nj", "ni") if src[name].ndim == 2 else ("ncat", "nj", "ni")
+            out.createVariable(name, dtype, out_dims, fill_value=np.nan)
+
+        def read(name):
+            """ (nlev, n_a) source layers, with missing values as NaN (as decoded by xarray) """
+            with profiling.stage('read', var=name) as stage:
+                data = src[name][:]
+                if np.ma.isMaskedArray(data):
+                    data = data.filled(np.nan)
+                stage.add(read=data.nbytes)
+            return np.asarray(data).reshape(nlevs[name], -1)
+
+        def write(name, data):
+            with profiling.stage('write', var=name) as stage:
+                data = np.asarray(data).astype(dtype, copy=False)
+                out[name][:] = data.reshape(out[name].shape)
+                stage.add(written=data.nbytes)
+
+        buffer = np.empty((max(args.chunk_rows, max(nlevs.values())), S_mat.shape[1]), dtype=dtype)
+
+        def remap_layers(layers):
+            """ Remap a list of (nlev, n_a) source arrays with one operator application """
+            return batch.apply_stacked(S_mat, layers, buffer=buffer)
+
+        # --- Vectors: rotate to N-S, remap, rotate back to the grid ---
+        with profiling.labels(var='uvel,vvel'):
+            u, v = rotation.rotate_vector(read('uvel'), read('vvel'), src_angle.reshape(1, -1), ROTATIONS['grid2NS'])
+            u, v = remap_layers([u, v])
+            u, v = rotation.rotate_vector(u.reshape(dims), v.reshape(dims), dst_angle, ROTATIONS['NS2grid'])
+        write('uvel', u)
+        write('vvel', v)
+        del u, v
+
+        # --- Ice fractions, volumes and snow enthalpy ---
+        fractions = []
+        for name in ('aicen', 'vicen', 'vsnon', 'Tsfcn'):
+            with profiling.labels(var=name):
+                fractions.append(remap_layers([read(name)])[0].reshape(nlevs[name], *dims))
+        aicen, vicen, vsnon, Tsfcn = fractions
+        del fractions
+        write('Tsfcn', Tsfcn)
+
+        # Ice fraction, volume and snow corrections (see thermo.py)
+        with profiling.stage('thermo', var='aicen,vicen,vsnon'):
+            qsno, ice_free, iceumask = thermo.correct_fractions(aicen, vicen, vsnon, Tsfcn, kmt, backend=args.backend)
+        write('qsno001', qsno)
+        write('aicen', aicen)
+        write('vicen', vicen)
+        write('vsnon', vsnon)
+        if 'iceumask' in names:
+            write('iceumask', iceumask)
+        del aicen, vicen, vsnon, Tsfcn, qsno
+
+        # --- Remaining variables, `chunk_rows` layers at a time ---
+        done = {'uvel', 'vvel', 'aicen', 'vicen', 'vsnon', 'Tsfcn', 'qsno001', 'iceumask'}
+        for name in vars_to_reset:
+            if name in names:
+                write(name, np.zeros(out[name].shape, dtype=dtype))
+                done.add(name)
+
+        chunks, chunk = [], []
+        for name in names:
+            if name in done:
+                continue
+            if chunk and sum(nlevs[other] for other in chunk) + nlevs[name] > args.chunk_rows:
+                chunks.append(chunk)
+                chunk = []
+            chunk.append(name)
+        if chunk:
+            chunks.append(chunk)
+
+        for chunk in chunks:
+            with profiling.labels(var=','.join(chunk)):
+                remapped = remap_layers([read(name) for name in chunk])
+            for name, data in zip(chunk, remapped):
+                if name.startswith('qice') and int(name[4:]) <= thermo.nilyr:
+                    with profiling.stage('thermo', var=name):
+                        thermo.correct_ice_enthalpy(data.reshape(1, -1, *dims), Tmltz[int(name[4:]) - 1:int(name[4:])],
+                                                    ice_free=ice_free, backend=args.backend)
+                write(name, data)
+
+def remap(ds_in, wgt_file, dtype=np.float64):
+    """ Remap every variable of `ds_in` onto the destination grid with a single operator application.
+
+    All variables share one weight matrix, so every 2D field and every category layer of the 3D
+    (ncat, nj, ni) fields is stacked as a row of one (K, n_a) block. The block is remapped with one
+    sparse product (or a gather for nearest neighbour weights), and each variable is a view of its
+    rows of the (K, n_b) result (see `remapping.batch.apply_stacked`).
+    """
+    S_mat, dst_dims, nb = weights.load_weights(wgt_file) # Cached on disk, see remapping/weights.py
+    S_mat = S_mat.astype(dtype) # Weights and remapped data share one dtype
+
+    dims = (dst_dims[1], dst_dims[0])
 
-    for var in ds_in:
-        data_src = np.array(ds_in[var].values[:])
-        shape = len(np.shape(data_src))
+    names = list(ds_in)
+    with profiling.stage('read') as stage:
+        fields = [ds_in[var].values.reshape(1 if ds_in[var].ndim == 2 else ds_in[var].shape[0], -1) for var in names]
+        stage.add(read=sum(data.nbytes for data in fields))
+    data_rmp = batch.apply_stacked(S_mat, fields)
+    del fields
 
-        if shape == 2:
-            data_lvl = np.where(data_src.ravel() == N, 0, data_src.ravel())
-            data_rmp = S_mat.dot(data_lvl).reshape(dims)
-            remapped[var] = xr.DataArray(data_rmp, dims=("nj", "ni"))
+    remapped = {}
+    for var, data in zip(names, data_rmp):
+        if ds_in[var].ndim == 2:
+            remapped[var] = xr.DataArray(data[0].reshape(dims), dims=("nj", "ni"))
         else: # 3D (ncat, nj, ni)
-            ncat = data_src.shape[0]
-            data_rmp = np.zeros((ncat, nb))
-            for d in range(ncat):
-                data_lvl = np.where(data_src[d, :, :].ravel() == N, 0, data_src[d, :, :].ravel())
-                data_rmp[d, :] = S_mat.dot(data_lvl)
-            data_rmp = data_rmp.reshape(ncat, dims[0], dims[1])
-            remapped[var] = xr.DataArray(data_rmp, dims=("ncat", "nj", "ni"))
+            remapped[var] = xr.DataArray(data.reshape(len(data), dims[0], dims[1]), dims=("ncat", "nj", "ni"))
 
     return xr.Dataset(remapped)
 
-def unpack(wgt_file):
-    wgt_ds = xr.open_dataset(wgt_file)
-    na = wgt_ds['n_a'].shape[0]
-    nb = wgt_ds['n_b'].shape[0]
-    col = np.array(wgt_ds['col'].values[:]) - 1
-    row = np.array(wgt_ds['row'].values[:]) - 1
-    S = np.array(wgt_ds['S'].values[:])
-
-    # Sparse matrix mapping source to target grid
-    S_mat = coo_matrix((S, (row, col)), shape=(nb, na))
-    dst_dims = wgt_ds['dst_grid_dims'].values[:]
-
-    return S_mat, dst_dims, nb
-
-def rotate(u, v, ang, rot):
-    u = np.asarray(u)
-    v = np.asarray(v)
-    ang = np.asarray(ang)
-
-    if (np.min(ang) < -1 * np.pi) or (np.max(ang) > np.pi):
-        ang = np.radians(ang)
-
-    cosa = np.cos(ang)
-    sina = np.sin(ang)
-
-    if rot == 'grid2NS':
-        rotated_u = u*cosa + v*sina
-        rotated_v = v*cosa - u*sina
-    elif rot == 'NS2grid':
-        rotated_u = u*cosa - v*sina
-        rotated_v = v*cosa + u*sina
-
-    return rotated_u, rotated_v
-
-def get_centers(data):
-    # Extracts cell centers from supergrid
-    return data[1::2, 1::2]
-
 if __name__=="__main__":
     parser = argparse.ArgumentParser(description="Remap ice initial conditions from tripole to latlon grid")
     parser.add_argument("--wgt_file", required=True,  help="Path to weight file")
@@ -215,6 +246,20 @@ if __name__=="__main__":
     parser.add_argument("--dst_angl", required=True,  help="Path to destination grid angle file")
     parser.add_argument("--msk_name", default="mask", help="Mask variable name. Defaults to 'mask'")
     parser.add_argument("--out_file", required=True,  help="Path to output file")
+    parser.add_argument("--dtype", default="float64", choices=["float32", "float64"],
+                        help="Data type for the weights and remapped fields. Defaults to 'float64' (the restart precision)")
+    parser.add_argument("--stream", default=False, type=bool,
+                        help="Specify as True to process the restart in chunks of category layers with in-place updates, "
+                             "writing each variable as it is completed (bounded memory, same output)")
+    parser.add_argument("--backend", default="numpy", choices=thermo.BACKENDS,
+                        help="Backend of the ice thermodynamic corrections (see thermo.py). 'numba' requires numba. "
+                             "Defaults to 'numpy'")
+    parser.add_argument("--chunk_rows", default=10, type=int,
+                        help="Number of category layers (2D fields) remapped together with --stream. Defaults to 10")
+    parser.add_argument("--profile", default=None,
+                        help="Report file for the wall time, bytes read/written and peak memory of each stage "
+                             "(read, mask, apply, rotate, thermo, write). Written as CSV if the name ends in .csv, "
+                             "JSON otherwise. Defaults to a report in $PREP_PROFILE_DIR, if set (see remapping/profiling.py)")
 
     args = parser.parse_args()
 
@@ -67,6 +67,8 @@ else
         log_info "-> Weight file already exists, skipping generation: ${ICE_WGT_FILE}"
     fi
     
+    # Set ICE_STREAM=True to process the restart in chunks with bounded memory (same output)
+    # Set ICE_THERMO_BACKEND=numba to run the ice thermodynamic corrections compiled (requires numba)
     log_info "-> Running interpolation script..."
     # ================================= #
     # Interpolate Ice Data              #
@@ -77,7 +79,9 @@ else
         --src_angl "${ICE_SRC_ANG_FILE}" \
         --msk_file "${ICE_DST_FILE}" \
         --dst_angl "${ICE_DST_ANG_FILE}" \
-        --out_file "${OUT_FILE}" || error_exit "run_ice_prep.py crashed."
+        --out_file "${OUT_FILE}" \
+        ${ICE_STREAM:+--stream "${ICE_STREAM}"} \
+        ${ICE_THERMO_BACKEND:+--backend "${ICE_THERMO_BACKEND}"} || error_exit "run_ice_prep.py crashed."
 fi
 
 log_info "-> Ice prep complete."
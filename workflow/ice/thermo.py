@@ -0,0 +1,276 @@
+"""
+Ice thermodynamic corrections applied to a remapped CICE restart (see run_ice_prep.py).
+
+    1. Ice layer enthalpies are converted to temperature, capped at the layer melting
+       temperature and converted back (Bitz and Lipscomb thermodynamics, ktherm=1).
+    2. Ice fractions are zeroed over land and below 1%, and ice volume, snow volume and
+       ice enthalpy are zeroed where there is no ice left.
+    3. Snow enthalpy is recomputed from the surface temperature and limited to the Icepack
+       maximum snow temperature.
+    4. Ice fractions are zeroed without ice volume and capped at 1, and the ice mask is
+       recomputed from the total ice fraction.
+
+All corrections are applied in place, to all categories and layers at once. The 'numpy'
+backend works on the stacked (nlyr, ncat, nj, ni) layers with a fixed number of work arrays,
+and gives the same values as the original layer-by-layer expressions. The optional 'numba'
+backend does the same per grid point in one parallel compiled loop, without work arrays,
+and agrees to rounding (it computes in double precision throughout).
+"""
+
+import numpy as np
+
+#define some constants
+saltmax = 3.20
+nsal    = 0.407
+msal    = 0.573
+rhoi    = 917.0
+rhos    = 330.0
+cp_ice  = 2106.0
+cp_ocn  = 4218.0
+Lvap    = 2.501e6
+Lsub    = 2.835e6
+Lfresh  = 3.34e5
+puny    = 1.0e-3
+nilyr   = 7
+ncat    = 5
+
+# Snow temperature limit (Icepack)
+puny_temp = 1.0E-012
+rnslyr    = 1.0
+c1        = 1.0
+
+# Ice fraction thresholds
+aice_min   = 0.01     # Smaller ice fractions are removed
+vice_min   = 0.00001  # Ice fractions without more ice volume are removed
+iceumask_min = 0.1    # Total ice fraction of the ice mask
+
+BACKENDS = ['numpy', 'numba']
+
+def melting_temperature():
+    """ Melting temperature of each ice layer, from the Icepack salinity profile """
+    # Compute salinity and melting temperature per layer
+    salinz = np.zeros(nilyr, np.double)
+    for l in range(nilyr):
+        zn = (l + 1 - 0.5) / float(nilyr)
+        salinz[l] = (saltmax / 2.0) * (1.0 - np.cos(np.pi * zn**(nsal / (msal + zn))))
+
+    return salinz / (-18.48 + (0.01848 * salinz))
+
+##########################
+###      Kernels       ###
+##########################
+
+def correct_ice_state(aicen, vicen, vsnon, Tsfcn, qice, kmt, Tmltz, backend='numpy'):
+    """ Apply all corrections to a remapped restart, in place.
+
+    Parameters:
+        aicen, vicen, vsnon (ndarray): (ncat, nj, ni) ice fraction, ice volume and snow volume
+        Tsfcn (ndarray): (ncat, nj, ni) surface temperature (not modified)
+        qice (ndarray): (nlyr, ncat, nj, ni) stacked ice layer enthalpies, or None
+        kmt (ndarray): (nj, ni) destination land mask, 1 over ocean
+        Tmltz (ndarray): (nlyr,) melting temperature of each `qice` layer
+        backend (str): 'numpy' or 'numba'
+
+    Returns:
+        qsno (ndarray): (ncat, nj, ni) snow enthalpy, in the dtype of `Tsfcn`
+        iceumask (ndarray): (nj, ni) ice mask
+    """
+    if qice is not None:
+        correct_ice_enthalpy(qice, Tmltz, backend=backend)
+    qsno, ice_free, iceumask = correct_fractions(aicen, vicen, vsnon, Tsfcn, kmt, backend=backend)
+    if qice is not None:
+        qice[:, ice_free] = 0
+
+    return qsno, iceumask
+
+def correct_ice_enthalpy(qice, Tmltz, ice_free=None, backend='numpy'):
+    """ Cap the temperature of ice layer enthalpies at the layer melting temperature, in place.
+
+    Parameters:
+        qice (ndarray): (nlyr, ...) stacked ice layer enthalpies
+        Tmltz (ndarray): (nlyr,) melting temperature of each layer
+        ice_free (ndarray): Optional boolean mask broadcast over the layers, where enthalpy is zeroed
+        backend (str): 'numpy' or 'numba'
+    """
+    Tmltz = np.asarray(Tmltz, dtype=np.float64)
+    if backend == 'numba':
+        q = qice.reshape(len(Tmltz), -1)
+        free = np.zeros(0, dtype=np.bool_) if ice_free is None else np.broadcast_to(ice_free, qice.shape[1:]).ravel()
+        numba_kernels()['ice_enthalpy'](q, Tmltz, free)
+        if not np.may_share_memory(q, qice):
+            qice[...] = q.reshape(qice.shape)
+        return
+    elif backend != 'numpy':
+        raise ValueError(f"Unknown backend '{backend}'. Must be one of {', '.join(BACKENDS)}")
+
+    # Melting temperature broadcast over each layer
+    T = Tmltz.reshape((-1,) + (1,)*(qice.ndim-1))
+    work = np.empty(qice.shape, dtype=np.result_type(qice, T))
+    q2T = np.empty_like(work)
+    a = cp_ice
+    c = Lfresh * T
+
+    # Convert enthalpy to temperature (see eq 53: https://cice-consortium-icepack.readthedocs.io/en/icepack1.2.2/science_guide/sg_thermo.html#bitz-and-lipscomb-thermodynamics-ktherm-1)
+    # b = ((cp_ocn - cp_ice) * T) - (q / rhoi) - Lfresh (in q2T), d = max(b**2 - 4ac, 0) (in work)
+    np.divide(qice, rhoi, out=q2T)
+    np.subtract((cp_ocn - cp_ice) * T, q2T, out=q2T)
+    q2T -= Lfresh
+    np.square(q2T, out=work)
+    work -= 4.0*a*c
+    np.maximum(work, 0, out=work)
+    np.sqrt(work, out=work)
+    np.negative(q2T, out=q2T)
+    q2T -= work
+    q2T /= (2.0 * a)
+
+    # Cap temperature to melting temp for each layer
+    np.copyto(q2T, np.broadcast_to(T, q2T.shape), where=(q2T > T))
+
+    # Convert temperature back to enthalpy: -rhoi * (cp_ice*(T-q2T) + Lfresh*(1-(T/q2T)) - cp_ocn*T)
+    np.subtract(T, q2T, out=work)
+    work *= cp_ice
+    np.divide(T, q2T, out=q2T)
+    np.subtract(1, q2T, out=q2T)
+    q2T *= Lfresh
+    work += q2T
+    work -= cp_ocn*T
+    work *= -rhoi
+    np.copyto(qice, work, casting='unsafe')
+
+    if ice_free is not None:
+        qice[:, ice_free] = 0
+
+def correct_fractions(aicen, vicen, vsnon, Tsfcn, kmt, backend='numpy'):
+    """ Ice fraction, volume and snow corrections (steps 2 to 4), in place.
+
+    Parameters:
+        aicen, vicen, vsnon, Tsfcn, kmt, backend: As for `correct_ice_state`
+
+    Returns:
+        qsno (ndarray): (ncat, nj, ni) snow enthalpy, in the dtype of `Tsfcn`
+        ice_free (ndarray): (ncat, nj, ni) points without ice before the volume check,
+                            where ice enthalpies must be zeroed
+        iceumask (ndarray): (nj, ni) ice mask
+    """
+    qsno = np.empty_like(Tsfcn)
+    ice_free = np.empty(aicen.shape, dtype=bool)
+    iceumask = np.empty(aicen.shape[1:], dtype=aicen.dtype)
+
+    if backend == 'numba':
+        npts = int(np.prod(aicen.shape[1:]))
+        arrays = [np.ascontiguousarray(x).reshape(-1, npts) for x in (aicen, vicen, vsnon, Tsfcn)]
+        numba_kernels()['fractions'](*arrays, np.ascontiguousarray(kmt, dtype=np.float64).ravel(),
+                                     qsno.reshape(-1, npts), ice_free.reshape(-1, npts), iceumask.reshape(npts))
+        for x, y in zip((aicen, vicen, vsnon), arrays[:3]):
+            if not np.may_share_memory(x, y):
+                x[...] = y.reshape(x.shape)
+        return qsno, ice_free, iceumask
+    elif backend != 'numpy':
+        raise ValueError(f"Unknown backend '{backend}'. Must be one of {', '.join(BACKENDS)}")
+
+    # Set aicen to zero over land and zero out small ice fractions
+    aicen[:, kmt != 1] = 0
+    aicen[~(aicen > aice_min)] = 0
+    np.logical_not(aicen > 0, out=ice_free)
+    vicen[ice_free] = 0
+    vsnon[ice_free] = 0
+
+    # Snow enthalpy from the surface temperature
+    np.multiply(Tsfcn, cp_ice, out=qsno)
+    np.subtract(Lfresh, qsno, out=qsno)
+    np.multiply(qsno, -rhos, out=qsno)
+
+    # Correct Snow Temperature (using Icepack formulas)
+    A = c1 / (rhos * cp_ice)
+    B = Lfresh / cp_ice
+
+    zTsn = qsno * A
+    zTsn += B
+    Tmax = np.negative(qsno)
+    Tmax *= puny_temp
+    Tmax *= rnslyr
+    Qmax = vsnon * (rhos * cp_ice)
+    Qmax += puny_temp
+    Tmax /= Qmax
+    np.subtract(Tmax, Lfresh / cp_ice, out=Qmax)
+    Qmax *= rhos * cp_ice
+
+    # Keep the snow enthalpy below the limit, and where there is no snow
+    replace = ~((zTsn <= Tmax) | (vsnon == 0.0))
+    qsno[replace] = Qmax[replace]
+    del zTsn, Tmax, Qmax, replace
+
+    # Remove ice fractions without ice volume, and recompute the ice mask
+    aicen[~(vicen > vice_min)] = 0
+    aicen[aicen > 1.0] = 1.0
+    np.copyto(iceumask, np.where(aicen.sum(axis=0) > iceumask_min, 1.0, 0.0), casting='unsafe')
+
+    return qsno, ice_free, iceumask
+
+##########################
+###   Numba Backend    ###
+##########################
+
+_numba_kernels = {}
+
+def numba_kernels():
+    """ Compile the numba kernels on first use """
+    if _numba_kernels:
+        return _numba_kernels
+
+    try:
+        import numba
+    except ImportError:
+        raise ImportError("numba is required for the 'numba' ice thermodynamics backend. Use 'numpy' instead.")
+
+    @numba.njit(parallel=True, cache=True)
+    def ice_enthalpy(q, Tmltz, free):
+        nlyr, npts = q.shape
+        for p in numba.prange(npts):
+            for l in range(nlyr):
+                if free.size > 0 and free[p]:
+                    q[l, p] = 0
+                    continue
+                T = Tmltz[l]
+                b = ((cp_ocn - cp_ice) * T) - (q[l, p] / rhoi) - Lfresh
+                d = max(b*b - 4.0*cp_ice*(Lfresh * T), 0.0)
+                q2T = (-b - np.sqrt(d)) / (2.0 * cp_ice)
+                if q2T > T:
+                    q2T = T
+                q[l, p] = -rhoi * (cp_ice*(T - q2T) + Lfresh*(1 - (T/q2T)) - cp_ocn*T)
+
+    @numba.njit(parallel=True, cache=True)
+    def fractions(aicen, vicen, vsnon, Tsfcn, kmt, qsno, ice_free, iceumask):
+        ncat, npts = aicen.shape
+        A = c1 / (rhos * cp_ice)
+        B = Lfresh / cp_ice
+        for p in numba.prange(npts):
+            aice = 0.0
+            for n in range(ncat):
+                a = aicen[n, p]
+                if not (kmt[p] == 1) or not (a > aice_min):
+                    a = 0.0
+                free = not (a > 0)
+                ice_free[n, p] = free
+                if free:
+                    vicen[n, p] = 0
+                    vsnon[n, p] = 0
+
+                q = -rhos * (Lfresh - cp_ice * Tsfcn[n, p])
+                zTsn = A * q + B
+                Tmax = -q * puny_temp * rnslyr / (rhos * cp_ice * vsnon[n, p] + puny_temp)
+                if not (zTsn <= Tmax or vsnon[n, p] == 0.0):
+                    q = rhos * cp_ice * (Tmax - Lfresh / cp_ice)
+                qsno[n, p] = q
+
+                if not (vicen[n, p] > vice_min):
+                    a = 0.0
+                if a > 1.0:
+                    a = 1.0
+                aicen[n, p] = a
+                aice += aicen[n, p]
+            iceumask[p] = 1.0 if aice > iceumask_min else 0.0
+
+    _numba_kernels.update(ice_enthalpy=ice_enthalpy, fractions=fractions)
+
+    return _numba_kernels
@@ -1,2 +1,8 @@
+import os
+import sys
+
+# Shared remapping engine (workflow/remapping), also used by the ice prep
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
 from .remapper import Remapper 
 from .utilities import *
@@ -0,0 +1,204 @@
+import os
+import json
+from netCDF4 import Dataset
+
+from remapping import weights
+from remapping.files import file_key, is_current
+
+from . import utilities
+from . import masks
+from . import obc
+from . import vertical
+
+# Arguments every manifest task must provide (directly or through "defaults")
+REQUIRED_KEYS = ['var_name', 'wgt_file', 'vrt_file', 'src_file', 'out_file', 'dz_name', 'time_name']
+
+# Arguments that accept a list of values (nargs='+' on the command line)
+LIST_KEYS = ['var_name', 'wgt_file', 'src_file', 'dst_file', 'var_name_out']
+
+# Arguments that may differ between OBC segment tasks remapped together (see `group_segments`)
+TARGET_KEYS = ['wgt_file', 'out_file', 'dz_name_out', 'var_name_out', 'dst_ang_file',
+               'obc_segment', 'obc_hgrid_file', 'obc_compact_dz']
+
+##########################
+###  Manifest Parsing  ###
+##########################
+
+def load_manifest(fname):
+    """ Read a remapping manifest (JSON, or YAML if PyYAML is available).
+
+    The manifest lists the fields to remap in a single process. Each task uses the same
+    keys as the `run_ocn_prep.py` command line arguments; keys under "defaults" apply to
+    every task unless the task overrides them:
+
+        {
+          "defaults": {"vrt_file": "MOM.res.nc", "dz_name": "Layer", "time_name": "Time"},
+          "tasks": [
+            {"var_name": ["u", "v"], "src_file": ["MOM.res.nc", "MOM.res_1.nc"],
+             "wgt_file": ["gefs2arctic_u.nc", "gefs2arctic_v.nc"], "out_file": "mom6_IC.nc"},
+            {"var_name": "Temp", "src_file": "MOM.res.nc", "wgt_file": "gefs2arctic_h.nc",
+             "out_file": "mom6_IC.nc"}
+          ]
+        }
+
+    Parameters:
+        fname (str): Path to the manifest file.
+
+    Returns:
+        list of dict: One dictionary of arguments per task, with defaults applied.
+    """
+    with open(fname, 'r') as f:
+        if os.path.splitext(fname)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(f"PyYAML is required to read manifest '{fname}'. Use JSON instead.")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    defaults = manifest.get('defaults', {})
+    tasks = []
+
+    for i, entry in enumerate(manifest.get('tasks', [])):
+        task = dict(defaults, **entry)
+
+        missing = [key for key in REQUIRED_KEYS if task.get(key) is None]
+        if missing:
+            raise ValueError(f"Manifest '{fname}' task {i} is missing required keys: {', '.join(missing)}")
+
+        for key in LIST_KEYS:
+            if isinstance(task.get(key), str):
+                task[key] = [task[key]]
+
+        tasks.append(task)
+
+    return tasks
+
+def group_segments(tasks):
+    """ Group OBC segment tasks that remap the same field onto different segments.
+
+    Tasks in a group only differ in their `TARGET_KEYS`, so they can share one stacked operator
+    and a single read of the source (see `remapper._RemapperBase`). Other tasks form their own group.
+
+    Parameters:
+        tasks (list of dict): Tasks from `load_manifest`
+
+    Returns:
+        list of list of dict: Groups of tasks, in order of first appearance
+    """
+    groups = {}
+    for i, task in enumerate(tasks):
+        if task.get('obc_segment') is None or len(task['wgt_file']) != 1:
+            key = i
+        else:
+            key = json.dumps({k: v for k, v in task.items() if k not in TARGET_KEYS}, sort_keys=True)
+        groups.setdefault(key, []).append(task)
+
+    return list(groups.values())
+
+##########################
+###   Shared Session   ###
+##########################
+
+class SessionCache:
+    """ Derived data shared by every field of a session: the land masks of the source grids
+        (`masks`), vertical interpolators and grid angles. A long-lived process (see
+        remap_service.py) keeps one cache warm for all of its sessions. Entries are keyed by
+        the `remapping.files.file_key` of their files, so changed files are read again. """
+    def __init__(self):
+        self.masks = masks.MaskCache()
+        self.vertical = {}
+        self.angles = {}
+
+    def next_request(self, max_idle=None):
+        """ Start a new request of a long-lived process: forget the entries (and loaded weight
+            operators, see `weights.drop_stale`) of files that changed since the last request,
+            and with `max_idle`, the masks of files not used in the last `max_idle` requests """
+        self.masks.generation += 1
+        self.drop_stale(max_idle)
+        weights.drop_stale()
+
+    def drop_stale(self, max_idle=None):
+        """ Forget entries built from files that changed or were removed (see `MaskCache.drop_stale`) """
+        self.masks.drop_stale(max_idle)
+        for cache in (self.vertical, self.angles):
+            for key in list(cache):
+                if not all(is_current(part) for part in key if isinstance(part, tuple)):
+                    del cache[key]
+
+class PrepSession:
+    """ Keeps input datasets and output files open so they are shared by every field
+        remapped in one process, together with the land masks of their source grids,
+        vertical interpolators and grid angles (`cache`, see `SessionCache`).
+        Weight operators are shared through `weights.load_weights`. """
+    partition = None # Rank of a row-partitioned remap, see `parallel.ParallelSession`
+
+    def __init__(self, cache=None):
+        self._inputs = {}
+        self._outputs = {}
+        self._segments = {}
+        self.cache = cache or SessionCache()
+        self.masks = self.cache.masks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_variable(self, fname, vname):
+        """ Same as `utilities.read_variable_from_file`, but reuses open datasets """
+        if fname not in self._inputs:
+            self._inputs[fname] = Dataset(fname, 'r')
+        ds = self._inputs[fname]
+
+        if vname not in ds.variables:
+            raise KeyError(f"Variable '{vname}' not found in file '{fname}'.")
+        else:
+            return ds[vname]
+
+    def vertical_interpolator(self, src_vrt_file, src_vrt_name, dst_vrt_file, dst_vrt_name):
+        """ Interpolator between two sets of vertical levels, computed once per session (cache) """
+        key = (file_key(src_vrt_file), src_vrt_name, file_key(dst_vrt_file), dst_vrt_name)
+        if key not in self.cache.vertical:
+            z_s = self.read_variable(src_vrt_file, src_vrt_name)[:]
+            z_d = self.read_variable(dst_vrt_file, dst_vrt_name)[:]
+            self.cache.vertical[key] = vertical.VerticalInterpolator(z_s, z_d)
+
+        return self.cache.vertical[key]
+
+    def read_angle(self, fname, vname):
+        """ Grid angles, read once per session (cache) """
+        key = (file_key(fname), vname)
+        if key not in self.cache.angles:
+            self.cache.angles[key] = self.read_variable(fname, vname)[:]
+
+        return self.cache.angles[key]
+
+    def open_output(self, dz, dz_name_out, times, time_name_out, out_file, write_dz=True):
+        """ Initialize the output file on first use and return a handle kept open for later fields """
+        if out_file not in self._outputs:
+            utilities.initialize_file(dz, dz_name_out, times, time_name_out, out_file, write_dz=write_dz)
+            self._outputs[out_file] = Dataset(out_file, 'a', format='NETCDF4')
+
+        return self._outputs[out_file]
+
+    def add_segment(self, out_file, segment, dz, dz_name_out, time_name_out, hgrid_file, compact_dz=False):
+        """ Register an open output file as MOM6 OBC segment `segment` (settings of the first
+            field written to the file apply), see `finalize_segments` """
+        self._segments.setdefault(out_file, (segment, dz, dz_name_out, time_name_out, hgrid_file, compact_dz))
+
+    def finalize_segments(self):
+        """ Write the OBC segment layout (see `obc.finalize_segment`) of every registered
+            output file, once all of its fields have been remapped. """
+        for out_file, segment_args in self._segments.items():
+            obc.finalize_segment(self._outputs[out_file], *segment_args)
+        self._segments.clear()
+
+    def close(self):
+        for ds in list(self._outputs.values()) + list(self._inputs.values()):
+            if ds.isopen():
+                ds.close()
+        self._inputs.clear()
+        self._outputs.clear()
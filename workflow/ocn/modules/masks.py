@@ -0,0 +1,137 @@
+import os
+import numpy as np
+
+from remapping.batch import FILL_SENTINEL
+from remapping.files import file_key, is_current
+
+def fill_value(var):
+    """ Fill value marking land points of a source variable.
+
+    Parameters:
+        var (netCDF4.Variable): Source variable
+
+    Returns:
+        float: The `_FillValue` attribute, else `missing_value`, else `FILL_SENTINEL`
+    """
+    for attr in ('_FillValue', 'missing_value'):
+        if attr in var.ncattrs():
+            return np.asarray(var.getncattr(attr)).ravel()[0]
+
+    return FILL_SENTINEL
+
+def is_fill(data, fill):
+    """ Fill points of `data`: equal to `fill` (NaN if `fill` is NaN) or to `FILL_SENTINEL`, which
+        land points may hold even when the file declares a different fill value.
+
+    Parameters:
+        data (ndarray): Source values
+        fill (float): Fill value of the source variable (see `fill_value`)
+
+    Returns:
+        ndarray: Boolean array of the shape of `data`
+    """
+    fill = np.asarray(fill, dtype=data.dtype)
+    sentinel = np.asarray(FILL_SENTINEL, dtype=data.dtype)
+    is_fill = np.isnan(data) if np.isnan(fill) else (data == fill)
+    if fill != sentinel:
+        is_fill |= (data == sentinel)
+
+    return is_fill
+
+class MaskCache:
+    """ Land/fill masks shared by every field remapped on the same source grid.
+
+    A mask is built once per grid and level, from the first field read there, by comparing
+    with the field's fill value and `FILL_SENTINEL` (see `is_fill`). It is stored as packed bits over the
+    source points read by the operator (see `weights.RemapOperator.windowed`). Fields from the
+    same file with the same horizontal dimensions, fill value and source window share masks,
+    so they are assumed to have the same land points.
+
+    Optionally, row scales that renormalize the weights by the unmasked weight sum are also
+    cached per operator and level, so coastal destination points are not biased towards zero.
+
+    A cache kept by a long-lived process (see remap_service.py) is pruned with `drop_stale`.
+    """
+    def __init__(self):
+        self._masks = {}
+        self._scales = {}
+        self._files = {} # `remapping.files.file_key` of each source file with masks, when first masked
+        self._used = {} # Generation each source file was last masked in
+        self.generation = 0
+
+    @staticmethod
+    def grid_key(var, S_mat):
+        """ Key identifying the source points and fill value of `var` as read by `S_mat` """
+        window = None if S_mat.window is None else tuple(S_mat.window.slabs)
+        fill = float(fill_value(var))
+        fill = 'nan' if np.isnan(fill) else fill # NaN never compares equal, so it would never match
+        return (os.path.realpath(var.group().filepath()), var.ndim, var.dimensions[-2:], fill, window)
+
+    def mask_levels(self, var, S_mat, levels, data_src):
+        """ Zero the fill points of a block of source levels in place.
+
+        Parameters:
+            var (netCDF4.Variable): Variable the block was read from
+            S_mat (weights.RemapOperator): Operator the block was read for
+            levels (sequence of int): Level index of each row of `data_src`
+            data_src (ndarray): (K, n_a) source block from `S_mat.read_source`
+
+        Returns:
+            ndarray: (K, n_a) boolean mask of the fill points
+        """
+        key = self.grid_key(var, S_mat)
+        if key not in self._masks:
+            self._files.setdefault(key[0], file_key(key[0]))
+        self._used[key[0]] = self.generation
+        masks = self._masks.setdefault(key, {})
+        npts = data_src.shape[-1]
+        fill = fill_value(var)
+
+        mask = np.empty(data_src.shape, dtype=bool)
+        for k, level in enumerate(levels):
+            if level not in masks:
+                masks[level] = np.packbits(is_fill(data_src[k], fill))
+            mask[k] = np.unpackbits(masks[level], count=npts).view(bool)
+
+        data_src[mask] = 0
+
+        return mask
+
+    def renormalize(self, var, S_mat, levels, mask, data_interp):
+        """ Rescale remapped levels in place by (total weight / unmasked weight) of each destination row.
+
+        Parameters:
+            var, S_mat, levels: As for `mask_levels`
+            mask (ndarray): (K, n_a) mask returned by `mask_levels`
+            data_interp (ndarray): (K, n_b) remapped block
+        """
+        if S_mat.is_gather: # A single weight per row is either fully masked or unchanged
+            return
+
+        key = self.grid_key(var, S_mat)
+        for k, level in enumerate(levels):
+            if (S_mat, key, level) not in self._scales:
+                valid = np.stack([np.ones(mask.shape[-1], dtype=bool), ~mask[k]]).astype(S_mat.dtype)
+                total, unmasked = S_mat.apply(valid)
+                scale = np.divide(total, unmasked, out=np.ones_like(total), where=unmasked > 0)
+                self._scales[(S_mat, key, level)] = scale
+            data_interp[k] *= self._scales[(S_mat, key, level)]
+
+    def drop_stale(self, max_idle=None):
+        """ Forget the masks (and scales) of source files that changed or were removed since they
+            were masked, and with `max_idle`, of files not masked in the last `max_idle` generations.
+
+        Parameters:
+            max_idle (int): Number of generations (e.g., service requests, which advance
+                            `generation`) to keep the masks of unused files for
+        """
+        stale = {path for path, key in self._files.items()
+                 if (not is_current(key)) or
+                    (max_idle is not None and self.generation - self._used[path] > max_idle)}
+        if not stale:
+            return
+
+        self._masks = {key: masks for key, masks in self._masks.items() if key[0] not in stale}
+        self._scales = {key: scale for key, scale in self._scales.items() if key[1][0] not in stale}
+        for path in stale:
+            del self._files[path], self._used[path]
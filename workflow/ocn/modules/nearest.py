@@ -0,0 +1,158 @@
+import numpy as np
+from netCDF4 import Dataset
+from scipy.spatial import cKDTree
+
+# In-process memo of KD-trees, keyed by source grid file, so every destination grid
+# generated in one session queries the same tree
+_trees = {}
+
+##########################
+###   Grid Utilities   ###
+##########################
+
+def unit_vectors(lat, lon):
+    """ 3D Cartesian coordinates on the unit sphere of (lat, lon) points in degrees.
+
+    Parameters:
+        lat, lon (ndarray): Latitudes and longitudes in degrees
+
+    Returns:
+        ndarray: (npts, 3) coordinates. Chord distances between them order points the
+                 same way as great circle distances.
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64).ravel())
+    lon = np.radians(np.asarray(lon, dtype=np.float64).ravel())
+    coslat = np.cos(lat)
+
+    return np.stack((coslat*np.cos(lon), coslat*np.sin(lon), np.sin(lat)), axis=-1)
+
+def to_degrees(var):
+    """ Values of a SCRIP coordinate variable in degrees """
+    data = np.asarray(var[:], dtype=np.float64)
+    if 'rad' in getattr(var, 'units', 'degrees').lower():
+        data = np.degrees(data)
+
+    return data
+
+def read_scrip_source(src_file):
+    """ Read the cell centers and mask of a SCRIP source grid (e.g., Ct.mx025_SCRIP_masked.nc).
+
+    Returns:
+        lat, lon (ndarray): (n_a,) cell center coordinates in degrees
+        imask (ndarray): (n_a,) grid_imask, 0 for masked (land) cells
+        src_dims (list): ESMF (nx, ny) grid dimensions (SCRIP `grid_dims`)
+    """
+    with Dataset(src_file, 'r') as ds:
+        lat = to_degrees(ds['grid_center_lat'])
+        lon = to_degrees(ds['grid_center_lon'])
+        if 'grid_imask' in ds.variables:
+            imask = np.asarray(ds['grid_imask'][:]).ravel()
+        else:
+            imask = np.ones(lat.size, dtype=np.int32)
+        src_dims = [int(d) for d in ds['grid_dims'][:]]
+
+    return lat.ravel(), lon.ravel(), imask, src_dims
+
+def find_coordinate(ds, direction):
+    """ Name of the latitude ('north') or longitude ('east') variable of a destination grid file.
+
+    Variables are identified by their units (e.g., 'degrees_north', 'degree_east') or
+    standard_name rather than by name, since the subgrid files written by make_subgrids.py
+    store latitude in 'x'.
+    """
+    standard_name = {'north': 'latitude', 'east': 'longitude'}[direction]
+    for name, var in ds.variables.items():
+        if direction in getattr(var, 'units', '').lower() or getattr(var, 'standard_name', '') == standard_name:
+            return name
+
+    raise KeyError(f"No variable with '{direction}' units in '{ds.filepath()}'")
+
+def read_destination(dst_file):
+    """ Read the destination points of a grid file (ocean_mask.nc, subgrid or hgrid files).
+
+    Returns:
+        lat, lon (ndarray): (ny, nx) coordinates in degrees
+    """
+    with Dataset(dst_file, 'r') as ds:
+        lat = np.asarray(ds[find_coordinate(ds, 'north')][:], dtype=np.float64)
+        lon = np.asarray(ds[find_coordinate(ds, 'east')][:], dtype=np.float64)
+
+    if lat.ndim == 1 and lon.ndim == 1: # Rectilinear grid
+        lon, lat = np.meshgrid(lon, lat)
+
+    return lat, lon
+
+##########################
+###  Nearest Neighbour ###
+##########################
+
+def source_tree(src_file):
+    """ KD-tree over the unmasked cell centers of a SCRIP source grid, built once per session.
+
+    Returns:
+        tree (scipy.spatial.cKDTree): Tree over the unmasked source points
+        src_index (ndarray): Source grid index of each tree point
+        n_a (int): Number of source grid points
+        src_dims (list): ESMF (nx, ny) source grid dimensions
+    """
+    if src_file not in _trees:
+        lat, lon, imask, src_dims = read_scrip_source(src_file)
+        src_index = np.flatnonzero(imask != 0).astype(np.int32)
+        tree = cKDTree(unit_vectors(lat[src_index], lon[src_index]))
+        _trees[src_file] = (tree, src_index, lat.size, src_dims)
+
+    return _trees[src_file]
+
+def nearest_weights(src_file, dst_file, workers=-1):
+    """ Nearest unmasked source point of every destination point, equivalent to
+        `ESMF_RegridWeightGen -m neareststod --dst_loc center`.
+
+    Parameters:
+        src_file (str): SCRIP source grid file
+        dst_file (str): Destination grid file
+        workers (int): Number of threads for the KD-tree query (-1 uses all cores)
+
+    Returns:
+        col (ndarray): (n_b,) 0-based source index for each destination point
+        meta (dict): n_a, n_b, src_grid_dims and dst_grid_dims, as for `weights.read_esmf_weights`
+    """
+    tree, src_index, na, src_dims = source_tree(src_file)
+    lat, lon = read_destination(dst_file)
+
+    __, nearest = tree.query(unit_vectors(lat, lon), k=1, workers=workers)
+    col = src_index[nearest]
+
+    ny, nx = lat.shape
+    meta = {'n_a': na, 'n_b': lat.size, 'src_grid_dims': src_dims, 'dst_grid_dims': [nx, ny]}
+
+    return col, meta
+
+def write_weights(wgt_file, col, meta, src_file=None, dst_file=None):
+    """ Write nearest neighbour weights in the ESMF_RegridWeightGen weight file format """
+    nb = meta['n_b']
+
+    with Dataset(wgt_file, 'w', format='NETCDF4') as ds:
+        ds.title = "ESMF Offline Regridding Weight Generator"
+        ds.map_method = "Nearest source to destination"
+        ds.normalization = "none"
+        if src_file is not None:
+            ds.domain_a = src_file
+        if dst_file is not None:
+            ds.domain_b = dst_file
+
+        ds.createDimension('n_a', meta['n_a'])
+        ds.createDimension('n_b', nb)
+        ds.createDimension('n_s', nb)
+        ds.createDimension('src_grid_rank', len(meta['src_grid_dims']))
+        ds.createDimension('dst_grid_rank', len(meta['dst_grid_dims']))
+
+        ds.createVariable('src_grid_dims', 'i4', ('src_grid_rank',))[:] = meta['src_grid_dims']
+        ds.createVariable('dst_grid_dims', 'i4', ('dst_grid_rank',))[:] = meta['dst_grid_dims']
+        ds.createVariable('row', 'i4', ('n_s',))[:] = np.arange(1, nb+1, dtype=np.int32)
+        ds.createVariable('col', 'i4', ('n_s',))[:] = np.asarray(col, dtype=np.int32) + 1 # 1-based
+        ds.createVariable('S', 'f8', ('n_s',))[:] = np.ones(nb)
+        ds.createVariable('frac_b', 'f8', ('n_b',))[:] = np.ones(nb)
+
+        frac_a = np.zeros(meta['n_a'])
+        frac_a[np.unique(col)] = 1.0
+        ds.createVariable('frac_a', 'f8', ('n_a',))[:] = frac_a
@@ -0,0 +1,79 @@
+import numpy as np
+from netCDF4 import Dataset
+
+# Direction of each MOM6 open boundary segment (ocean_hgrid_NNN.nc strips).
+# Segments 001/002 run along x (one row), 003/004 run along y (one column).
+SEGMENT_AXIS = {'001': 'x', '002': 'x', '003': 'y', '004': 'y'}
+
+##########################
+###   Segment Layout   ###
+##########################
+
+def segment_names(segment):
+    """ Names of the (nz, ny, nx) dimensions of a MOM6 OBC segment, e.g. `nz_segment_001` """
+    return tuple(f"{dim}_segment_{segment}" for dim in ('nz', 'ny', 'nx'))
+
+def segment_fields(ds, segment):
+    """ Field names (e.g., 'temp' for `temp_segment_001`) of the remapped segment variables in `ds` """
+    suffix = f"_segment_{segment}"
+    return [name[:-len(suffix)] for name in ds.variables
+            if name.endswith(suffix) and not name.startswith(('dz_', 'lon_', 'lat_'))]
+
+def finalize_segment(ds, segment, dz, dz_name_out, time_name_out, hgrid_file, compact_dz=False):
+    """ Convert a remapped boundary file into the MOM6 OBC segment layout, in place.
+
+    Renames the remapped (yh, xh) and vertical dimensions to the segment dimensions, writes a
+    `dz_<field>_segment_NNN` layer thickness for every `<field>_segment_NNN` variable, and adds
+    `lon_segment_NNN` / `lat_segment_NNN` from the segment's supergrid strip. This replaces the
+    ncrename / ncap2 / ncks post-processing, which rewrote the whole file at every step.
+
+    Parameters:
+        ds (netCDF4.Dataset): Boundary file open in append mode, with `<field>_segment_NNN` variables
+        segment (str): Segment number, e.g. '001'
+        dz (ndarray): Layer thicknesses broadcast into the dz fields
+        dz_name_out (str): Name of the vertical dimension the variables were written with
+        time_name_out (str): Name of the time dimension
+        hgrid_file (str): Supergrid file of the segment (ocean_hgrid_NNN.nc)
+        compact_dz (bool): Compress the dz fields. They are constant in the horizontal, so each
+                           (ny, nx) slab is stored in a few bytes instead of in full.
+    """
+    if segment not in SEGMENT_AXIS:
+        raise ValueError(f"Unknown OBC segment '{segment}'. Must be one of {', '.join(SEGMENT_AXIS)}")
+
+    nz, ny, nx = segment_names(segment)
+
+    for old, new in ((dz_name_out, nz), ('yh', ny), ('xh', nx)):
+        if old != new and old in ds.dimensions and new not in ds.dimensions:
+            ds.renameDimension(old, new)
+
+    # Layer thickness for each field, in the same precision as the remapped fields
+    dz = np.asarray(dz[:], dtype='f4')
+    dims = (time_name_out, nz, ny, nx)
+    shape = tuple(len(ds.dimensions[dim]) for dim in dims)
+    for field in segment_fields(ds, segment):
+        name = f"dz_{field}_segment_{segment}"
+        if name not in ds.variables:
+            if compact_dz:
+                ds.createVariable(name, 'f4', dims, zlib=True, complevel=1, chunksizes=(1,) + shape[1:])
+            else:
+                ds.createVariable(name, 'f4', dims)
+        ds.variables[name][:] = np.broadcast_to(dz[np.newaxis, :, np.newaxis, np.newaxis], shape)
+
+    # Segment coordinates along the boundary
+    with Dataset(hgrid_file, 'r') as hgrid:
+        if SEGMENT_AXIS[segment] == 'x':
+            coords, dim = {'lon': hgrid['x'][0,:], 'lat': hgrid['y'][0,:]}, nx
+        else:
+            coords, dim = {'lon': hgrid['x'][:,0], 'lat': hgrid['y'][:,0]}, ny
+        units = {'lon': getattr(hgrid['x'], 'units', None), 'lat': getattr(hgrid['y'], 'units', None)}
+
+    for coord, data in coords.items():
+        if len(data) != len(ds.dimensions[dim]):
+            raise ValueError(f"Segment {segment}: {len(data)} points in '{hgrid_file}' but "
+                             f"{len(ds.dimensions[dim])} along {dim}.")
+        name = f"{coord}_segment_{segment}"
+        if name not in ds.variables:
+            var = ds.createVariable(name, data.dtype, (dim,))
+            if units[coord] is not None:
+                var.units = units[coord]
+        ds.variables[name][:] = data
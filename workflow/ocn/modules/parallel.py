@@ -0,0 +1,210 @@
+"""
+Row-partitioned parallel remapping.
+
+Every rank (a local process, or an MPI rank) remaps a contiguous band of the destination rows of
+each field: its operator only keeps those rows (`weights.RemapOperator.take_rows`), so each rank
+reads only the matching source window and holds only its share of the output. Each rank then
+writes its own hyperslab of the output variables. The output files are netCDF-4/HDF5 files, which
+cannot be open for writing in several processes, so ranks take turns (in rank order) opening the
+output files, writing their rows and closing them again (see `Partition.turn`). The first rank
+initializes the output files and creates the variables, and the other ranks follow its decision.
+"""
+
+import traceback
+import multiprocessing
+import multiprocessing.connection
+from contextlib import contextmanager
+from netCDF4 import Dataset
+
+from remapping import profiling
+from . import utilities
+from . import obc
+from .manifest import PrepSession
+
+##########################
+###   Communicators    ###
+##########################
+
+class LocalComm:
+    """ Messages and barrier between local processes started by `run_local` """
+    def __init__(self, rank, size, queues, barrier):
+        self.rank = rank
+        self.size = size
+        self._queues = queues # One incoming queue per rank
+        self._barrier = barrier
+
+    def send(self, obj, dest):
+        self._queues[dest].put(obj)
+
+    def recv(self, source):
+        return self._queues[self.rank].get() # Messages only ever come from one rank (see `Partition.turn`)
+
+    def barrier(self):
+        self._barrier.wait()
+
+class MPIComm:
+    """ Messages and barrier between MPI ranks (requires mpi4py) """
+    def __init__(self):
+        try:
+            from mpi4py import MPI
+        except ImportError:
+            raise ImportError("mpi4py is required to remap with MPI ranks. Use local processes instead.")
+
+        self.comm = MPI.COMM_WORLD
+        self.rank = self.comm.Get_rank()
+        self.size = self.comm.Get_size()
+
+    def send(self, obj, dest):
+        self.comm.send(obj, dest=dest)
+
+    def recv(self, source):
+        return self.comm.recv(source=source)
+
+    def barrier(self):
+        self.comm.Barrier()
+
+##########################
+###     Partition      ###
+##########################
+
+class Partition:
+    """ Rank `comm.rank` of `comm.size` in a row-partitioned remap (see module docstring) """
+    def __init__(self, comm):
+        self.comm = comm
+        self.rank = comm.rank
+        self.size = comm.size
+        self._turns = 0
+        self._created = None # Variables created by the first rank in the current turn
+
+    def band(self, ny):
+        """ (j0, j1) destination rows of this rank out of `ny`, in balanced contiguous bands.
+            Ranks beyond `ny` (e.g., on an OBC segment one row wide) get no rows. """
+        nrows, extra = divmod(ny, self.size)
+        j0 = self.rank*nrows + min(self.rank, extra)
+
+        return j0, j0 + nrows + (self.rank < extra)
+
+    def barrier(self):
+        self.comm.barrier()
+
+    @contextmanager
+    def turn(self):
+        """ Exclusive access to the output files, passed from rank to rank in order (a token ring).
+            Every rank must take the same number of turns. """
+        if self.rank > 0:
+            self._created = self.comm.recv(self.rank - 1)
+        elif self._turns > 0 and self.size > 1: # Wait for the last rank to finish the previous turn
+            self.comm.recv(self.size - 1)
+        if self.rank == 0:
+            self._created = {}
+
+        try:
+            yield
+        finally:
+            self._turns += 1
+            if self.size > 1:
+                self.comm.send(self._created, (self.rank + 1) % self.size)
+
+    def variable(self, ds, var_name_out, create):
+        """ Output variable to write in the current turn: the first rank gets it from `create`
+            (see `remapper._RemapperBase.output_variable`), which may return None to leave an
+            existing variable unchanged. The other ranks follow the first rank. """
+        key = (ds.filepath(), var_name_out)
+        if self.rank == 0:
+            var = create()
+            self._created[key] = var is not None
+            return var
+
+        return ds.variables[var_name_out] if self._created[key] else None
+
+    def finish(self):
+        """ Collect the token of the last turn, so no message is left pending """
+        if self.rank == 0 and self._turns > 0 and self.size > 1:
+            self.comm.recv(self.size - 1)
+        self._turns = 0
+
+class ParallelSession(PrepSession):
+    """ `PrepSession` of one rank of a row-partitioned remap. Output files are initialized by the
+        first rank, and only opened by the remappers during their turns (see `Partition.turn`). """
+    def __init__(self, partition, cache=None):
+        super().__init__(cache)
+        self.partition = partition
+
+    def open_output(self, dz, dz_name_out, times, time_name_out, out_file, write_dz=True):
+        """ Initialize the output file on first use (on the first rank) and return its path """
+        if out_file not in self._outputs:
+            if self.partition.rank == 0:
+                utilities.initialize_file(dz, dz_name_out, times, time_name_out, out_file, write_dz=write_dz)
+            self._outputs[out_file] = out_file
+            self.partition.barrier()
+
+        return out_file
+
+    def finalize_segments(self):
+        """ Write the OBC segment layouts on the first rank, once every rank has written its rows """
+        self.partition.finish()
+        self.partition.barrier()
+        if self.partition.rank == 0:
+            for out_file, segment_args in self._segments.items():
+                with Dataset(out_file, 'a') as ds:
+                    obc.finalize_segment(ds, *segment_args)
+        self._segments.clear()
+        self.partition.barrier()
+
+    def close(self):
+        for ds in self._inputs.values():
+            if ds.isopen():
+                ds.close()
+        self._inputs.clear()
+        self._outputs.clear()
+
+##########################
+###      Drivers       ###
+##########################
+
+def _run_rank(rank, size, queues, barrier, target, args):
+    partition = Partition(LocalComm(rank, size, queues, barrier))
+    profiling.set_rank(rank)
+    try:
+        target(partition, *args)
+    finally:
+        profiling.write_report() # Forked processes exit without atexit handlers
+
+def run_local(nprocs, target, *args):
+    """ Run `target(partition, *args)` on `nprocs` forked local processes, one per rank.
+
+    If a rank fails, the other ranks are terminated (they may be waiting on it) and a
+    RuntimeError is raised.
+    """
+    ctx = multiprocessing.get_context('fork')
+    queues = [ctx.Queue() for rank in range(nprocs)]
+    barrier = ctx.Barrier(nprocs)
+    procs = [ctx.Process(target=_run_rank, args=(rank, nprocs, queues, barrier, target, args))
+             for rank in range(nprocs)]
+    for proc in procs:
+        proc.start()
+
+    running = list(procs)
+    while running:
+        for sentinel in multiprocessing.connection.wait([proc.sentinel for proc in running]):
+            proc = next(proc for proc in running if proc.sentinel == sentinel)
+            proc.join()
+            running.remove(proc)
+            if proc.exitcode != 0:
+                for other in running:
+                    other.terminate()
+                raise RuntimeError(f"Remapping rank {procs.index(proc)} of {nprocs} failed (exit code {proc.exitcode}).")
+
+def run_mpi(target, *args):
+    """ Run `target(partition, *args)` on this MPI rank (e.g., launched with srun/mpirun) """
+    partition = Partition(MPIComm())
+    if partition.size > 1:
+        profiling.set_rank(partition.rank)
+
+    try:
+        target(partition, *args)
+    except BaseException:
+        if partition.size > 1: # The other ranks may be waiting on this one
+            traceback.print_exc()
+            partition.comm.comm.Abort(1)
+        raise
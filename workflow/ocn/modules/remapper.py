@@ -1,16 +1,42 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import threading
 import numpy as np
 import netCDF4 as nc
 from netCDF4 import Dataset
-from scipy.sparse import coo_matrix
+
+from remapping import weights, rotation, batch, profiling
+from . import masks
+from . import utilities
+
+# Data type of output variables. Also the default compute dtype, so remapping never
+# carries more precision than is written out.
+OUTPUT_DTYPE = 'f4'
+
+# Interface height output of `add_eta` (see `_Remapper3DBase.eta_levels`)
+ETA_NAME = 'eta'
+ETA_DIM = 'zp'
 
 ###########################
 ### Base Remapper Class ###
 ###########################
 
 class Remapper:
-    def __new__(cls, *args, depth_name = None, src_angle = None, dst_angle = None, src_ang_hgrid = False, dst_ang_hgrid = False):
-        """ Determine data type based on number of input dimensions and instantiate accordingly """
+    def __new__(cls, *args, depth_name = None, src_angle = None, dst_angle = None, src_ang_hgrid = False, dst_ang_hgrid = False,
+                fused_vector = False, dtype = None, mask_cache = None, renormalize = False, vertical = None,
+                add_eta = False, partition = None):
+        """ Determine data type based on number of input dimensions and instantiate accordingly.
+
+        Source data and weights are cast to `dtype` before remapping (defaults to `OUTPUT_DTYPE`).
+        Fill values are masked in the source dtype, before the cast, using `mask_cache` (a
+        `masks.MaskCache` shared by fields on the same grid) or a new cache for this field.
+        With `renormalize`, scalar fields are rescaled by the unmasked weight sum of each point.
+        3D fields remapped in memory are then interpolated onto new levels with `vertical`
+        (a `vertical.VerticalInterpolator`), if given. With `add_eta`, a 3D layer thickness field
+        is written together with its interface heights (`ETA_NAME`). With a `partition`
+        (`parallel.Partition`), only the rank's band of destination rows is remapped and written.
+        """
         if (len(args)<1 or len(args)>3):
             raise ValueError("Must provide either 1 (scalar) or 2 (vectore) netCDF4 variables")
 
@@ -42,29 +68,64 @@ class Remapper:
                 instance = _Remapper2DScalar(args)
         else:
             if ndepths>1:
-                instance = _Remapper3DVector(args, ndepths, src_angle, dst_angle, src_ang_hgrid, dst_ang_hgrid)
+                instance = _Remapper3DVector(args, ndepths, src_angle, dst_angle, src_ang_hgrid, dst_ang_hgrid, fused_vector)
             else:
                 raise ValueError("Vector interpolation only implemented for 3D data")
 
+        instance.dtype = np.dtype(OUTPUT_DTYPE if dtype is None else dtype)
+        instance.masks = masks.MaskCache() if mask_cache is None else mask_cache
+        instance.renormalize = renormalize
+        instance.vertical = vertical
+
+        if add_eta and not isinstance(instance, _Remapper3DScalar):
+            raise ValueError("`add_eta` requires a 3D scalar layer thickness field")
+        instance.add_eta = add_eta
+        instance.partition = partition
+        instance.bands = None
+
         return instance
 
     @staticmethod
     def unpack_weights(wgt_file):
-        """ Unpacks weight file generated by ESMF_RegridWeightGen """
-        wgt_grid = Dataset(wgt_file, 'r')
-        na = len(wgt_grid.dimensions['n_a'])
-        nb = len(wgt_grid.dimensions['n_b'])
-        col = np.array(wgt_grid.variables['col'][:])-1 # Convert to 0-base order
-        row = np.array(wgt_grid.variables['row'][:])-1
-        S = np.array(wgt_grid.variables['S'][:])
-        S_mat = coo_matrix((S, (row, col)), shape=(nb, na))
-
-        dst_dims = wgt_grid.variables['dst_grid_dims']
-    
-        return S_mat, dst_dims, nb
+        """ Unpacks weight file generated by ESMF_RegridWeightGen into a `weights.RemapOperator`.
+            Compiled operators are cached on disk and shared with the ice prep (see `remapping.weights`). """
+        return weights.load_weights(wgt_file)
+
+    @staticmethod
+    def stack_weights(wgt_files):
+        """ Unpacks one or more weight files sharing a source grid into a single (stacked) operator.
+
+        Returns:
+            S_mat (weights.RemapOperator): Operator for all destination grids
+            dims (list of tuple): (ny, nx) of each destination grid
+            offsets (list of int): Row offset of each destination grid in `S_mat` (plus the total)
+        """
+        S_mats = [Remapper.unpack_weights(wgts)[0] for wgts in wgt_files]
+        dims = [(int(S.dst_dims[1]), int(S.dst_dims[0])) for S in S_mats] # Dims are flipped
+
+        if len(S_mats) == 1:
+            return S_mats[0], dims, [0, S_mats[0].shape[0]]
+
+        S_mat, offsets = weights.stack_operators(S_mats)
+
+        return S_mat, dims, offsets
+
+    @staticmethod
+    def split_targets(data_interp, dims, offsets):
+        """ Split (K, n_b) stacked remapped rows into a (K, ny, nx) array per destination grid """
+        nlev = data_interp.shape[0]
+        return [data_interp[:, offsets[i]:offsets[i+1]].reshape((nlev,) + dims[i]) for i in range(len(dims))]
+
+    # Remaps a stack of K source levels in a single operation (see `remapping.batch`)
+    apply_weights = staticmethod(batch.apply_weights)
 
 
 class _RemapperBase(ABC):
+    """ Scalar fields accept several weight files with the same source grid (e.g., the four
+        OBC segments). They are stacked into one operator so each source level is read and
+        remapped once, and each destination grid (target) is written to its own output file. """
+    ntargets = 1
+
     @abstractmethod
     def remap_from_file(self, wgt_file) -> np.ndarray:
         pass
@@ -73,6 +134,278 @@ class _RemapperBase(ABC):
     def write_to_file(self, out_file, var_name_out) -> None:
         pass
 
+    @abstractmethod
+    def output_dims(self, dz_name_out, time_name_out) -> list:
+        """ Output dimension names of each remapped output variable """
+        pass
+
+    def output_targets(self, out_file, dz_name_out, time_name_out, var_name_out):
+        """ Output file, variable name and dimension names of each remapped output.
+
+        Parameters:
+            out_file (str, netCDF4.Dataset or list): Output file, or one per target
+            dz_name_out (str or list): Vertical dimension name, or one per target
+            time_name_out (str): Time dimension name
+            var_name_out (list of str): Output variable names of all targets, in order
+
+        Returns:
+            list of tuple: (out_file, var_name_out, dim_names) per output variable
+        """
+        out_files = out_file if isinstance(out_file, (list, tuple)) else [out_file]*self.ntargets
+        dz_names = dz_name_out if isinstance(dz_name_out, (list, tuple)) else [dz_name_out]*self.ntargets
+        per_target = len(var_name_out) // self.ntargets
+
+        return [(out_files[k // per_target], name, self.output_dims(dz_names[k // per_target], time_name_out)[k])
+                for k, name in enumerate(var_name_out)]
+
+    def restrict_rows(self, S_mat, dims, offsets):
+        """ With a `partition`, restrict a (stacked) operator to the rank's band of destination
+            rows of each target (see `parallel.Partition.band`), before it is windowed, so that
+            only the source window of those rows is read.
+
+        Parameters:
+            S_mat, dims, offsets: Operator, (ny, nx) of each target and row offsets, as from `Remapper.stack_weights`
+
+        Returns:
+            S_mat, dims, offsets: The same for the rank's rows. `bands` is set to the (j0, j1, ny)
+                                  rows of each target.
+        """
+        if self.partition is None:
+            return S_mat, dims, offsets
+
+        self.bands = [self.partition.band(ny) + (ny,) for ny, nx in dims]
+        S_mat = S_mat.take_rows([(offsets[i] + j0*nx, offsets[i] + j1*nx)
+                                 for i, ((j0, j1, ny), (__, nx)) in enumerate(zip(self.bands, dims))])
+        dims = [(j1 - j0, nx) for (j0, j1, ny), (__, nx) in zip(self.bands, dims)]
+        offsets = np.concatenate(([0], np.cumsum([ny*nx for ny, nx in dims]))).tolist()
+
+        return S_mat, dims, offsets
+
+    def output_rows(self, k, noutputs, shape):
+        """ Rows written by this rank and full (ny, nx) shape of output variable `k` of `noutputs`,
+            with remapped horizontal `shape` """
+        if self.bands is None:
+            return slice(None), tuple(shape)
+
+        j0, j1, ny = self.bands[k // (noutputs // len(self.bands))]
+        return slice(j0, j1), (ny, shape[-1])
+
+    def write_turn(self):
+        """ Context of one write to the output files: with a `partition`, ranks take turns """
+        return nullcontext() if self.partition is None else self.partition.turn()
+
+    def target_variable(self, ds, var_name_out, dim_names, shape, forecast_iter):
+        """ `output_variable` of the rank. The first rank creates it, the other ranks follow its decision. """
+        if self.partition is None:
+            return self.output_variable(ds, var_name_out, dim_names, shape, forecast_iter)
+
+        return self.partition.variable(ds, var_name_out,
+                                       lambda: self.output_variable(ds, var_name_out, dim_names, shape, forecast_iter))
+
+    @staticmethod
+    def output_variable(ds, var_name_out, dim_names, shape, forecast_iter):
+        """ Get the output variable to write timestep `forecast_iter` into.
+
+        On the first timestep, creates the horizontal dimensions and the variable. Returns None if the
+        variable already exists on the first timestep, in which case it is left unchanged.
+
+        Parameters:
+            ds (netCDF4.Dataset): Output dataset open for appending
+            var_name_out (str): Output variable name
+            dim_names (tuple): Output dimension names, ending with the (y, x) dimensions
+            shape (tuple): (ny, nx) size of the horizontal dimensions
+            forecast_iter (int): Output timestep
+        """
+        if (forecast_iter == 0): # First timestep
+            if var_name_out in ds.variables:
+                return None
+            for dim_name, dim_len in zip(dim_names[-2:], shape):
+                if dim_name not in ds.dimensions:
+                    ds.createDimension(dim_name, dim_len)
+            return ds.createVariable(var_name_out, OUTPUT_DTYPE, dim_names, fill_value=1.e+20)
+        else: # Append subsequent timesteps
+            return ds.variables[var_name_out]
+
+class _Remapper3DBase(_RemapperBase):
+    """ Common depth-block logic for the 3D classes.
+
+    Subclasses implement `setup` (load weights), `read_levels` (read a range of depth levels),
+    `compute_levels` (remap them) and `output_dims` (output dimension names). The full volume can
+    then either be remapped in memory (`remap_from_file` + `write_to_file`), or streamed to the
+    output file in blocks of depth levels (`stream_to_file`), which bounds peak memory by the block size.
+    """
+    @abstractmethod
+    def setup(self, *wgt_file) -> None:
+        pass
+
+    @abstractmethod
+    def read_levels(self, d0, d1) -> tuple:
+        """ Returns a tuple with the (d1-d0, n_a) source data per input variable """
+        pass
+
+    @abstractmethod
+    def compute_levels(self, *data_src) -> list:
+        """ Returns a list with one (nlev, ny, nx) array per output variable """
+        pass
+
+    def remap_levels(self, d0, d1):
+        with profiling.labels(block=(d0, d1)):
+            return self.compute_levels(*self.read_levels(d0, d1))
+
+    def remap_from_file(self, *wgt_file):
+        """ Remap all depth levels in memory, then onto the destination levels if required """
+        self.setup(*wgt_file)
+        remapped = self.remap_levels(0, self.ndepths)
+        if self.vertical is not None:
+            with profiling.stage('vertical'):
+                remapped = [self.vertical(data, axis=0) for data in remapped]
+        self.remapped = [data[np.newaxis] for data in remapped]
+
+    def write_to_file(self, out_file, dz_name_out, time_name_out, forecast_iter, *var_name_out):
+        if self.remapped is None:
+            raise ValueError(f"No remapped data to write out.")
+
+        remapped = self.remapped if isinstance(self.remapped, list) else [self.remapped]
+        targets = self.output_targets(out_file, dz_name_out, time_name_out, var_name_out)
+
+        with self.write_turn(), utilities.open_outputs([target[0] for target in targets]) as datasets:
+            for k, (ds, (__, name, dims), data) in enumerate(zip(datasets, targets, remapped)):
+                rows, shape = self.output_rows(k, len(targets), data.shape[-2:])
+                var = self.target_variable(ds, name, dims, shape, forecast_iter)
+                if var is not None and data.size:
+                    with profiling.stage('write', var=name) as stage:
+                        var[forecast_iter,:,rows,:] = data[0,:,:,:]
+                        stage.add(written=data[0].size*var.dtype.itemsize)
+
+                if self.add_eta:
+                    eta_var = self.output_eta(ds, dims, data.shape[-3:-2] + shape, forecast_iter)
+                    if eta_var is not None and data.size:
+                        with profiling.stage('eta', var=ETA_NAME) as stage:
+                            eta_var[forecast_iter,:,rows,:] = self.eta_levels(data[0])[0]
+                            stage.add(written=(data[0].shape[0]+1)*data[0][0].size*eta_var.dtype.itemsize)
+
+    @staticmethod
+    def eta_levels(thk, top=None):
+        """ Interface heights of a block of layer thicknesses, as previously computed by utils/add_eta.py:
+            eta[0] = thk[0] and eta[k+1] = eta[k] - thk[k], as a single vectorized accumulation.
+
+        Parameters:
+            thk (ndarray): (nlev, ny, nx) layer thicknesses, in the order of the depth levels
+            top (ndarray): (ny, nx) interface height above the block, None for the first block
+
+        Returns:
+            eta (ndarray): (nlev+1, ny, nx) heights of the first block, (nlev, ny, nx) below the
+                           first interface otherwise
+            bottom (ndarray): (ny, nx) lowest interface height, the `top` of the next block
+        """
+        # Accumulate in double precision from the thicknesses as written to the output file
+        thk = np.asarray(thk, dtype=OUTPUT_DTYPE).astype(np.float64)
+        first = thk[:1] if top is None else top[np.newaxis]
+        eta = np.subtract.accumulate(np.concatenate((first, thk)), axis=0)
+
+        return (eta if top is None else eta[1:]), eta[-1]
+
+    def output_eta(self, ds, dims, shape, forecast_iter):
+        """ Interface height output variable of a (nlev, ny, nx) thickness variable with `dims` """
+        if ETA_DIM not in ds.dimensions:
+            ds.createDimension(ETA_DIM, shape[0] + 1)
+
+        return self.target_variable(ds, ETA_NAME, (dims[0], ETA_DIM) + tuple(dims[-2:]), shape[-2:], forecast_iter)
+
+    def stream_to_file(self, wgt_file, out_file, dz_name_out, time_name_out, forecast_iter, var_name_out, block_size,
+                       prefetch=False):
+        """ Remap `block_size` depth levels at a time, writing each block straight into its
+            output hyperslab, so that peak memory does not grow with the number of levels.
+
+        With `prefetch`, a reader thread reads block d+1 and a writer thread writes block d-1
+        while block d is remapped on the calling thread, so the wall time approaches
+        max(I/O, compute) rather than their sum. The numpy/scipy kernels release the GIL, and at
+        most one block is held in each of the read and write buffers.
+
+        Parameters:
+            wgt_file (list of str): Weight file(s), as for `remap_from_file`
+            out_file (str, netCDF4.Dataset or list): Output file, or one per target
+            dz_name_out, time_name_out, forecast_iter: As for `write_to_file`
+            var_name_out (list of str): Output variable name(s)
+            block_size (int): Number of depth levels per block
+            prefetch (bool): Overlap reading and writing with remapping using background threads
+        """
+        if self.vertical is not None:
+            raise ValueError("Vertical interpolation needs whole columns and cannot be streamed in blocks of levels.")
+
+        if self.partition is not None: # Each rank holds only its rows, and ranks take turns writing whole fields
+            self.remap_from_file(*wgt_file)
+            self.write_to_file(out_file, dz_name_out, time_name_out, forecast_iter, *var_name_out)
+            return
+
+        self.setup(*wgt_file)
+        targets = self.output_targets(out_file, dz_name_out, time_name_out, var_name_out)
+        block_size = max(1, int(block_size))
+        blocks = [(d0, min(d0 + block_size, self.ndepths)) for d0 in range(0, self.ndepths, block_size)]
+
+        with utilities.open_outputs([target[0] for target in targets]) as datasets:
+            # First block creates the output variables
+            d0, d1 = blocks[0]
+            remapped = self.remap_levels(d0, d1)
+            out_vars = [self.output_variable(ds, name, dims, data.shape[-2:], forecast_iter)
+                        for ds, (__, name, dims), data in zip(datasets, targets, remapped)]
+            if self.add_eta: # Interface heights are accumulated block by block, top to bottom
+                shape = (self.ndepths,) + remapped[0].shape[-2:]
+                eta_vars = [self.output_eta(ds, dims, shape, forecast_iter)
+                            for ds, (__, __, dims) in zip(datasets, targets)]
+            else:
+                eta_vars = [None] * len(targets)
+            eta_top = [None] * len(targets)
+            if all(var is None for var in out_vars + eta_vars): # Nothing to (over)write
+                return
+
+            def write_levels(d0, d1, remapped):
+                for i, (var, eta_var, data) in enumerate(zip(out_vars, eta_vars, remapped)):
+                    if var is not None:
+                        with profiling.stage('write', var=targets[i][1], block=(d0, d1)) as stage:
+                            var[forecast_iter,d0:d1,:,:] = data
+                            stage.add(written=data.size*var.dtype.itemsize)
+                    if eta_var is not None:
+                        with profiling.stage('eta', var=ETA_NAME, block=(d0, d1)) as stage:
+                            eta, eta_top[i] = self.eta_levels(data, eta_top[i])
+                            eta_var[forecast_iter,d1+1-len(eta):d1+1,:,:] = eta
+                            stage.add(written=eta.size*eta_var.dtype.itemsize)
+
+            if not prefetch:
+                write_levels(d0, d1, remapped)
+                for d0, d1 in blocks[1:]:
+                    write_levels(d0, d1, self.remap_levels(d0, d1))
+                return
+
+            # The netCDF-C library is not thread-safe, so reads and writes take turns on the
+            # library while remapping runs concurrently with either of them
+            io_lock = threading.Lock()
+            context = profiling.current_labels() # Carried into the reader and writer threads
+
+            def read_levels(d0, d1):
+                with io_lock, profiling.labels(**context):
+                    return self.read_levels(d0, d1)
+
+            def write_locked(d0, d1, remapped):
+                with io_lock, profiling.labels(**context):
+                    write_levels(d0, d1, remapped)
+
+            with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(max_workers=1) as writer:
+                pending_read = reader.submit(read_levels, *blocks[1]) if len(blocks) > 1 else None
+                pending_write = writer.submit(write_locked, d0, d1, remapped)
+
+                for i, (d0, d1) in enumerate(blocks[1:], start=1):
+                    data_src = pending_read.result()
+                    pending_read = reader.submit(read_levels, *blocks[i+1]) if i+1 < len(blocks) else None
+
+                    with profiling.labels(block=(d0, d1)):
+                        remapped = self.compute_levels(*data_src)
+
+                    pending_write.result() # Keep at most one block waiting to be written
+                    pending_write = writer.submit(write_locked, d0, d1, remapped)
+
+                pending_write.result()
+
 #######################
 ### 2D Scalar Class ###
 #######################
@@ -83,299 +416,289 @@ class _Remapper2DScalar(_RemapperBase):
         self.data = args[0]
         self.remapped = None
 
-    def remap_from_file(self, wgt_file):
-        S_mat, dst_dims, __ = Remapper.unpack_weights(wgt_file)
-
-        dims = (1, dst_dims[1], dst_dims[0]) # Dims are flipped
+    def remap_from_file(self, *wgt_file):
+        S_mat, dims, offsets = Remapper.stack_weights(wgt_file)
+        self.ntargets = len(dims)
+        S_mat, dims, offsets = self.restrict_rows(S_mat, dims, offsets)
 
-        N = 1.2676506e+30 # NaN placeholder value
+        # Only read the source window referenced by the weights
+        S_mat = S_mat.windowed(self.data.shape[-2:]).astype(self.dtype)
 
         t = 0
-        data_src = np.array(self.data[t,:,:])
-        data_level = np.where(data_src.ravel()==N, 0, data_src.ravel())
-        data_interp = S_mat.dot(data_level)
+        with profiling.stage('read') as stage:
+            data_src = S_mat.read_source(self.data, (slice(t, t+1),))
+            stage.add(read=data_src.nbytes)
+        with profiling.stage('mask'):
+            mask = self.masks.mask_levels(self.data, S_mat, [0], data_src)
+        data_interp = Remapper.apply_weights(S_mat, data_src, masked=True)
+        if self.renormalize:
+            self.masks.renormalize(self.data, S_mat, [0], mask, data_interp)
 
-        data_interp = data_interp.reshape(dims)
+        remapped = Remapper.split_targets(data_interp, dims, offsets)
 
-        self.remapped = data_interp
+        self.remapped = remapped[0] if self.ntargets == 1 else remapped
 
     def write_to_file(self, out_file, dz_name_out, time_name_out, forecast_iter, *var_name_out):
-        var_name_out = var_name_out[0] # Should only have one input for Scalar Classes
         if self.remapped is None:
             raise ValueError(f"No remapped data to write out.")
 
-        __, ny, nx = np.shape(self.remapped)
-
-        with Dataset(out_file, 'a', format='NETCDF4') as ds:
-            if (forecast_iter == 0): # First timestep
-                if 'yh' not in ds.dimensions:
-                    ds.createDimension('yh', ny)
-                if 'xh' not in ds.dimensions:
-                    ds.createDimension('xh', nx)
-                if var_name_out not in ds.variables:
-                    var = ds.createVariable(var_name_out, 'f4', (time_name_out, 'yh', 'xh'), fill_value=1.e+20)
-                    var[:] = self.remapped
-            else: # Append subsequent timesteps
-                var = ds.variables[var_name_out]
-                var[forecast_iter,:,:] = self.remapped[0,:,:]
-                
+        remapped = self.remapped if isinstance(self.remapped, list) else [self.remapped]
+        targets = self.output_targets(out_file, dz_name_out, time_name_out, var_name_out)
+
+        with self.write_turn(), utilities.open_outputs([target[0] for target in targets]) as datasets:
+            for k, (ds, (__, name, dims), data) in enumerate(zip(datasets, targets, remapped)):
+                rows, shape = self.output_rows(k, len(targets), data.shape[-2:])
+                var = self.target_variable(ds, name, dims, shape, forecast_iter)
+                if var is not None and data.size:
+                    with profiling.stage('write', var=name) as stage:
+                        var[forecast_iter,rows,:] = data[0,:,:]
+                        stage.add(written=data[0].size*var.dtype.itemsize)
+
+    def output_dims(self, dz_name_out, time_name_out):
+        return [(time_name_out, 'yh', 'xh')] * self.ntargets
+
+    def stream_to_file(self, wgt_file, out_file, dz_name_out, time_name_out, forecast_iter, var_name_out, block_size,
+                       prefetch=False):
+        """ Single level: remap and write directly """
+        self.remap_from_file(*wgt_file)
+        self.write_to_file(out_file, dz_name_out, time_name_out, forecast_iter, *var_name_out)
     
 #######################
 ### 3D Scalar Class ###
 #######################
 
-class _Remapper3DScalar(_RemapperBase):
+class _Remapper3DScalar(_Remapper3DBase):
     """ Class for 3D scalar datatype (temperature, salinity) """
     def __init__(self, args, ndepths):
         self.data = args[0]
         self.ndepths = ndepths
         self.remapped = None
 
-    def remap_from_file(self, wgt_file):
-        """ Remap onto the destination center points based on ESMF_RegridWeightGen weight file. """
-        S_mat, dst_dims, nb = Remapper.unpack_weights(wgt_file)
+    def setup(self, *wgt_file):
+        """ Load the ESMF_RegridWeightGen weights for remapping onto the destination center points. """
+        S_mat, dims, offsets = Remapper.stack_weights(wgt_file)
+        self.ntargets = len(dims)
+        S_mat, self.dims, self.offsets = self.restrict_rows(S_mat, dims, offsets)
 
-        dims = (1,self.ndepths,int(dst_dims[1]), int(dst_dims[0])) # Dims are flipped
-
-        data_interp = np.zeros((1,self.ndepths,nb))
-        N = 1.2676506e+30 # NaN placeholder value
+        # Only read the source window referenced by the weights
+        self.S_mat = S_mat.windowed(self.data.shape[-2:]).astype(self.dtype)
 
+    def read_levels(self, d0, d1):
         t = 0
-        for d in range(self.ndepths):
-            data_src = np.array(self.data[t,d,:,:])
-            data_level = np.where(data_src.ravel()==N, 0, data_src.ravel())
-            data_interp[t,d,:] = S_mat.dot(data_level)
-   
-        data_interp = data_interp.reshape(dims)
+        levels = range(d0, d1)
+        with profiling.stage('read', block=(d0, d1)) as stage:
+            data_src = self.S_mat.read_source(self.data, (t, slice(d0, d1)))
+            stage.add(read=data_src.nbytes)
+        with profiling.stage('mask', block=(d0, d1)):
+            mask = self.masks.mask_levels(self.data, self.S_mat, levels, data_src)
 
-        self.remapped = data_interp
+        return data_src, levels, mask
 
-    def write_to_file(self, out_file, dz_name_out, time_name_out, forecast_iter, *var_name_out):
-        var_name_out = var_name_out[0] # Should only have one input for Scalar Classes
-        if self.remapped is None:
-            raise ValueError(f"No remapped data to write out.")
+    def compute_levels(self, data_src, levels, mask):
+        data_interp = Remapper.apply_weights(self.S_mat, data_src, masked=True)
+        if self.renormalize:
+            self.masks.renormalize(self.data, self.S_mat, levels, mask, data_interp)
+
+        return Remapper.split_targets(data_interp, self.dims, self.offsets)
+
+    def remap_from_file(self, *wgt_file):
+        """ Remap onto the destination center points based on ESMF_RegridWeightGen weight file(s). """
+        super().remap_from_file(*wgt_file)
+        if self.ntargets == 1:
+            self.remapped = self.remapped[0]
 
-        __, __, ny, nx = np.shape(self.remapped)
-
-        with Dataset(out_file, 'a', format='NETCDF4') as ds:
-            if (forecast_iter == 0): # First timestep
-                if 'yh' not in ds.dimensions:
-                    ds.createDimension('yh', ny)
-                if 'xh' not in ds.dimensions:
-                    ds.createDimension('xh', nx)
-                if var_name_out not in ds.variables:
-                    var = ds.createVariable(var_name_out, 'f4', (time_name_out, dz_name_out, 'yh', 'xh'), fill_value=1.e+20)
-                    var[:] = self.remapped
-            else: # Append subsequent timesteps
-                var = ds.variables[var_name_out]
-                var[forecast_iter,:,:,:] = self.remapped[0,:,:,:]
+    def output_dims(self, dz_name_out, time_name_out):
+        return [(time_name_out, dz_name_out, 'yh', 'xh')] * self.ntargets
 
 #######################
 ### 3D Vector Class ###
 #######################
 
-class _Remapper3DVector(_RemapperBase):
-    """ Class for 3D Vector datatype (velocity) """
-    def __init__(self, args, ndepths, src_angle, dst_angle, src_ang_hgrid, dst_ang_hgrid):
+class _Remapper3DVector(_Remapper3DBase):
+    """ Class for 3D Vector datatype (velocity)
+
+    If `dst_angle` is a list (one destination angle, or None, per weight file), each weight file
+    is a separate colocated target and all targets are remapped together from one read of the source.
+    """
+    def __init__(self, args, ndepths, src_angle, dst_angle, src_ang_hgrid, dst_ang_hgrid, fused=False):
         self.data = (args[0], args[1])
         self.ndepths = ndepths
         self.src_angle = src_angle
         self.dst_angle = dst_angle
         self.src_hgrid = src_ang_hgrid
         self.dst_hgrid = dst_ang_hgrid
+        self.fused = fused
         self.remapped = None
         self.staggered = None
 
         if (self.src_angle is not None) and (self.src_hgrid):
             self.src_angle = self.convert_angle_to_subgrid(self.src_angle[:], 'center')
 
-    def remap_from_file(self, *wgt_file):
+        # Convert to radians on the full grid, since only a window of it may be used
+        if self.src_angle is not None:
+            self.src_angle = self.to_radians(np.array(self.src_angle[:]))
+
+    def setup(self, *wgt_file):
         """ Determines whether to remap to centers or directly to edges based on whether
-            provided 1 (center) weight file or 2 (u,v) weight files. """
-        if len(wgt_file) == 1:
+            provided 1 (center) weight file or 2 (u,v) weight files, and loads the weights. """
+        if isinstance(self.dst_angle, list): # Stacked colocated targets (not fused)
             self.staggered = False
-            self.remap_to_center(*wgt_file)
+            self.mode = 'center'
+        elif len(wgt_file) == 1:
+            self.staggered = False
+            self.mode = 'fused' if self.fused else 'center'
         elif len(wgt_file) == 2:
             self.staggered = True
-            self.remap_to_edges(*wgt_file)
+            self.mode = 'fused' if self.fused else 'edges'
 
-    def remap_to_edges(self, *wgt_file):
-        """ Remap (u,v) to edges, rotate vector, then extract v from v-edges and u from u-edges"""
-        self.remapped = []
-        N = 1.2676506e+30 # NaN placeholder value
-        subgrids = ['u','v']
+        if self.mode == 'fused':
+            self.setup_fused(*wgt_file)
+        elif self.mode == 'edges':
+            self.setup_edges(*wgt_file)
+        else:
+            self.setup_center(*wgt_file)
 
-        for i in range(2): # For each edge subgrid
-            sg = subgrids[i]
-            if (self.dst_angle is not None) and (self.dst_hgrid): # Get angles for subgrids from supergrid
-                dst_angle_sg = self.convert_angle_to_subgrid(self.dst_angle[:], sg)
-            else: 
-                dst_angle_sg = None
+    def read_levels(self, d0, d1):
+        t = 0
+        with profiling.stage('read', block=(d0, d1)) as stage:
+            data_src_u = self.S_mat.read_source(self.data[0], (t, slice(d0, d1)))
+            data_src_v = self.S_mat.read_source(self.data[1], (t, slice(d0, d1)))
+            stage.add(read=data_src_u.nbytes + data_src_v.nbytes)
+
+        # Zero fill values before the source rotation
+        with profiling.stage('mask', block=(d0, d1)):
+            self.masks.mask_levels(self.data[0], self.S_mat, range(d0, d1), data_src_u)
+            self.masks.mask_levels(self.data[1], self.S_mat, range(d0, d1), data_src_v)
+
+        return data_src_u, data_src_v
+
+    def compute_levels(self, data_src_u, data_src_v):
+        if self.mode == 'fused':
+            return self.remap_fused(data_src_u, data_src_v)
+        elif self.mode == 'edges':
+            return self.remap_to_edges(data_src_u, data_src_v)
+        else:
+            return self.remap_to_center(data_src_u, data_src_v)
+
+    def setup_fused(self, *wgt_file):
+        """ Load a single fused operator that combines source rotation, interpolation
+            and destination rotation as a 2x2 block matrix (see `weights.fuse_vector_operator`). """
+        if self.staggered:
+            src_grid = 'dst' # Same source rotation as remap_to_edges
+            if (self.dst_angle is not None) and (self.dst_hgrid):
+                dst_angles = [self.convert_angle_to_subgrid(self.dst_angle[:], sg) for sg in ['u','v']]
+            else:
+                dst_angles = [None, None]
+        else:
+            src_grid = 'src' # Same source rotation as remap_to_center
+            dst_angles = [None if self.dst_angle is None else self.dst_angle[:]]
 
-            wgts = wgt_file[i]
-            S_mat, dst_dims, nb = Remapper.unpack_weights(wgts)
+        S_vec, dst_dims = weights.load_vector_operator(list(wgt_file), self.src_angle, dst_angles, src_grid)
 
-            dims = (1,self.ndepths,int(dst_dims[1]), int(dst_dims[0])) # Dims are flipped
+        dims = [(int(ny), int(nx)) for nx, ny in dst_dims] # Dims are flipped
+        offsets = np.concatenate(([0], np.cumsum([ny*nx for ny, nx in dims]))).tolist()
+        S_vec, self.dims, self.offsets = self.restrict_rows(S_vec, dims, offsets)
 
-            data_u = np.zeros((1,self.ndepths,nb))
-            data_v = np.zeros((1,self.ndepths,nb))
-            
-            t = 0
+        self.S_mat = S_vec.windowed(self.data[0].shape[-2:]).astype(self.dtype)
 
-            for d in range(self.ndepths):
-                data_src_u = np.array(self.data[0][t,d,:,:])
-                data_src_v = np.array(self.data[1][t,d,:,:])
+    def remap_fused(self, data_src_u, data_src_v):
+        """ Remap (u,v) with the fused operator. Matches `remap_to_center` (1 weight file) or
+            `remap_to_edges` (2 weight files). """
+        nlev = data_src_u.shape[0]
+        data_interp = Remapper.apply_weights(self.S_mat, np.concatenate((data_src_u, data_src_v), axis=-1), masked=True)
 
-                # Rotate to N-E direction from source grid
-                if self.src_angle is not None:
-                    data_src_u, data_src_v = self.rotate_vector(data_src_u, data_src_v, self.src_angle, grid='dst')
+        # Split stacked output rows back into u and v on their own grids
+        return [data_interp[:, self.offsets[i]:self.offsets[i+1]].reshape((nlev,) + self.dims[i]) for i in range(2)]
 
-                # Interpolate u
-                data_level = np.where(data_src_u.ravel()==N, 0, data_src_u.ravel())
-                data_u[t,d,:] = S_mat.dot(data_level)
+    def setup_edges(self, *wgt_file):
+        """ Load the u- and v-edge weights, stacked so each source level is read and rotated once. """
+        S_edges = [Remapper.unpack_weights(wgts)[0] for wgts in wgt_file]
+        S_mat, offsets = weights.stack_operators(S_edges)
+        dims = [(int(S_edge.dst_dims[1]), int(S_edge.dst_dims[0])) for S_edge in S_edges] # Dims are flipped
+        S_mat, self.dims, self.offsets = self.restrict_rows(S_mat, dims, offsets)
 
-                # Interpolate v
-                data_level = np.where(data_src_v.ravel()==N, 0, data_src_v.ravel())
-                data_v[t,d,:] = S_mat.dot(data_level)
+        self.S_mat = S_mat.windowed(self.data[0].shape[-2:]).astype(self.dtype)
 
-            data_u = data_u.reshape(dims)
-            data_v = data_v.reshape(dims)
+        # Source angles on the window, and destination angles for subgrids from the supergrid
+        self.src_angle_pts = None if self.src_angle is None else self.S_mat.source_points(self.src_angle)
+        if (self.dst_angle is not None) and (self.dst_hgrid):
+            self.dst_angle_sg = [self.band_rows(self.to_radians(np.array(self.convert_angle_to_subgrid(self.dst_angle[:], sg))), i).astype(self.dtype)
+                                 for i, sg in enumerate(['u','v'])]
+        else:
+            self.dst_angle_sg = [None, None]
 
-            if dst_angle_sg is not None: # No center angle assumes destination grid is North-East aligned
-                data_u, data_v = self.rotate_vector(data_u, data_v, dst_angle_sg, grid='dst')
-           
-            # Only keep rotated u on u grid and rotated v on v grid
-            if sg == 'u':
-                self.remapped.append(data_u)
-            else: # 'v'
-                self.remapped.append(data_v)
-
-    def remap_to_center(self, wgt_file):
-        """ Remap to every point, and then rotate vector. Does not use subgrids. """
-        self.remapped = []
-        N = 1.2676506e+30 # NaN placeholder value
-        
-        S_mat, dst_dims, nb = Remapper.unpack_weights(wgt_file)
-        
-        dims = (1,self.ndepths,int(dst_dims[1]), int(dst_dims[0])) # Dims are flipped
-        
-        data_u = np.zeros((1,self.ndepths,nb))
-        data_v = np.zeros((1,self.ndepths,nb))
-        
-        t = 0
+    def remap_to_edges(self, data_src_u, data_src_v):
+        """ Remap (u,v) to edges, rotate vector, then extract v from v-edges and u from u-edges. """
+        nlev = data_src_u.shape[0]
+        remapped = []
 
-        for d in range(self.ndepths):
-            data_src_u = np.array(self.data[0][t,d,:,:])
-            data_src_v = np.array(self.data[1][t,d,:,:])
+        # Rotate to N-E direction from source grid
+        if self.src_angle_pts is not None:
+            data_src_u, data_src_v = self.rotate_vector(data_src_u, data_src_v, self.src_angle_pts, grid='dst')
 
-            # Rotate to N-E direction from source grid
-            if self.src_angle is not None:
-                data_src_u, data_src_v = self.rotate_vector(data_src_u, data_src_v, self.src_angle, grid='src')
-            
-            # Interpolate u
-            data_level = np.where(data_src_u.ravel()==N, 0, data_src_u.ravel())
-            data_u[t,d,:] = S_mat.dot(data_level)
+        # Interpolate u and v levels together onto both edge subgrids
+        data_interp = Remapper.apply_weights(self.S_mat, np.concatenate((data_src_u, data_src_v)), masked=True)
+        data_u_all, data_v_all = np.split(data_interp, 2)
 
-            # Interpolate v
-            data_level = np.where(data_src_v.ravel()==N, 0, data_src_v.ravel())
-            data_v[t,d,:] = S_mat.dot(data_level)
+        for i in range(2): # For each edge subgrid ('u', 'v')
+            data_u = data_u_all[:, self.offsets[i]:self.offsets[i+1]].reshape((nlev,) + self.dims[i])
+            data_v = data_v_all[:, self.offsets[i]:self.offsets[i+1]].reshape((nlev,) + self.dims[i])
 
-        data_u = data_u.reshape(dims)
-        data_v = data_v.reshape(dims)
+            if self.dst_angle_sg[i] is not None: # No center angle assumes destination grid is North-East aligned
+                data_u, data_v = self.rotate_vector(data_u, data_v, self.dst_angle_sg[i], grid='dst')
+           
+            # Only keep rotated u on u grid and rotated v on v grid
+            remapped.append(data_u if i == 0 else data_v)
 
-        if self.dst_angle is not None: # No center angle assumes destination grid is North-East aligned
-            data_u, data_v = self.rotate_vector(data_u, data_v, self.dst_angle, grid='dst')
-        
-        self.remapped.append(data_u)
-        self.remapped.append(data_v)
+        return remapped
 
-    @staticmethod
-    def rotate_vector(u, v, a, grid):
-        """ Rotates vector from North-East alignment to grid alignment specified by the angle, a """
-        if (np.min(a) < -1*np.pi) or (np.max(a) > np.pi):
-            a = np.radians(a)
+    def setup_center(self, *wgt_file):
+        """ Load the weights for remapping to every point (of each target). Does not use subgrids. """
+        S_mat, dims, offsets = Remapper.stack_weights(wgt_file)
+        self.ntargets = len(dims)
+        S_mat, self.dims, self.offsets = self.restrict_rows(S_mat, dims, offsets)
 
-        cosa = np.cos(a)
-        sina = np.sin(a)
+        self.S_mat = S_mat.windowed(self.data[0].shape[-2:]).astype(self.dtype)
 
-        if grid=='dst':
-            rotated_u = u*cosa + v*sina
-            rotated_v = v*cosa - u*sina
-        elif grid=='src':
-            rotated_u = u*cosa - v*sina
-            rotated_v = v*cosa + u*sina
+        dst_angles = self.dst_angle if isinstance(self.dst_angle, list) else [self.dst_angle]
+        self.src_angle_pts = None if self.src_angle is None else self.S_mat.source_points(self.src_angle)
+        self.dst_angle_pts = [None if a is None else self.band_rows(self.to_radians(np.array(a[:])), i).astype(self.dtype)
+                              for i, a in enumerate(dst_angles)]
 
-        return rotated_u, rotated_v
+    def remap_to_center(self, data_src_u, data_src_v):
+        """ Remap to every point, and then rotate vector. """
+        nlev = data_src_u.shape[0]
 
-    @staticmethod
-    def convert_angle_to_subgrid(var, gridtype):
-        """Converts from supergrid to specified subgrid points"""
-        if gridtype == "center": # Extract center points of grid
-            cvar = var[1::2, 1::2]
-        elif gridtype == "u": # Extract the East/West edges of grid
-            cvar = var[1::2,0::2]
-        elif gridtype == "v": # Extract the North/South edges of grid
-            cvar = var[0::2,1::2]
-        else:
-            raise ValueError("Grid type not supported. Must be center, u, or v")
-    
-        return cvar
+        # Rotate to N-E direction from source grid
+        if self.src_angle_pts is not None:
+            data_src_u, data_src_v = self.rotate_vector(data_src_u, data_src_v, self.src_angle_pts, grid='src')
 
-    def write_to_file(self, out_file, dz_name_out, time_name_out, forecast_iter, *var_name_out):
-        if self.remapped is None:
-            raise ValueError(f"No remapped data to write out.")
+        # Interpolate u and v levels together
+        data_interp = Remapper.apply_weights(self.S_mat, np.concatenate((data_src_u, data_src_v)), masked=True)
+        data_u_all, data_v_all = np.split(data_interp, 2)
+        remapped = []
 
-        u_name = var_name_out[0]
-        v_name = var_name_out[1]
+        for data_u, data_v, dst_angle in zip(Remapper.split_targets(data_u_all, self.dims, self.offsets),
+                                             Remapper.split_targets(data_v_all, self.dims, self.offsets),
+                                             self.dst_angle_pts):
+            if dst_angle is not None: # No center angle assumes destination grid is North-East aligned
+                data_u, data_v = self.rotate_vector(data_u, data_v, dst_angle, grid='dst')
 
-        __, __, ny, nx = np.shape(self.remapped[0])
+            remapped += [data_u, data_v]
 
-        if self.staggered: # U and V are located on different subgrids
-            # Write u out
-            with Dataset(out_file, 'a', format='NETCDF4') as ds:
-                if (forecast_iter==0):
-                    if 'yh' not in ds.dimensions:
-                        ds.createDimension('yh', ny)
-                    if 'xq' not in ds.dimensions:
-                        ds.createDimension('xq', nx)
-                    if u_name not in ds.variables:
-                        var = ds.createVariable(u_name, 'f4', (time_name_out, dz_name_out, 'yh', 'xq'), fill_value=1.e+20)
-                        var[:] = self.remapped[0]
-                else:
-                    var = ds.variables[u_name]
-                    var[forecast_iter,:,:,:] = self.remapped[0][0,:,:,:]
-
-            # Write v out
-            __, __, ny, nx = np.shape(self.remapped[1])
-
-            with Dataset(out_file, 'a', format='NETCDF4') as ds:
-                if (forecast_iter == 0):
-                    if 'yq' not in ds.dimensions:
-                        ds.createDimension('yq', ny)
-                    if 'xh' not in ds.dimensions:
-                        ds.createDimension('xh', nx)
-                    if v_name not in ds.variables:
-                        var = ds.createVariable(v_name, 'f4', (time_name_out, dz_name_out, 'yq', 'xh'), fill_value=1.e+20)
-                        var[:] = self.remapped[1]
-                else:
-                    var = ds.variables[v_name]
-                    var[forecast_iter,:,:,:] = self.remapped[1][0,:,:,:]
+        return remapped
 
+    def band_rows(self, arr, i):
+        """ Rows of a (ny, nx) destination array of target `i` remapped by this rank """
+        return arr if self.bands is None else arr[self.bands[i][0]:self.bands[i][1]]
+
+    def output_dims(self, dz_name_out, time_name_out):
+        if self.staggered: # U and V are located on different subgrids
+            return [(time_name_out, dz_name_out, 'yh', 'xq'), (time_name_out, dz_name_out, 'yq', 'xh')]
         else: # U and V are colocated
-            with Dataset(out_file, 'a', format='NETCDF4') as ds:
-                if (forecast_iter == 0):
-                    if 'yh' not in ds.dimensions:
-                        ds.createDimension('yh', ny)
-                    if 'xh' not in ds.dimensions:
-                        ds.createDimension('xh', nx)
-                    if u_name not in ds.variables:
-                        var = ds.createVariable(u_name, 'f4', (time_name_out, dz_name_out, 'yh', 'xh'), fill_value=1.e+20)
-                        var[:] = self.remapped[0]
-                    if v_name not in ds.variables:
-                        var = ds.createVariable(v_name, 'f4', (time_name_out, dz_name_out, 'yh', 'xh'), fill_value=1.e+20)
-                        var[:] = self.remapped[1]
-                else:
-                    uvar = ds.variables[u_name]
-                    uvar[forecast_iter,:,:,:] = self.remapped[0][0,:,:,:]
-                    vvar = ds.variables[v_name]
-                    vvar[forecast_iter,:,:,:] = self.remapped[1][0,:,:,:]
+            return [(time_name_out, dz_name_out, 'yh', 'xh'), (time_name_out, dz_name_out, 'yh', 'xh')] * self.ntargets
+
+    # Vector rotation and angle helpers shared with the ice prep (see `remapping.rotation`)
+    to_radians = staticmethod(rotation.to_radians)
+    rotate_vector = staticmethod(rotation.rotate_vector)
+    convert_angle_to_subgrid = staticmethod(rotation.convert_angle_to_subgrid)
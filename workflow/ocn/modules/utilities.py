@@ -1,7 +1,10 @@
 import os
+from contextlib import contextmanager, ExitStack
 import numpy as np
 from netCDF4 import Dataset
 
+from .vertical import VerticalInterpolator
+
 ##########################
 ### File I/O Utilities ###
 ##########################
@@ -23,6 +26,41 @@ def read_variable_from_file(fname, vname):
     else:
         return ds[vname]
 
+@contextmanager
+def open_output(out_file):
+    """ Open an output NetCDF file for appending.
+
+    Parameters:
+        out_file (str or netCDF4.Dataset): Path to the output file, or an already open
+                                           Dataset (e.g., shared across fields), which is left open.
+
+    Yields:
+        netCDF4.Dataset: Dataset open in append mode.
+    """
+    if isinstance(out_file, Dataset):
+        yield out_file
+    else:
+        with Dataset(out_file, 'a', format='NETCDF4') as ds:
+            yield ds
+
+@contextmanager
+def open_outputs(out_files):
+    """ Open several output NetCDF files for appending (see `open_output`).
+
+    Parameters:
+        out_files (list of str or netCDF4.Dataset): Output files, which may repeat.
+
+    Yields:
+        list of netCDF4.Dataset: Dataset for each entry of `out_files`, each file opened once.
+    """
+    with ExitStack() as stack:
+        datasets = {}
+        for out_file in out_files:
+            key = id(out_file) if isinstance(out_file, Dataset) else out_file
+            if key not in datasets:
+                datasets[key] = stack.enter_context(open_output(out_file))
+        yield [datasets[id(out_file) if isinstance(out_file, Dataset) else out_file] for out_file in out_files]
+
 def check_file_dimensions(ofile, dname, dim_data, append=False):
     """
     Checks the dimensions of a specific file and verifies its dimension matches the expected data.
@@ -52,7 +90,7 @@ def check_file_dimensions(ofile, dname, dim_data, append=False):
     
     return True
 
-def initialize_file(dz, dz_name_out, times, time_name_out, out_file):
+def initialize_file(dz, dz_name_out, times, time_name_out, out_file, write_dz=True):
     """ Initialize the output file with layer depth and time data
 
     Parameters:
@@ -61,6 +99,8 @@ def initialize_file(dz, dz_name_out, times, time_name_out, out_file):
         times (netCDF4.variable): Time data for initializing the time dimension.
         time_name_out (str): The name of the time dimension to use in the output file.
         out_file (str): Path to the output NetCDF file to initialize.
+        write_dz (bool): Also write the depth data as a variable named `dz_name_out`
+                         (not wanted in OBC segment files, see `obc.finalize_segment`).
     """
     dz = np.asarray(dz[:], dtype=float)
 
@@ -75,10 +115,11 @@ def initialize_file(dz, dz_name_out, times, time_name_out, out_file):
             new_ds.createDimension(time_name_out, None)
 
             # Add depth data
-            depth_var = new_ds.createVariable(dz_name_out, 'f4', (dz_name_out), fill_value=1.e+20)
+            if write_dz:
+                depth_var = new_ds.createVariable(dz_name_out, 'f4', (dz_name_out), fill_value=1.e+20)
+                depth_var[:] = dz
             time_var = new_ds.createVariable(time_name_out, 'f4', (time_name_out))
 
-            depth_var[:] = dz
 #            time_var[:] = 737678.5 # times[:]
             time_var[:] = times[:]
             if hasattr(times, 'long_name'):
@@ -104,7 +145,8 @@ def initialize_file(dz, dz_name_out, times, time_name_out, out_file):
 
 def interpolate_vertical(v_s, z_s, z_d):
 
-    """ Performs piecewise linear interpolation of vertical levels using numpy.interp()
+    """ Performs piecewise linear interpolation of vertical levels, with the same result as
+        numpy.interp(z_d, z_s, v_s[i,j,:], right=0) on each column (see `vertical.VerticalInterpolator`)
 
     Parameters:
         z_s(k_s)     (netCDF4.variable): Source vertical levels
@@ -114,19 +156,8 @@ def interpolate_vertical(v_s, z_s, z_d):
     Returns:
         v_d(i,j,k_d) (netCDF4.variable): Destination vertical interpolated data
     """
-    ni, nj, _ = np.shape(v_s)
-    nk_s = np.size(z_s)
-    nk_d = np.size(z_d)
-
-    v_d = np.zeros([ni, nj, nk_d])
-
-    # Perform standard numpy interpolation, column by column
-    for i in range(ni):
-        for j in range(nj):
-            # `left`:  Value to return for x < xp[0], default is fp[0] (Above surface)
-            # `right`: Value to return for x > xp[-1], default is fp[-1] (Below bathymetry)
-            v_d[i,j,:] = np.interp(z_d, z_s, v_s[i,j,:], right=0)
-
-    np.interp()
+    # `left`:  Value for z_d < z_s[0] is v_s[...,0] (Above surface)
+    # `right`: Value for z_d > z_s[-1] is 0 (Below bathymetry)
+    interpolator = VerticalInterpolator(z_s[:], z_d[:])
 
-    return v_d
+    return interpolator(np.asarray(v_s[:], dtype=np.float64), axis=-1)
@@ -0,0 +1,130 @@
+"""
+Script Name: remap_client.py
+Description:
+    Thin client of remap_service.py. Accepts the same arguments as run_ocn_prep.py (including
+    --manifest) and runs them in a remap service listening on a Unix socket, which keeps the
+    Python modules, weight operators, grid angles and land masks loaded between invocations.
+    Only the standard library is imported here, so the client starts in milliseconds.
+
+    The socket is given with --socket (or the OCN_REMAP_SOCKET environment variable). With
+    `--start True`, a service is started on the socket if none is listening. Otherwise, without
+    a service, run_ocn_prep.py is run in this process instead, so the client is always a drop-in
+    replacement.
+
+Example:
+    remap_client.py --socket ${PREP_DIR}/ocn_remap.sock --start True --manifest manifest.json
+    remap_client.py --socket ${PREP_DIR}/ocn_remap.sock --stop True
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+
+# Socket of the remap service, if --socket is not given
+SOCKET_ENV = 'OCN_REMAP_SOCKET'
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def request(socket_file, message, timeout=None):
+    """ Send one request to the service and return its reply.
+
+    Parameters:
+        socket_file (str): Unix socket of the service
+        message (dict): {'argv': [...], 'cwd': ..., 'env': {...}} to remap, or {'command': 'ping' / 'stop'}
+        timeout (float): Seconds to wait for the reply, None to wait for the remapping to finish
+
+    Returns:
+        dict: Reply with the exit 'status' and captured 'output' of the request
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_file)
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        with sock.makefile('r') as f:
+            reply = f.readline()
+
+    if not reply:
+        raise ConnectionError(f"Remap service on {socket_file} closed the connection without replying.")
+
+    return json.loads(reply)
+
+def is_running(socket_file):
+    """ Whether a service answers on `socket_file` """
+    try:
+        return request(socket_file, {'command': 'ping'}, timeout=10)['status'] == 0
+    except (OSError, ValueError):
+        return False
+
+def start_service(socket_file, idle_timeout, wait=120):
+    """ Start a detached remap service on `socket_file` (logging to `<socket_file>.log`) and
+        wait until it accepts requests """
+    with open(socket_file + '.log', 'a') as log:
+        subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, 'remap_service.py'),
+                          '--socket', socket_file, '--timeout', str(idle_timeout)],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+
+    deadline = time.monotonic() + wait
+    while not is_running(socket_file):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Remap service did not start on {socket_file}, see {socket_file}.log")
+        time.sleep(0.1)
+
+def run_local(argv):
+    """ Run run_ocn_prep.py with `argv` in this process, without a service """
+    os.execv(sys.executable, [sys.executable, os.path.join(SCRIPT_DIR, 'run_ocn_prep.py')] + argv)
+
+def main(args, argv):
+    socket_file = args.socket or os.environ.get(SOCKET_ENV)
+    if socket_file is None:
+        return run_local(argv)
+    socket_file = os.path.abspath(socket_file)
+
+    if args.stop:
+        if is_running(socket_file):
+            request(socket_file, {'command': 'stop'}, timeout=60)
+        return 0
+
+    if args.start and not is_running(socket_file):
+        start_service(socket_file, args.timeout)
+
+    if not argv: # Only start the service
+        return 0
+
+    try:
+        reply = request(socket_file, {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)})
+    except (FileNotFoundError, ConnectionRefusedError): # No service listening
+        return run_local(argv)
+
+    sys.stderr.write(reply['output'])
+
+    return reply['status']
+
+if __name__=="__main__":
+    # Client arguments. All other arguments are passed on to run_ocn_prep.py
+    parser = argparse.ArgumentParser(description="Run run_ocn_prep.py in a remap service (see remap_service.py)",
+                                     epilog="All other arguments are the same as run_ocn_prep.py", allow_abbrev=False)
+    parser.add_argument("--socket",
+                        required=False,
+                        help=f"Unix socket of the remap service. Defaults to ${SOCKET_ENV}. "
+                             f"Without either, run_ocn_prep.py is run in this process.")
+    parser.add_argument("--start",
+                        required=False,
+                        type=bool,
+                        help=f"Specify as True to start a service on the socket if none is running.")
+    parser.add_argument("--stop",
+                        required=False,
+                        type=bool,
+                        help=f"Specify as True to stop the service on the socket.")
+    parser.add_argument("--timeout",
+                        required=False,
+                        type=float,
+                        default=3600,
+                        help=f"Idle time in seconds after which a service started with --start exits. Defaults to 3600.")
+
+    args, argv = parser.parse_known_args()
+
+    sys.exit(main(args, argv))
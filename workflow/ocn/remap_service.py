@@ -0,0 +1,152 @@
+"""
+Script Name: remap_service.py
+Description:
+    Long-lived remap service for run_ocn_prep.py. Listens on a Unix socket and runs each request
+    of remap_client.py (the same arguments as run_ocn_prep.py) in this process, so that
+    interpreter startup, importing netCDF4/SciPy/NumPy and loading weights are paid once rather
+    than per invocation. Between requests it keeps warm:
+      * weight operators (windowed, stacked, fused; see remapping/weights.py)
+      * grid angles, land masks and vertical interpolators (see modules/manifest.SessionCache)
+
+    Requests run one at a time, in the working directory and with the REMAP_CACHE_DIR /
+    PREP_PROFILE_* environment of the client. Input and output files are opened per request and
+    closed when it completes. Cached entries whose files changed are rebuilt, and the masks of
+    source files not used in the last --max_idle requests are dropped.
+
+    The service exits after --timeout seconds without requests, or on `remap_client.py --stop True`.
+    Clients must run on the same node as the service.
+
+Example:
+    remap_service.py --socket ${PREP_DIR}/ocn_remap.sock --timeout 3600 &
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import socketserver
+from contextlib import redirect_stdout, redirect_stderr
+
+import run_ocn_prep
+from remap_client import is_running
+from modules.manifest import SessionCache
+from remapping import weights, profiling
+
+# Environment variables of the client applied to each request
+CLIENT_ENV = [weights.CACHE_DIR_ENV, profiling.PROFILE_DIR_ENV, profiling.PROFILE_FORMAT_ENV]
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        message = json.loads(self.rfile.readline())
+        command = message.get('command')
+
+        if command == 'ping':
+            reply = {'status': 0, 'output': ''}
+        elif command == 'stop':
+            self.server.stopped = True
+            reply = {'status': 0, 'output': ''}
+        else:
+            reply = self.server.run(message['argv'], message['cwd'], message.get('env', {}))
+
+        self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+class RemapService(socketserver.UnixStreamServer):
+    """ Unix socket server running run_ocn_prep.py requests one at a time with a warm `SessionCache` """
+    def __init__(self, socket_file, idle_timeout=None, max_idle=20):
+        self.cache = SessionCache()
+        self.timeout = idle_timeout # Seconds without requests before `serve` returns
+        self.max_idle = max_idle
+        self.stopped = False
+        super().__init__(socket_file, _RequestHandler)
+
+    def handle_timeout(self):
+        self.stopped = True
+
+    def serve(self):
+        """ Serve requests until stopped or idle for `timeout` seconds """
+        while not self.stopped:
+            self.handle_request()
+
+    def run(self, argv, cwd, env):
+        """ Run run_ocn_prep.py with arguments `argv` in directory `cwd`, with the `CLIENT_ENV` of `env`.
+
+        Returns:
+            dict: Exit 'status' (as run_ocn_prep.py), captured 'output' and 'wall_s' of the request
+        """
+        start = time.perf_counter()
+        output = io.StringIO()
+        previous_cwd = os.getcwd()
+        previous_env = {name: os.environ.get(name) for name in CLIENT_ENV}
+
+        # Rebuild cached entries of files that changed since the last request
+        self.cache.next_request(self.max_idle)
+
+        try:
+            os.chdir(cwd)
+            for name in CLIENT_ENV:
+                set_env(name, env.get(name))
+
+            with redirect_stdout(output), redirect_stderr(output):
+                try:
+                    run_ocn_prep.main(run_ocn_prep.parse_args(argv), cache=self.cache)
+                    status = 0
+                except SystemExit as e: # Argument errors, --help
+                    status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                except Exception:
+                    traceback.print_exc()
+                    status = 1
+                finally:
+                    profiling.write_report() # Per request, see `run_ocn_prep.main`
+                    profiling.disable()
+        finally:
+            os.chdir(previous_cwd)
+            for name, value in previous_env.items():
+                set_env(name, value)
+
+        wall = time.perf_counter() - start
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} status={status} wall={wall:.2f}s {' '.join(argv)}", flush=True)
+
+        return {'status': status, 'output': output.getvalue(), 'wall_s': round(wall, 6)}
+
+def set_env(name, value):
+    """ Set (or unset, if `value` is None) environment variable `name` """
+    if value is None:
+        os.environ.pop(name, None)
+    else:
+        os.environ[name] = value
+
+def main(args):
+    socket_file = os.path.abspath(args.socket)
+    if os.path.exists(socket_file):
+        if is_running(socket_file):
+            sys.exit(f"A remap service is already running on {socket_file}.")
+        os.unlink(socket_file) # Left behind by a service that did not exit cleanly
+
+    with RemapService(socket_file, args.timeout, args.max_idle) as service:
+        print(f"Remap service listening on {socket_file} (pid {os.getpid()})", flush=True)
+        try:
+            service.serve()
+        finally:
+            os.unlink(socket_file)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Serve run_ocn_prep.py requests of remap_client.py on a Unix socket")
+    parser.add_argument("--socket",
+                        required=True,
+                        help=f"Unix socket to listen on.")
+    parser.add_argument("--timeout",
+                        required=False,
+                        type=float,
+                        help=f"Idle time in seconds after which the service exits. Defaults to no timeout.")
+    parser.add_argument("--max_idle",
+                        required=False,
+                        type=int,
+                        default=20,
+                        help=f"Number of requests to keep the land masks of unused source files for. Defaults to 20.")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -9,14 +9,63 @@ Description:
 
 import os
 import argparse
+from argparse import Namespace
 import numpy as np
 import netCDF4 as nc
 from netCDF4 import Dataset
 
 from modules import Remapper 
 from modules import utilities 
+from modules.manifest import PrepSession, load_manifest, group_segments
+from modules import parallel
+from remapping import profiling
 
-def main(args):
+def main(args, cache=None):
+    # Optional -- Report the time, bytes moved and peak memory of each stage
+    if args.profile is not None:
+        profiling.enable(args.profile)
+    else:
+        profiling.enable_from_env('run_ocn_prep')
+
+    # Optional -- Partition the destination rows of every field across MPI ranks or local processes
+    if args.mpi:
+        parallel.run_mpi(run_partition, args)
+    elif (args.nprocs or 1) > 1:
+        parallel.run_local(args.nprocs, run_partition, args)
+    else:
+        run(args, PrepSession(cache))
+
+def run(args, session):
+    """ Remap the field given by `args`, or every field of its manifest, within `session` """
+    with session:
+        if args.manifest is not None:
+            run_manifest(args.manifest, session)
+        else:
+            remap_field(args, session)
+        session.finalize_segments()
+
+def run_partition(partition, args):
+    """ Run one rank of a row-partitioned remap (see modules/parallel.py) """
+    run(args, parallel.ParallelSession(partition))
+
+def run_manifest(manifest_file, session):
+    """ Remap every field listed in a manifest within one process, sharing weights,
+        open datasets and output files between fields. A field remapped onto several OBC
+        segments is remapped onto all of them together, reading the source once. """
+    tasks = load_manifest(manifest_file)
+    defaults = vars(build_parser(require_args=False).parse_args([]))
+
+    for group in group_segments(tasks):
+        targets = [Namespace(**dict(defaults, **task)) for task in group]
+        remap_field(targets[0], session, targets=targets)
+
+def remap_field(args, session, targets=None):
+    """ Remap a single scalar or vector field and append it to the output file.
+
+    `targets` optionally lists arguments for several destination grids of the same field (e.g., OBC
+    segments), each with one weight file and its own output file (see `manifest.TARGET_KEYS`).
+    """
+    targets = targets or [args]
 #    print(f"... Reading arguments ...")
 
     wgt_file = args.wgt_file
@@ -36,7 +85,7 @@ def main(args):
     dz_name_out = args.dz_name_out or dz_name
     time_name_out = args.time_name_out or time_name
 
-    # Optional -- Calculate thickness (eta) and add to output file
+    # Optional -- Calculate interface heights (eta) from this thickness field and add to output file
     add_eta = args.add_eta or False
 
     # Optional -- Default to 0th time step if not specified
@@ -50,59 +99,122 @@ def main(args):
     dst_ang_file = args.dst_ang_file or None
     dst_ang_supergrid = args.dst_ang_supergrid or False
 
+    # Optional -- Remap vectors with a single fused rotate-remap-rotate operator
+    fused_vector = args.fused_vector or False
+
+    # Optional -- Stream depth levels to the output file in blocks to bound memory use
+    block_size = args.block_size or None
+
+    # Optional -- Overlap reads and writes with remapping in background threads (implies streaming)
+    prefetch = args.prefetch or False
+    if prefetch and block_size is None:
+        block_size = 1
+
+    # Optional -- Compute dtype, defaults to the output dtype (float32)
+    dtype = args.dtype or None
+
+    # Optional -- Rescale scalar fields by the unmasked weights near land
+    renormalize = args.renormalize or False
+
+    # Optional -- Interpolate 3D fields from the source levels onto the `dz_name` levels
+    src_vrt_file = args.src_vrt_file or None
+    src_vrt_name = args.src_vrt_name or None
+
     # Initialize output file with vertical layer and time information
 #    print(f"... Initializing output file ...")
-    dz = utilities.read_variable_from_file(vrt_file, dz_name)
-    times = utilities.read_variable_from_file(tme_file, time_name)
-    utilities.initialize_file(dz, dz_name_out, times, time_name_out, out_file)
+    dz = session.read_variable(vrt_file, dz_name)
+    times = session.read_variable(tme_file, time_name)
+    out_ds, dz_names_out, var_names_out, dst_angles = [], [], [], []
+    for target in targets:
+        target_dz_name_out = target.dz_name_out or dz_name
+
+        # Optional -- Write the output file as a MOM6 open boundary segment
+        obc_segment = target.obc_segment or None
+        obc_hgrid_file = target.obc_hgrid_file or None
+        obc_compact_dz = target.obc_compact_dz or False
+        if obc_segment is not None and obc_hgrid_file is None:
+            raise ValueError("`--obc_hgrid_file` is required with `--obc_segment`")
+
+        out_ds.append(session.open_output(dz, target_dz_name_out, times, time_name_out, target.out_file,
+                                          write_dz=(obc_segment is None)))
+        if obc_segment is not None:
+            session.add_segment(target.out_file, obc_segment, dz, target_dz_name_out, time_name_out,
+                                obc_hgrid_file, obc_compact_dz)
+
+        dz_names_out.append(target_dz_name_out)
+        var_names_out += target.var_name_out or var_name
+        if target.dst_ang_file is not None and dst_ang_name is not None:
+            dst_angles.append(session.read_angle(target.dst_ang_file, dst_ang_name))
+        else:
+            dst_angles.append(None)
 
     # Gather datasets
     variables = [
-        utilities.read_variable_from_file(src_file, var_name)
+        session.read_variable(src_file, var_name)
         for src_file, var_name in zip(args.src_file, args.var_name)
     ]
 
     # Get angles if applicable
     if src_ang_file is not None and src_ang_name is not None:
-        src_angle = utilities.read_variable_from_file(src_ang_file, src_ang_name)
+        src_angle = session.read_angle(src_ang_file, src_ang_name)
     else:
         src_angle = None
-    if dst_ang_file is not None and dst_ang_name is not None:
-        dst_angle = utilities.read_variable_from_file(dst_ang_file, dst_ang_name)
+
+    # Get vertical interpolation if applicable
+    if src_vrt_file is not None and src_vrt_name is not None:
+        vertical = session.vertical_interpolator(src_vrt_file, src_vrt_name, vrt_file, dz_name)
     else:
-        dst_angle = None
+        vertical = None
+
+    if len(targets) == 1:
+        out_ds, dz_name_out, dst_angle = out_ds[0], dz_names_out[0], dst_angles[0]
+    else: # Remap onto all targets together, see `remapper._RemapperBase`
+        wgt_file = [wgts for target in targets for wgts in target.wgt_file]
+        dz_name_out, dst_angle = dz_names_out, dst_angles
+    var_name_out = var_names_out
 
     # Perform horizontal interpolation
 #    print(f"... Interpolating ...")
     var_remapper = Remapper(*variables, depth_name = 'Layer', src_angle=src_angle, dst_angle=dst_angle, 
-                            src_ang_hgrid=src_ang_supergrid, dst_ang_hgrid=dst_ang_supergrid)
-    var_remapper.remap_from_file(*wgt_file)
+                            src_ang_hgrid=src_ang_supergrid, dst_ang_hgrid=dst_ang_supergrid,
+                            fused_vector=fused_vector, dtype=dtype, mask_cache=session.masks,
+                            renormalize=renormalize, vertical=vertical, add_eta=add_eta,
+                            partition=session.partition)
+
+    with profiling.labels(var=','.join(var_name)), profiling.stage('field'):
+        if block_size is not None:
+            # Remap and append to file one block of depth levels at a time
+            var_remapper.stream_to_file(wgt_file, out_ds, dz_name_out, time_name_out, forecast_iter,
+                                        var_name_out, block_size, prefetch=prefetch)
+        else:
+            var_remapper.remap_from_file(*wgt_file)
 
-    # Append to file
-#    print(f"... Writing to output file ...")
-    var_remapper.write_to_file(out_file, dz_name_out, time_name_out, forecast_iter, *var_name_out)
+            # Append to file
+#            print(f"... Writing to output file ...")
+            var_remapper.write_to_file(out_ds, dz_name_out, time_name_out, forecast_iter, *var_name_out)
 
 #    print("Complete!")
 
 
-if __name__=="__main__":
+def build_parser(require_args=True):
+    """ Command line arguments. Arguments marked as required are optional when running from a manifest. """
     parser = argparse.ArgumentParser(description="Convert RTOFS to MOM6 Initial Conditions")
 
     # Required Arguments
     parser.add_argument("--var_name", 
                         nargs='+',
-                        required=True, 
+                        required=require_args, 
                         help=f"Space-seperated list of variables. "
                              f"Scalar: only include one variable name (e.g., --var_name ssh). "
                              f"Vector: include u- and v- components (e.g., --var_name u v).")
     parser.add_argument("--wgt_file",
                         nargs='+',
-                        required=True, 
+                        required=require_args, 
                         help=f"Name of netCDF file containing RTOFS to MOM6 weights file from ESMF_RegridWeightGen. "
                              f"Can accept one or two arguments (for u- and v- vector compenents, respectively)."
                              f"(e.g., `--wgt_file u_grid.nc v_grid.nc`)")
     parser.add_argument("--vrt_file", 
-                        required=True, 
+                        required=require_args, 
                         help=f"Name of netCDF file containing vertical grid data")
     parser.add_argument("--tme_file", 
                         required=False, 
@@ -110,7 +222,7 @@ if __name__=="__main__":
                              f"Defauts to first `--src_file` input if not specified.")
     parser.add_argument("--src_file", 
                         nargs='+',
-                        required=True, 
+                        required=require_args, 
                         help=f"Name of netCDF file containing RTOFS data "
                              f"Entry required for each `--var_name` specified")
     parser.add_argument("--dst_file", 
@@ -119,13 +231,13 @@ if __name__=="__main__":
                         help=f"Name of netCDF file containing destination grid point points "
                              f"To interpolate vectors onto edge points, input 2 files")
     parser.add_argument("--out_file", 
-                        required=True, 
+                        required=require_args, 
                         help=f"Name of output netCDF file")
     parser.add_argument("--dz_name", 
-                        required=True,
+                        required=require_args,
                         help=f"Name of layer thickness (dz) variable in `vrt_file`")
     parser.add_argument("--time_name", 
-                        required=True, 
+                        required=require_args, 
                         help=f"Name of output time variable in `src_file`")
 
     # Optional Arguments
@@ -153,6 +265,63 @@ if __name__=="__main__":
                         required=False,
                         help=f"Specify as True if the destination grid angle is specified on a "
                              f"supergrid and needs to be converted to center points.")
+    parser.add_argument("--fused_vector",
+                        required=False,
+                        help=f"Specify as True to remap vectors with one precomputed operator that combines "
+                             f"source rotation, interpolation and destination rotation (cached next to the weights).")
+    parser.add_argument("--block_size",
+                        required=False,
+                        type=int,
+                        help=f"Number of depth levels to remap at a time. Each block is written straight to the "
+                             f"output file, so peak memory no longer scales with the number of levels.")
+    parser.add_argument("--prefetch",
+                        required=False,
+                        type=bool,
+                        help=f"Specify as True to read the next block of depth levels and write the previous one "
+                             f"in background threads while the current block is remapped. "
+                             f"Uses `--block_size` (default 1 level per block).")
+    parser.add_argument("--nprocs",
+                        required=False,
+                        type=int,
+                        help=f"Number of local processes to remap each field with, each remapping and writing "
+                             f"a band of the destination rows (see modules/parallel.py). Defaults to 1.")
+    parser.add_argument("--mpi",
+                        required=False,
+                        type=bool,
+                        help=f"Specify as True to partition the destination rows across the MPI ranks of the "
+                             f"launcher (e.g., `srun -n 8 python run_ocn_prep.py --mpi True ...`). Requires mpi4py.")
+    parser.add_argument("--dtype",
+                        required=False,
+                        choices=['float32', 'float64'],
+                        help=f"Data type used for the weights and remapped data. Defaults to the output "
+                             f"variable type (float32); float64 reproduces double precision remapping.")
+    parser.add_argument("--renormalize",
+                        required=False,
+                        type=bool,
+                        help=f"Specify as True to divide remapped scalar fields by the sum of the weights on "
+                             f"unmasked source points, instead of treating land (fill) values as zero.")
+    parser.add_argument("--src_vrt_file",
+                        required=False,
+                        help=f"Name of netCDF file containing the source vertical levels (e.g., mx025.ocean_vgrid.nc). "
+                             f"If given with `--src_vrt_name`, 3D fields are linearly interpolated from these levels "
+                             f"onto the `--dz_name` levels of `--vrt_file` (0 below the deepest source level). "
+                             f"Not compatible with `--block_size`.")
+    parser.add_argument("--src_vrt_name",
+                        required=False,
+                        help=f"Name of source vertical level variable in `src_vrt_file` (e.g., zt)")
+    parser.add_argument("--obc_segment",
+                        required=False,
+                        help=f"Write `out_file` as MOM6 open boundary segment (e.g., 001): renames the dimensions "
+                             f"to nz/ny/nx_segment_NNN and adds dz_<field>_segment_NNN and lon/lat_segment_NNN. "
+                             f"Output variables should be named <field>_segment_NNN (see `--var_name_out`).")
+    parser.add_argument("--obc_hgrid_file",
+                        required=False,
+                        help=f"Supergrid file of the boundary segment (ocean_hgrid_NNN.nc) for the segment lon/lat")
+    parser.add_argument("--obc_compact_dz",
+                        required=False,
+                        type=bool,
+                        help=f"Specify as True to store the segment dz fields compressed. They only vary "
+                             f"with depth, so this makes them nearly free on disk.")
     parser.add_argument("--var_name_out", 
                         nargs='+',
                         required=False, 
@@ -170,8 +339,34 @@ if __name__=="__main__":
     parser.add_argument("--add_eta",
                         required=False,
                         type=bool,
-                        help=f"Calculate thickness (eta) and add to output file")
+                        help=f"Specify as True to also write the interface heights (eta) of a layer thickness "
+                             f"field, along the 'zp' interface dimension, computed from the remapped thicknesses.")
+    parser.add_argument("--manifest",
+                        required=False,
+                        help=f"JSON (or YAML) manifest listing fields to remap in a single process. "
+                             f"Each task uses the same keys as these arguments (see modules/manifest.py). "
+                             f"When given, all other arguments are ignored.")
+    parser.add_argument("--profile",
+                        required=False,
+                        help=f"Report file for the wall time, bytes read/written and peak memory of each stage "
+                             f"(read, mask, apply, rotate, write, ...) per field and block of depth levels. "
+                             f"Written as CSV if the name ends in .csv, JSON otherwise. "
+                             f"Defaults to a report in $PREP_PROFILE_DIR, if set (see remapping/profiling.py).")
 
-    args = parser.parse_args()  
+    return parser
+
+def parse_args(argv=None):
+    """ Parse command line arguments `argv` (defaults to sys.argv), which are optional with --manifest """
+    manifest_parser = argparse.ArgumentParser(add_help=False)
+    manifest_parser.add_argument("--manifest")
+    known, __ = manifest_parser.parse_known_args(argv)
+
+    parser = build_parser(require_args=(known.manifest is None))
+    parser.prog = os.path.basename(__file__) # Also when parsed by remap_service.py
+
+    return parser.parse_args(argv)
+
+if __name__=="__main__":
+    args = parse_args()
 
     main(args)
@@ -52,12 +52,14 @@ if [ $OCNINTYPE == 'gefs' ]; then
     ICFILENAME="${OCN_RUN_DIR}/inputs/Ct.mx025_SCRIP_masked.nc"
     BCFILENAME="${OCN_RUN_DIR}/inputs/Ct.mx025_SCRIP.nc"
     METHOD="neareststod"
+    WGT_TOOL="${OCN_WGT_TOOL:-kdtree}" # SCRIP source grids: nearest neighbour weights in Python
     ${NLN} ${OCN_SRC_DIR}/*.nc ${OCN_RUN_DIR}/inputs/.
 elif [[ "$OCNINTYPE" == 'rtofs' ]]; then
     WGT_FILE_BASE='rtofs2arctic'
     ICFILENAME="${OCN_RUN_DIR}/inputs/rtofs_global_ssh_ic.nc"
     BCFILENAME="${OCN_RUN_DIR}/inputs/rtofs_global_ssh_ic.nc"
     METHOD="neareststod"
+    WGT_TOOL="esmf"
 fi
 
 # ================================= #
@@ -92,12 +94,96 @@ generate_weight() {
     fi
 }
 
+# Usage: generate_weights src dst:wgt [dst:wgt ...]
+# Generates all missing weight files from one source grid. Nearest neighbour weights from a
+# SCRIP source are computed by utils/make_nn_weights.py in a single call, so the KD-tree on the
+# source grid is built once for every destination grid.
+generate_weights() {
+    local src="$1"; shift
+    local dsts=() wgts=()
+
+    for pair in "$@"; do
+        if [[ ! -e "${pair##*:}" ]]; then
+            dsts+=("${pair%%:*}")
+            wgts+=("${pair##*:}")
+        fi
+    done
+    [[ ${#wgts[@]} -eq 0 ]] && return 0
+
+    if [[ "$METHOD" == "neareststod" ]] && [[ "$WGT_TOOL" == "kdtree" ]]; then
+        log_info "-> Weight files do not exist: ${wgts[*]}. Generating with make_nn_weights.py..."
+        ${APRUNS} python "${OCN_SCRIPT_DIR}/utils/make_nn_weights.py" --src "$src" \
+            --dst "${dsts[@]}" --wgt "${wgts[@]}" --cache > /dev/null || error_exit "make_nn_weights.py failed on ${wgts[*]}"
+    else
+        for k in "${!wgts[@]}"; do
+            generate_weight "$src" "${dsts[$k]}" "${wgts[$k]}"
+        done
+    fi
+}
+
+# All fields (IC and every OBC segment) are collected into a single manifest
+# and remapped by one run_ocn_prep.py process (see modules/manifest.py)
+manifest_tasks=()
+OBC_PENDING=()
+IC_PENDING=""
+
+# Optional trailing arguments of add_vector_task / add_scalar_task are added to the
+# task as extra manifest keys (a JSON fragment, e.g. for OBC segment outputs)
+add_vector_task() {
+    local out="$1"
+    local ang="$2"
+    local time_out="$3"
+    local extra="$4"
+    shift 4
+    local wgts
+    wgts=$(printf '"%s", ' "$@")
+
+    manifest_tasks+=("{\"var_name\": [\"${OCN_U_VARNAME}\", \"${OCN_V_VARNAME}\"], \
+\"src_file\": [\"${INPUT_DIR}/${OCN_U_SRC_FILE}\", \"${INPUT_DIR}/${OCN_V_SRC_FILE}\"], \
+\"src_ang_name\": \"${OCN_SRC_ANG_NAME}\", \"src_ang_file\": \"${INPUT_DIR}/${OCN_SRC_ANG_FILE}\", \
+\"src_ang_supergrid\": \"${OCN_SRC_CONVERT_ANG}\", \"dst_ang_name\": \"${OCN_DST_ANG_NAME}\", \
+\"dst_ang_file\": \"${ang}\", \"dst_ang_supergrid\": \"${OCN_DST_CONVERT_ANG}\", \
+\"wgt_file\": [${wgts%, }], \"out_file\": \"${out}\", \"time_name_out\": \"${time_out}\"${extra:+, ${extra}}}")
+}
+
+add_scalar_task() {
+    local var="$1"
+    local src="$2"
+    local wgt="$3"
+    local out="$4"
+    local time_out="$5"
+    local extra="$6"
+
+    manifest_tasks+=("{\"var_name\": \"${var}\", \"src_file\": \"${src}\", \"wgt_file\": \"${wgt}\", \
+\"out_file\": \"${out}\", \"time_name_out\": \"${time_out}\"${extra:+, ${extra}}}")
+}
+
+# With OCN_VRT_INTERP=True, 3D fields are also interpolated from the source levels
+# (OCN_SRC_VRT_FILE / OCN_SRC_VRT_NAME) onto the destination levels (OCN_DST_VRT_NAME)
+write_manifest() {
+    local sep=""
+    local vrt_interp=""
+    if [[ "${OCN_VRT_INTERP:-False}" == "True" ]]; then
+        vrt_interp=", \"src_vrt_file\": \"${INPUT_DIR}/${OCN_SRC_VRT_FILE}\", \"src_vrt_name\": \"${OCN_SRC_VRT_NAME}\""
+    fi
+    {
+        printf '{\n  "defaults": {"vrt_file": "%s", "dz_name": "%s", "time_name": "%s"%s},\n  "tasks": [\n' \
+            "${DST_VRT_FILE_PATH}" "${OCN_DST_VRT_NAME}" "${OCN_TIME_VARNAME}" "${vrt_interp}"
+        for task in "${manifest_tasks[@]}"; do
+            printf '%s    %s' "${sep}" "${task}"
+            sep=$',\n'
+        done
+        printf '\n  ]\n}\n'
+    } > "${MANIFEST_PATH}"
+}
+
 # ================================= #
 # Initial Conditions (IC) Setup     #
 # ================================= #
 
 INPUT_DIR="${OCN_RUN_DIR}/inputs"
 OUTPUT_DIR="${OCN_RUN_DIR}/intercom"
+MANIFEST_PATH="${OUTPUT_DIR}/ocn_prep_manifest.json"
 OUT_FILE_PATH="${OUTPUT_DIR}/${OCN_IC_FILE}"
 TMP_FILE_PATH="${OUT_FILE_PATH}.tmp"
 DST_VRT_FILE_PATH="${INPUT_DIR}/${OCN_DST_VRT_FILE}"
@@ -139,26 +225,13 @@ else
     fi
     
     # Generate Center, U, and V Weights
-    generate_weight "${ICFILENAME}" "ocean_mask.nc"      "${WGT_FILE_BASE}_h.nc"
-    generate_weight "${ICFILENAME}" "ocean_subgrid_v.nc" "${WGT_FILE_BASE}_v.nc"
-    generate_weight "${ICFILENAME}" "ocean_subgrid_u.nc" "${WGT_FILE_BASE}_u.nc"
+    generate_weights "${ICFILENAME}" "ocean_mask.nc:${WGT_FILE_BASE}_h.nc" \
+        "ocean_subgrid_v.nc:${WGT_FILE_BASE}_v.nc" "ocean_subgrid_u.nc:${WGT_FILE_BASE}_u.nc"
     
     rm -f "$TMP_FILE_PATH"
 
-    ${APRUNS} python "${OCN_SCRIPT_DIR}/run_ocn_prep.py" \
-        --var_name "${OCN_U_VARNAME}" "${OCN_V_VARNAME}" \
-        --src_file "${INPUT_DIR}/${OCN_U_SRC_FILE}" "${INPUT_DIR}/${OCN_V_SRC_FILE}" \
-        --src_ang_name "${OCN_SRC_ANG_NAME}" \
-        --src_ang_file "${INPUT_DIR}/${OCN_SRC_ANG_FILE}" \
-        --src_ang_supergrid "${OCN_SRC_CONVERT_ANG}" \
-        --dst_ang_name "${OCN_DST_ANG_NAME}" \
-        --dst_ang_file "${INPUT_DIR}/${OCN_DST_ANG_FILE}" \
-        --dst_ang_supergrid "${OCN_DST_CONVERT_ANG}" \
-        --wgt_file "${INPUT_DIR}/${WGT_FILE_BASE}_u.nc" "${INPUT_DIR}/${WGT_FILE_BASE}_v.nc" \
-        --vrt_file "${DST_VRT_FILE_PATH}" \
-        --out_file "${TMP_FILE_PATH}" \
-        --dz_name "${OCN_DST_VRT_NAME}" \
-        --time_name "${OCN_TIME_VARNAME}" || error_exit "U-V Vector remapping failed."
+    add_vector_task "${TMP_FILE_PATH}" "${INPUT_DIR}/${OCN_DST_ANG_FILE}" "${OCN_TIME_VARNAME}" "" \
+        "${INPUT_DIR}/${WGT_FILE_BASE}_u.nc" "${INPUT_DIR}/${WGT_FILE_BASE}_v.nc"
     
     # Define scalars in a delimited array: "DisplayName:VariableName:SourceFile"
     scalars=(
@@ -169,27 +242,18 @@ else
     )
     
     for item in "${scalars[@]}"; do
-        desc="${item%%:*}"
         rest="${item#*:}"
         var_name="${rest%%:*}"
         src_file="${rest#*:}"
+
+        # Interface heights (eta) are written together with the remapped thickness
+        extra=""
+        [[ "${var_name}" == "${OCN_THK_VARNAME}" ]] && extra='"add_eta": true'
     
-        ${APRUNS} python "${OCN_SCRIPT_DIR}/run_ocn_prep.py" \
-            --var_name "${var_name}" \
-            --src_file "${INPUT_DIR}/${src_file}" \
-            --wgt_file "${H_WGT}" \
-            --vrt_file "${DST_VRT_FILE_PATH}" \
-            --out_file "${TMP_FILE_PATH}" \
-            --dz_name "${OCN_DST_VRT_NAME}" \
-            --time_name "${OCN_TIME_VARNAME}" || error_exit "${desc} remapping failed."
+        add_scalar_task "${var_name}" "${INPUT_DIR}/${src_file}" "${H_WGT}" "${TMP_FILE_PATH}" "${OCN_TIME_VARNAME}" "${extra}"
     done
 
-    ${APRUNS} python "${OCN_SCRIPT_DIR}/utils/add_eta.py" \
-        --file_name "${TMP_FILE_PATH}" \
-        --thickness_variable "${OCN_THK_VARNAME}" \
-        --time_dim "${OCN_TIME_VARNAME}" || error_exit "Failed to add ETA variable."
-
-    mv "${TMP_FILE_PATH}" "${OUT_FILE_PATH}"
+    IC_PENDING=1
 fi
 
 # ================================= #
@@ -219,12 +283,29 @@ fi
 TMP_VARNAME_OUT="${OCN_TMP_VARNAME_OUT:-$OCN_TMP_VARNAME}"
 TIME_VARNAME_OUT="${OCN_TIME_VARNAME_OUT:-$OCN_TIME_VARNAME}"
 
+# "SegmentField:VariableName:SourceFile", written as <SegmentField>_segment_NNN
 obc_scalars=(
-    "Temperature:${OCN_TMP_VARNAME}:${OCN_TMP_SRC_FILE}"
-    "Salinity:${OCN_SAL_VARNAME}:${OCN_SAL_SRC_FILE}"
-    "SSH:${OCN_SSH_VARNAME}:${OCN_SSH_SRC_FILE}"
+    "temp:${OCN_TMP_VARNAME}:${OCN_TMP_SRC_FILE}"
+    "salinity:${OCN_SAL_VARNAME}:${OCN_SAL_SRC_FILE}"
+    "ssh:${OCN_SSH_VARNAME}:${OCN_SSH_SRC_FILE}"
 )
 
+# Segment weights are sliced from one weight file onto every supergrid point,
+# instead of running ESMF once per ocean_hgrid_NNN.nc edge (see utils/slice_edge_weights.py)
+missing_segments=()
+for i in 001 002 003 004; do
+    if [[ ! -s "${OUTPUT_DIR}/${OCN_OUT_FILE_PATH_BASE}${i}${OCN_FILE_TAIL}" ]] && [[ ! -e "${WGT_FILE_BASE}_${i}.nc" ]]; then
+        missing_segments+=("${i}")
+    fi
+done
+if [[ ${#missing_segments[@]} -gt 0 ]]; then
+    generate_weights "${BCFILENAME}" "ocean_hgrid.nc:${WGT_FILE_BASE}_hgrid.nc"
+    log_info "-> Slicing OBC weights for segments ${missing_segments[*]}..."
+    ${APRUNS} python "${OCN_SCRIPT_DIR}/utils/slice_edge_weights.py" \
+        --fin "${WGT_FILE_BASE}_hgrid.nc" --out "${WGT_FILE_BASE}" \
+        --segments "${missing_segments[@]}" --cache || error_exit "Failed to slice OBC weights."
+fi
+
 for i in 001 002 003 004; do
     
     WGT_FILE="${WGT_FILE_BASE}_${i}.nc"
@@ -242,84 +323,57 @@ for i in 001 002 003 004; do
     log_info "-> Processing OBC Boundary ${i}"
 
     rm -f "$OBC_TMP_PATH"
-    
-    generate_weight "${BCFILENAME}" "ocean_hgrid_${i}.nc" "${WGT_FILE}"
+
+    # Fields are written directly in the MOM6 segment layout (see modules/obc.py)
+    SEGMENT_KEYS="\"dz_name_out\": \"nz_segment_${i}\", \"obc_segment\": \"${i}\", \"obc_hgrid_file\": \"${HGRID_PATH}\""
 
     # --- 1. Remap U-V Vectors ---
-    ${APRUNS} python "${OCN_SCRIPT_DIR}/run_ocn_prep.py" \
-        --var_name "${OCN_U_VARNAME}" "${OCN_V_VARNAME}" \
-        --src_file "${INPUT_DIR}/${OCN_U_SRC_FILE}" "${INPUT_DIR}/${OCN_V_SRC_FILE}" \
-        --src_ang_name "${OCN_SRC_ANG_NAME}" \
-        --src_ang_file "${INPUT_DIR}/${OCN_SRC_ANG_FILE}" \
-        --src_ang_supergrid "${OCN_SRC_CONVERT_ANG}" \
-        --dst_ang_name "${OCN_DST_ANG_NAME}" \
-        --dst_ang_file "${ANG_FILE}" \
-        --dst_ang_supergrid "${OCN_DST_CONVERT_ANG}" \
-        --wgt_file "${WGT_PATH}" \
-        --vrt_file "${DST_VRT_FILE_PATH}" \
-        --out_file "${OBC_TMP_PATH}" \
-        --dz_name "${OCN_DST_VRT_NAME}" \
-        --time_name "${OCN_TIME_VARNAME}" \
-        --time_name_out "${TIME_VARNAME_OUT}" || error_exit "OBC Boundary ${i} U-V remapping failed."
+    add_vector_task "${OBC_TMP_PATH}" "${ANG_FILE}" "${TIME_VARNAME_OUT}" \
+        "\"var_name_out\": [\"u_segment_${i}\", \"v_segment_${i}\"], ${SEGMENT_KEYS}" "${WGT_PATH}"
 
     # --- 2. Remap Scalars ---
     for item in "${obc_scalars[@]}"; do
-        desc="${item%%:*}"
+        field="${item%%:*}"
         rest="${item#*:}"
         var_name="${rest%%:*}"
         src_file="${rest#*:}"
 
-        ${APRUNS} python "${OCN_SCRIPT_DIR}/run_ocn_prep.py" \
-            --var_name "${var_name}" \
-            --src_file "${INPUT_DIR}/${src_file}" \
-            --wgt_file "${WGT_PATH}" \
-            --vrt_file "${DST_VRT_FILE_PATH}" \
-            --out_file "${OBC_TMP_PATH}" \
-            --dz_name "${OCN_DST_VRT_NAME}" \
-            --time_name "${OCN_TIME_VARNAME}" \
-            --time_name_out "${TIME_VARNAME_OUT}" || error_exit "OBC Boundary ${i} ${desc} remapping failed."
+        add_scalar_task "${var_name}" "${INPUT_DIR}/${src_file}" "${WGT_PATH}" "${OBC_TMP_PATH}" "${TIME_VARNAME_OUT}" \
+            "\"var_name_out\": \"${field}_segment_${i}\", ${SEGMENT_KEYS}"
     done
 
-    # --- 3. Format NetCDF Files (NCO) ---
-    
-    # Rename dimensions and variables
-    ncrename -O \
-        -d "${OCN_DST_VRT_NAME},nz_segment_${i}" \
-        -d "yh,ny_segment_${i}" \
-        -d "xh,nx_segment_${i}" \
-        -v "${OCN_SSH_VARNAME},ssh_segment_${i}" \
-        -v "${OCN_TMP_VARNAME},temp_segment_${i}" \
-        -v "${OCN_SAL_VARNAME},salinity_segment_${i}" \
-        -v "${OCN_U_VARNAME},u_segment_${i}" \
-        -v "${OCN_V_VARNAME},v_segment_${i}" "${OBC_TMP_PATH}"
-
-    # Generate dz arrays via ncap2
-    ncap2 -O -s "dz_u_segment_${i}[${TIME_VARNAME_OUT},nz_segment_${i},ny_segment_${i},nx_segment_${i}]=${OCN_DST_VRT_NAME}(:)" "${OBC_TMP_PATH}" "${OBC_TMP_PATH}"
-    ncap2 -O -s "dz_v_segment_${i}[${TIME_VARNAME_OUT},nz_segment_${i},ny_segment_${i},nx_segment_${i}]=${OCN_DST_VRT_NAME}(:)" "${OBC_TMP_PATH}" "${OBC_TMP_PATH}"
-    ncap2 -O -s "dz_ssh_segment_${i}[${TIME_VARNAME_OUT},nz_segment_${i},ny_segment_${i},nx_segment_${i}]=${OCN_DST_VRT_NAME}(:)" "${OBC_TMP_PATH}" "${OBC_TMP_PATH}"
-    ncap2 -O -s "dz_salinity_segment_${i}[${TIME_VARNAME_OUT},nz_segment_${i},ny_segment_${i},nx_segment_${i}]=${OCN_DST_VRT_NAME}(:)" "${OBC_TMP_PATH}" "${OBC_TMP_PATH}"
-    ncap2 -O -s "dz_temp_segment_${i}[${TIME_VARNAME_OUT},nz_segment_${i},ny_segment_${i},nx_segment_${i}]=${OCN_DST_VRT_NAME}(:)" "${OBC_TMP_PATH}" "${OBC_TMP_PATH}"
-
-    # Remove the original vertical coordinate variable
-    ncks -O -x -v "${OCN_DST_VRT_NAME}" "${OBC_TMP_PATH}" "${OBC_TMP_PATH}" > /dev/null 2>&1
-
-    # Extract Lat/Lon from HGRID and append to OBC output safely
-    rm -f tmp.nc
-    if [[ "$i" == "001" ]] || [[ "$i" == "002" ]]; then
-        ncap2 -A -v -s "lon_segment_${i}[nxp]=x(0,:)" "${HGRID_PATH}" tmp.nc
-        ncap2 -A -v -s "lat_segment_${i}[nxp]=y(0,:)" "${HGRID_PATH}" tmp.nc
-        ncrename -d "nxp,nx_segment_${i}" tmp.nc
-    elif [[ "$i" == "003" ]] || [[ "$i" == "004" ]]; then
-        ncap2 -A -v -s "lon_segment_${i}[nyp]=x(:,0)" "${HGRID_PATH}" tmp.nc
-        ncap2 -A -v -s "lat_segment_${i}[nyp]=y(:,0)" "${HGRID_PATH}" tmp.nc
-        ncrename -d "nyp,ny_segment_${i}" tmp.nc
+    OBC_PENDING+=("${i}")
+done
+
+# ================================= #
+# Remap All Fields (single process) #
+# ================================= #
+
+if [[ ${#manifest_tasks[@]} -gt 0 ]]; then
+    log_info "-> Remapping ${#manifest_tasks[@]} ocean fields..."
+    write_manifest
+    # Remap each field with several local processes, by bands of destination rows (see modules/parallel.py)
+    NPROCS_ARGS=()
+    if [[ -n "${OCN_REMAP_NPROCS}" ]]; then
+        NPROCS_ARGS=(--nprocs "${OCN_REMAP_NPROCS}")
+    fi
+    if [[ -n "${OCN_REMAP_SOCKET}" ]]; then
+        # Run in the remap service on this node, started on first use (see remap_service.py)
+        python "${OCN_SCRIPT_DIR}/remap_client.py" --socket "${OCN_REMAP_SOCKET}" --start True \
+            --manifest "${MANIFEST_PATH}" "${NPROCS_ARGS[@]}" || error_exit "Ocean remapping failed."
+    else
+        ${APRUNS} python "${OCN_SCRIPT_DIR}/run_ocn_prep.py" \
+            --manifest "${MANIFEST_PATH}" "${NPROCS_ARGS[@]}" || error_exit "Ocean remapping failed."
     fi
+fi
 
-    ncap2 -A -v -s "lon_segment_${i}=lon_segment_${i}" tmp.nc "${OBC_TMP_PATH}"
-    ncap2 -A -v -s "lat_segment_${i}=lat_segment_${i}" tmp.nc "${OBC_TMP_PATH}"
-    rm -f tmp.nc
+if [[ -n "${IC_PENDING}" ]]; then
+    mv "${TMP_FILE_PATH}" "${OUT_FILE_PATH}"
+fi
 
-    mv "${OBC_TMP_PATH}" "${OBC_OUT_PATH}"
+for i in "${OBC_PENDING[@]}"; do
+    OBC_OUT_PATH="${OUTPUT_DIR}/${OCN_OUT_FILE_PATH_BASE}${i}${OCN_FILE_TAIL}"
+    mv "${OBC_OUT_PATH}.tmp" "${OBC_OUT_PATH}"
 done
 
 log_info "-> Ocean Prep complete."
@@ -0,0 +1,58 @@
+"""
+Script Name: make_nn_weights.py
+Description:
+    Generates nearest neighbour weight files in the ESMF_RegridWeightGen format
+    (equivalent to `-m neareststod --dst_loc center`) without ESMF. A KD-tree is built once
+    on the 3D unit-sphere coordinates of the unmasked cells of a SCRIP source grid
+    (e.g., Ct.mx025_SCRIP_masked.nc) and every destination grid given (ocean_mask.nc,
+    ocean_subgrid_{u,v}.nc, ocean_hgrid.nc, ...) is queried against it in bulk, in parallel.
+
+    Destination latitude/longitude variables are found by their units (degrees_north /
+    degrees_east), see modules/nearest.py.
+
+Example:
+    make_nn_weights.py --src Ct.mx025_SCRIP_masked.nc \
+        --dst ocean_mask.nc ocean_subgrid_v.nc ocean_subgrid_u.nc \
+        --wgt gefs2arctic_h.nc gefs2arctic_v.nc gefs2arctic_u.nc
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from modules import nearest
+from remapping import weights
+
+def main(args):
+    if len(args.dst) != len(args.wgt):
+        raise ValueError(f"{len(args.dst)} destination grids but {len(args.wgt)} weight files.")
+
+    start = time.perf_counter()
+    nearest.source_tree(args.src)
+    print(f"KD-tree on '{args.src}' built in {time.perf_counter() - start:.1f} s")
+
+    for dst_file, wgt_file in zip(args.dst, args.wgt):
+        start = time.perf_counter()
+        col, meta = nearest.nearest_weights(args.src, dst_file, workers=args.workers)
+        nearest.write_weights(wgt_file, col, meta, src_file=args.src, dst_file=dst_file)
+        print(f"{wgt_file}: {meta['n_b']} points in {time.perf_counter() - start:.1f} s")
+
+        if args.cache:
+            weights.load_weights(wgt_file) # Compile into the weight cache
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Generate nearest neighbour weights with a KD-tree")
+    parser.add_argument("--src", required=True, help="SCRIP source grid file (grid_imask = 0 points are skipped)")
+    parser.add_argument("--dst", required=True, nargs='+', help="Destination grid files")
+    parser.add_argument("--wgt", required=True, nargs='+', help="Output weight file for each destination grid")
+    parser.add_argument("--workers", type=int, default=-1,
+                        help="Number of threads for the KD-tree queries (default: -1, all cores)")
+    parser.add_argument("--cache", action='store_true',
+                        help="Also compile the new weight files into the weight cache (see remapping/weights.py)")
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,120 @@
+"""
+Script Name: slice_edge_weights.py
+Description:
+    Derives the OBC segment weight files (<base>_001.nc ... <base>_004.nc) by selecting the
+    edge rows of a weight file generated once for every point of the supergrid
+    (ESMF_RegridWeightGen -d ocean_hgrid.nc --dst_loc center), instead of running
+    ESMF_RegridWeightGen again for each ocean_hgrid_NNN.nc edge strip.
+
+    The edges are the same supergrid rows/columns that extract_edges.py writes out:
+        001: nyp=[-1]   002: nyp=[0]   003: nxp=[-1]   004: nxp=[0]
+
+    The h/u/v operators cannot be used instead, since the supergrid corner points
+    (even i and j) are not part of any subgrid, and rows j=0 / columns i=0 are not in the
+    v / u subgrids (see make_subgrids.py).
+"""
+
+import os
+import sys
+import argparse
+import numpy as np
+from netCDF4 import Dataset
+
+# Remapping engine, to compile the new weight files into the weight cache
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from remapping import weights
+
+# Edge strip of each OBC segment: (supergrid dimension, index along it), as in extract_edges.py
+EDGES = {'001': ('nyp', -1), '002': ('nyp', 0), '003': ('nxp', -1), '004': ('nxp', 0)}
+
+def edge_points(segment, nxp, nyp):
+    """ Flat supergrid indices (j*nxp + i) of a segment's edge strip.
+
+    Parameters:
+        segment (str): Segment number ('001' to '004')
+        nxp, nyp (int): Supergrid dimensions
+
+    Returns:
+        points (ndarray): Destination rows of the supergrid operator on the edge, in strip order
+        dst_dims (list): ESMF (nx, ny) dimensions of the edge strip
+    """
+    dim, index = EDGES[segment]
+    if dim == 'nyp': # Row of nxp points
+        j = index % nyp
+        return j*nxp + np.arange(nxp), [nxp, 1]
+    else: # Column of nyp points
+        i = index % nxp
+        return np.arange(nyp)*nxp + i, [1, nyp]
+
+def write_edge_weights(wgt_in, out_file, points, dst_dims):
+    """ Write the rows `points` of an ESMF weight file as a new ESMF weight file.
+
+    Variables along `n_b` (e.g., frac_b, xc_b, mask_b) are subset to `points`, variables along
+    `n_s` to the weights kept, and everything else is copied unchanged.
+
+    Parameters:
+        wgt_in (netCDF4.Dataset): Supergrid weight file
+        out_file (str): Output weight file
+        points (ndarray): Destination rows (0-based) to keep, in output order
+        dst_dims (list): ESMF dimensions of the destination strip
+    """
+    nb = len(wgt_in.dimensions['n_b'])
+    row = np.asarray(wgt_in.variables['row'][:], dtype=np.int64) - 1
+
+    # Renumber kept destination rows to their position along the edge
+    position = np.full(nb, -1, dtype=np.int64)
+    position[points] = np.arange(len(points))
+    new_row = position[row]
+    keep = np.flatnonzero(new_row >= 0)
+
+    sizes = {'n_b': len(points), 'n_s': len(keep)}
+
+    with Dataset(out_file, 'w', format='NETCDF4') as ds:
+        ds.setncatts({name: wgt_in.getncattr(name) for name in wgt_in.ncattrs()})
+        for name, dim in wgt_in.dimensions.items():
+            ds.createDimension(name, sizes.get(name, None if dim.isunlimited() else len(dim)))
+
+        for name, var in wgt_in.variables.items():
+            out = ds.createVariable(name, var.dtype, var.dimensions)
+            out.setncatts({attr: var.getncattr(attr) for attr in var.ncattrs() if attr != '_FillValue'})
+
+            if name == 'row':
+                out[:] = new_row[keep] + 1 # 1-based
+            elif name == 'dst_grid_dims':
+                out[:] = dst_dims
+            elif 'n_s' in var.dimensions:
+                out[:] = var[:][keep]
+            elif 'n_b' in var.dimensions:
+                axis = var.dimensions.index('n_b')
+                out[:] = np.take(var[:], points, axis=axis)
+            else:
+                out[:] = var[:]
+
+def main(args):
+    with Dataset(args.fin, 'r') as wgt_in:
+        nxp, nyp = [int(d) for d in wgt_in.variables['dst_grid_dims'][:]] # Dims are flipped
+        if len(wgt_in.dimensions['n_b']) != nxp*nyp:
+            raise ValueError(f"'{args.fin}' does not map onto a {nyp} x {nxp} supergrid.")
+
+        for segment in args.segments:
+            points, dst_dims = edge_points(segment, nxp, nyp)
+            out_file = f"{args.out}_{segment}.nc"
+            write_edge_weights(wgt_in, out_file, points, dst_dims)
+
+            if args.cache:
+                weights.load_weights(out_file) # Compile into the weight cache
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Derive OBC edge weights from supergrid weights")
+    parser.add_argument("--fin", required=True,
+                        help="ESMF weight file onto every supergrid point (e.g., -d ocean_hgrid.nc --dst_loc center)")
+    parser.add_argument("--out", required=True,
+                        help="Output weight file base name (e.g., gefs2arctic writes gefs2arctic_001.nc ...)")
+    parser.add_argument("--segments", nargs='+', default=list(EDGES), choices=list(EDGES),
+                        help="Segments to write. Defaults to all four.")
+    parser.add_argument("--cache", action='store_true',
+                        help="Also compile the new weight files into the weight cache (see remapping/weights.py)")
+
+    args = parser.parse_args()
+
+    main(args)
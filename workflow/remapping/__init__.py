@@ -0,0 +1,4 @@
+from .weights import RemapOperator, load_weights, load_weights_with_meta, stack_operators, load_vector_operator
+from .rotation import to_radians, rotate_vector, convert_angle_to_subgrid
+from .batch import FILL_SENTINEL, apply_weights, apply_stacked
+from . import profiling
@@ -0,0 +1,77 @@
+import numpy as np
+
+from . import profiling
+
+# Placeholder written over land points when a variable has no fill value metadata
+FILL_SENTINEL = 1.2676506e+30
+
+def apply_weights(S_mat, data_src, masked=False):
+    """ Remaps a stack of K source levels in a single operation.
+
+    Parameters:
+        S_mat (weights.RemapOperator): (n_b, n_a) weight operator from `weights.load_weights`
+        data_src (ndarray): Source data of shape (K, ...), where trailing dimensions flatten to n_a
+        masked (bool): Fill values in `data_src` are already zeroed
+
+    Returns:
+        ndarray: Remapped data of shape (K, n_b), in the dtype of `S_mat`
+    """
+    N = FILL_SENTINEL # NaN placeholder value
+
+    nlev = np.shape(data_src)[0]
+    block = np.asarray(data_src).reshape(nlev, -1)
+
+    with profiling.stage('apply'):
+        if masked:
+            return S_mat.apply(block.astype(S_mat.dtype, copy=False))
+
+        if S_mat.is_gather: # Nearest neighbour: mask only the selected points
+            data_interp = S_mat.apply(block)
+            return np.where(data_interp==N, 0, data_interp).astype(S_mat.dtype, copy=False)
+
+        block = np.where(block==N, 0, block).astype(S_mat.dtype, copy=False)
+
+        return S_mat.apply(block)
+
+def apply_stacked(S_mat, fields, buffer=None):
+    """ Remaps several fields on the same source grid with one operator application.
+
+    Every field is copied (cast to the dtype of `S_mat`, `FILL_SENTINEL` values zeroed) into
+    consecutive rows of one (K, n_a) block, the block is remapped with one sparse product (or one
+    gather), and each field is returned as a view of its rows of the (K, n_b) result.
+
+    Parameters:
+        S_mat (weights.RemapOperator): (n_b, n_a) weight operator
+        fields (list of ndarray): Source fields of shape (nlev, ...), where trailing dimensions flatten to n_a
+        buffer (ndarray): Optional preallocated (K', n_a) block with K' >= K rows, reused between calls
+
+    Returns:
+        list of ndarray: (nlev, n_b) remapped rows of each field
+    """
+    N = FILL_SENTINEL # NaN placeholder value
+
+    fields = [np.asarray(data).reshape(np.shape(data)[0], -1) for data in fields]
+    nrows = sum(len(data) for data in fields)
+    if buffer is None:
+        buffer = np.empty((nrows, S_mat.shape[1]), dtype=S_mat.dtype)
+    elif len(buffer) < nrows:
+        raise ValueError(f"Buffer has {len(buffer)} rows, {nrows} are needed.")
+
+    with profiling.stage('mask'):
+        k0 = 0
+        for data in fields:
+            block = buffer[k0:k0+len(data)]
+            np.copyto(block, data, casting='unsafe')
+            block[data == N] = 0
+            k0 += len(data)
+
+    with profiling.stage('apply'):
+        data_interp = S_mat.apply(buffer[:nrows])
+
+    remapped = []
+    k0 = 0
+    for data in fields:
+        remapped.append(data_interp[k0:k0+len(data)])
+        k0 += len(data)
+
+    return remapped
@@ -0,0 +1,13 @@
+import os
+
+def file_key(fname):
+    """ (real path, size, mtime) identifying the current contents of a file """
+    st = os.stat(fname)
+    return (os.path.realpath(fname), st.st_size, st.st_mtime_ns)
+
+def is_current(key):
+    """ Whether the file identified by `key` (from `file_key`) is unchanged """
+    try:
+        return file_key(key[0]) == key
+    except OSError: # Removed
+        return False
@@ -0,0 +1,217 @@
+"""
+Opt-in per-stage instrumentation of the ocean and ice prep.
+
+Stages (netCDF reads, fill value masking, operator application, rotations, writes, ...) are
+wrapped in `stage(name)`, which records the wall time, bytes read and written and the peak RSS
+of the process at the end of the stage, labelled with the field (`var`) and block of depth
+levels (`block`) being processed (see `labels`). Nothing is recorded unless profiling is
+enabled, either with `--profile <report>` in run_ocn_prep.py / run_ice_prep.py, or for every
+invocation with the `PREP_PROFILE_DIR` environment variable (see `enable_from_env`).
+
+The report is written when the process exits: JSON (every stage record, plus totals per
+stage), or CSV (one row per stage record) for report files ending in `.csv`.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import atexit
+import datetime
+import resource
+import threading
+from contextlib import contextmanager
+
+# Directory to write a report for every invocation into, and its format ('json' or 'csv')
+PROFILE_DIR_ENV = 'PREP_PROFILE_DIR'
+PROFILE_FORMAT_ENV = 'PREP_PROFILE_FORMAT'
+
+FIELDS = ['stage', 'var', 'block', 'start_s', 'wall_s', 'bytes_read', 'bytes_written', 'max_rss_mib', 'max_rss_delta_mib']
+
+_report = None # Report file, None when profiling is disabled
+_records = []
+_lock = threading.Lock()
+_context = threading.local()
+_start = None
+_registered = False # Whether `write_report` runs at exit
+
+def max_rss_mib():
+    """ Peak resident set size of the process so far, in MiB """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 1024 # Bytes on macOS, KiB on Linux
+
+##########################
+###     Recording      ###
+##########################
+
+class Stage:
+    """ One timed stage. Bytes moved by the stage are added with `add`. """
+    __slots__ = ('bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, read=0, written=0):
+        self.bytes_read += int(read)
+        self.bytes_written += int(written)
+
+class _NullStage:
+    """ Stage handed out when profiling is disabled """
+    __slots__ = ()
+
+    def add(self, read=0, written=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+def enabled():
+    return _report is not None
+
+def current_labels():
+    """ Labels of the calling thread (see `labels`), e.g. to carry them into a worker thread """
+    return dict(getattr(_context, 'labels', {}))
+
+@contextmanager
+def _labels(**labels):
+    previous = getattr(_context, 'labels', {})
+    _context.labels = dict(previous, **{k: v for k, v in labels.items() if v is not None})
+    try:
+        yield
+    finally:
+        _context.labels = previous
+
+def labels(**labels):
+    """ Label every stage recorded by the calling thread within the block, e.g. `labels(var='Temp')` """
+    if _report is None:
+        return _NULL_STAGE
+    return _labels(**labels)
+
+@contextmanager
+def _stage(name, labels):
+    record = Stage()
+    rss0 = max_rss_mib()
+    t0 = time.perf_counter()
+    try:
+        yield record
+    finally:
+        wall = time.perf_counter() - t0
+        rss = max_rss_mib()
+        entry = dict(current_labels(), **{k: v for k, v in labels.items() if v is not None})
+        entry.update(stage=name, start_s=round(t0 - _start, 6), wall_s=round(wall, 6),
+                     bytes_read=record.bytes_read, bytes_written=record.bytes_written,
+                     max_rss_mib=round(rss, 1), max_rss_delta_mib=round(rss - rss0, 1))
+        if 'block' in entry:
+            entry['block'] = f"{entry['block'][0]}:{entry['block'][1]}"
+        with _lock:
+            _records.append(entry)
+
+def stage(name, **labels):
+    """ Time stage `name` of the enclosed block (see module docstring).
+
+    Parameters:
+        name (str): Stage name, e.g. 'read', 'mask', 'apply', 'rotate', 'write'
+        labels: Labels of this record in addition to those of `labels`, e.g. block=(d0, d1)
+
+    Returns:
+        Context manager yielding a `Stage`, whose `add(read=, written=)` counts bytes moved
+    """
+    if _report is None:
+        return _NULL_STAGE
+    return _stage(name, labels)
+
+##########################
+###      Reports       ###
+##########################
+
+def enable(report_file):
+    """ Start recording stages, and write them to `report_file` when the process exits """
+    global _report, _start, _registered
+    if not _registered:
+        atexit.register(write_report)
+        _registered = True
+    if _report is None:
+        _start = time.perf_counter()
+    _report = report_file
+
+def set_rank(rank):
+    """ Write the report of this process to `<report>.rank<rank>.<ext>`, for one rank of a parallel run """
+    global _report
+    if _report is not None:
+        root, ext = os.path.splitext(_report)
+        _report = f"{root}.rank{rank}{ext}"
+
+def disable():
+    """ Stop recording and forget the recorded stages, e.g. once a long-lived process
+        (see ocn/remap_service.py) has written the report of one request """
+    global _report
+    _report = None
+    with _lock:
+        _records.clear()
+
+def enable_from_env(prefix):
+    """ Enable profiling if `PREP_PROFILE_DIR` is set, with a report file named after the
+        invocation (`<prefix>.<date>.<pid>.json`, or `.csv` with `PREP_PROFILE_FORMAT=csv`).
+
+    Returns:
+        str: Report file, or None if the environment variable is not set
+    """
+    report_dir = os.environ.get(PROFILE_DIR_ENV)
+    if not report_dir:
+        return None
+
+    fmt = os.environ.get(PROFILE_FORMAT_ENV, 'json').lower()
+    stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+    os.makedirs(report_dir, exist_ok=True)
+    report_file = os.path.join(report_dir, f"{prefix}.{stamp}.{os.getpid()}.{fmt}")
+    n = 1
+    while os.path.exists(report_file): # Several reports per second from one process
+        report_file = os.path.join(report_dir, f"{prefix}.{stamp}.{os.getpid()}-{n}.{fmt}")
+        n += 1
+    enable(report_file)
+
+    return report_file
+
+def summary():
+    """ Totals per stage: count, wall time, bytes read and written, and the highest peak RSS """
+    totals = {}
+    for entry in _records:
+        total = totals.setdefault(entry['stage'], {'count': 0, 'wall_s': 0.0, 'bytes_read': 0, 'bytes_written': 0,
+                                                   'max_rss_mib': 0.0})
+        total['count'] += 1
+        total['wall_s'] = round(total['wall_s'] + entry['wall_s'], 6)
+        total['bytes_read'] += entry['bytes_read']
+        total['bytes_written'] += entry['bytes_written']
+        total['max_rss_mib'] = max(total['max_rss_mib'], entry['max_rss_mib'])
+
+    return totals
+
+def write_report(report_file=None):
+    """ Write the recorded stages to `report_file` (defaults to the file given to `enable`) """
+    report_file = report_file or _report
+    if report_file is None:
+        return
+
+    with _lock:
+        records = list(_records)
+
+    if report_file.endswith('.csv'):
+        extra = sorted({key for entry in records for key in entry} - set(FIELDS))
+        with open(report_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS + extra)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        report = {'command': sys.argv, 'pid': os.getpid(), 'host': os.uname().nodename,
+                  'wall_s': round(time.perf_counter() - _start, 6), 'max_rss_mib': round(max_rss_mib(), 1),
+                  'summary': summary(), 'stages': records}
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=1)
@@ -0,0 +1,73 @@
+import numpy as np
+
+from . import profiling
+
+def to_radians(a):
+    """ Converts angles to radians if they appear to be in degrees """
+    if np.size(a) and ((np.min(a) < -1*np.pi) or (np.max(a) > np.pi)): # Empty on ranks without rows
+        a = np.radians(a)
+
+    return a
+
+def rotate_vector(u, v, a, grid):
+    """ Rotates vector (u, v) by the angle, a.
+
+    Parameters:
+        u, v (ndarray): Vector components
+        a (ndarray): Grid angle, in radians or degrees (see `to_radians`), broadcast against u and v
+        grid (str): 'dst' rotates from North-East to grid alignment (u*cos(a) + v*sin(a)),
+                    'src' from grid to North-East alignment (u*cos(a) - v*sin(a))
+
+    Returns:
+        rotated_u, rotated_v (ndarray): Rotated components
+    """
+    if grid not in ('src', 'dst'):
+        raise ValueError("Rotation grid must be 'src' or 'dst'")
+
+    with profiling.stage('rotate'):
+        a = to_radians(np.asarray(a))
+
+        cosa = np.cos(a)
+        sina = np.sin(a)
+
+        if grid=='dst':
+            rotated_u = u*cosa + v*sina
+            rotated_v = v*cosa - u*sina
+        else:
+            rotated_u = u*cosa - v*sina
+            rotated_v = v*cosa + u*sina
+
+    return rotated_u, rotated_v
+
+def rotation_coefficients(a, grid, n):
+    """ Per-point coefficients (r11, r12, r21, r22) of the rotations in `rotate_vector`.
+        grid='dst' rotates from North-East to grid alignment, grid='src' from grid to North-East.
+        `a` may be None (no rotation) for `n` points. """
+    if a is None:
+        one, zero = np.ones(n), np.zeros(n)
+        return one, zero, zero, one
+
+    a = to_radians(np.asarray(a, dtype=np.float64).ravel())
+
+    cosa = np.cos(a)
+    sina = np.sin(a)
+
+    if grid == 'dst':
+        return cosa, sina, -sina, cosa
+    elif grid == 'src':
+        return cosa, -sina, sina, cosa
+    else:
+        raise ValueError("Rotation grid must be 'src' or 'dst'")
+
+def convert_angle_to_subgrid(var, gridtype):
+    """Converts from supergrid to specified subgrid points"""
+    if gridtype == "center": # Extract center points of grid
+        cvar = var[1::2, 1::2]
+    elif gridtype == "u": # Extract the East/West edges of grid
+        cvar = var[1::2,0::2]
+    elif gridtype == "v": # Extract the North/South edges of grid
+        cvar = var[0::2,1::2]
+    else:
+        raise ValueError("Grid type not supported. Must be center, u, or v")
+
+    return cvar
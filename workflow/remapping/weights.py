@@ -0,0 +1,589 @@
+import os
+import json
+import hashlib
+import numpy as np
+from netCDF4 import Dataset
+from scipy.sparse import coo_matrix, csr_matrix, diags, bmat, vstack
+
+from .rotation import rotation_coefficients
+from . import profiling
+from .files import file_key, is_current
+
+# Cache directory for compiled weight operators. Defaults to a `.remap_cache`
+# directory next to the weight file; set to "none" to disable caching.
+CACHE_DIR_ENV = 'REMAP_CACHE_DIR'
+CACHE_DIR_NAME = '.remap_cache'
+CACHE_VERSION = 1
+
+# In-process memo of loaded operators, keyed by (path, size, mtime)
+_loaded = {}
+# (path, size, mtime) of the weight files each `_loaded` entry was built from (see `drop_stale`)
+_sources = {}
+
+# Column gaps (in source points) wider than this split the source window into separate hyperslabs
+WINDOW_MIN_GAP = 64
+
+##########################
+###  Weight Operators  ###
+##########################
+
+class RemapOperator:
+    """ (n_b, n_a) remapping operator built from ESMF weights.
+
+    Selection operators, where every destination row has at most one weight of exactly 1.0
+    (e.g., all `neareststod` weights), are detected on construction and applied as a vectorized
+    index gather over a precomputed int32 index array. All other weights (bilinear, conservative)
+    are applied as a CSR sparse product.
+    """
+    def __init__(self, S_mat, src_dims=None, dst_dims=None, window=None, ncomp=1, entry_dir=None):
+        self.matrix = S_mat
+        self.shape = S_mat.shape
+        self.src_dims = src_dims # (nx, ny) as stored by ESMF
+        self.dst_dims = dst_dims
+        self.window = window # SourceWindow the columns refer to, or None for the full source grid
+        self.ncomp = ncomp # Number of stacked source components (e.g., 2 for fused u, v operators)
+        self.entry_dir = entry_dir # Weight cache entry the weights are mapped from (see `cast_weights`)
+        self.dtype = S_mat.dtype # Compute dtype: source data is cast to this before remapping
+        self.index = self.selection_index(S_mat)
+        self._windowed = {}
+        self._astype = {}
+        self._rows = {}
+
+        if self.index is not None:
+            self._empty_rows = np.flatnonzero(self.index < 0)
+            self._take_index = np.maximum(self.index, 0).astype(np.int32, copy=False)
+
+    @property
+    def is_gather(self):
+        return self.index is not None
+
+    @staticmethod
+    def selection_index(S_mat):
+        """ Return the source index for each destination row if `S_mat` is a selection operator,
+            with -1 for rows without a weight. Returns None for general weights. """
+        row_nnz = np.diff(S_mat.indptr)
+        if np.any(row_nnz > 1) or np.any(S_mat.data != 1.0):
+            return None
+
+        index = np.full(S_mat.shape[0], -1, dtype=np.int32)
+        rows = np.flatnonzero(row_nnz)
+        index[rows] = S_mat.indices[S_mat.indptr[rows]]
+
+        return index
+
+    def apply(self, block):
+        """ Remap a (K, n_a) block of source levels, returning a (K, n_b) block """
+        if self.is_gather:
+            data_interp = np.take(block, self._take_index, axis=1)
+            if self._empty_rows.size:
+                data_interp[:, self._empty_rows] = 0
+            return data_interp
+
+        # Stack levels as columns so each weight row is applied to all levels at once
+        data_interp = self.matrix.dot(np.ascontiguousarray(block.T))
+        return np.ascontiguousarray(data_interp.T)
+
+    def dot(self, x):
+        """ Matrix product with an (n_a,) vector or (n_a, K) block, matching scipy's `dot` """
+        x = np.asarray(x)
+        if x.ndim == 1:
+            return self.apply(x[np.newaxis, :])[0]
+
+        return self.apply(x.T).T
+
+    def source_columns(self):
+        """ Sorted unique source grid points referenced by the operator (in any component) """
+        if self.is_gather:
+            cols = self.index[self.index >= 0]
+        else:
+            cols = self.matrix.indices
+
+        return np.unique(cols % (self.shape[1] // self.ncomp))
+
+    def windowed(self, src_shape):
+        """ Operator restricted to the source points it references.
+
+        Derives the minimal source hyperslab(s) from the operator's column indices and returns
+        an operator compacted to those points, so only the window has to be read from file.
+
+        Parameters:
+            src_shape (tuple): (ny, nx) shape of the source data's horizontal dimensions
+
+        Returns:
+            RemapOperator: Compacted operator with a `window`, or this operator if the source
+                           shape does not match the weights or the window covers the whole grid.
+        """
+        src_shape = tuple(int(n) for n in src_shape)
+        if self.window is not None or self.src_dims is None:
+            return self
+        npts = src_shape[0]*src_shape[1]
+        if src_shape != (self.src_dims[1], self.src_dims[0]) or npts*self.ncomp != self.shape[1]:
+            return self
+
+        if src_shape not in self._windowed:
+            window = SourceWindow.from_columns(self.source_columns(), src_shape)
+
+            if window.size == npts:
+                self._windowed[src_shape] = self
+            else:
+                # Map full-grid source indices to positions in the window (per stacked component)
+                position = np.full(self.shape[1], -1, dtype=np.int32)
+                points = window.points()
+                for c in range(self.ncomp):
+                    position[c*npts + points] = c*window.size + np.arange(window.size, dtype=np.int32)
+
+                S_win = csr_matrix((self.matrix.data, position[self.matrix.indices], self.matrix.indptr),
+                                   shape=(self.shape[0], self.ncomp*window.size))
+                self._windowed[src_shape] = RemapOperator(S_win, self.src_dims, self.dst_dims, window, self.ncomp,
+                                                          self.entry_dir) # Same weights
+
+        return self._windowed[src_shape]
+
+    def take_rows(self, ranges):
+        """ Operator restricted to some destination points (rows), e.g. the rows of one rank of a
+            row-partitioned parallel remap (see ocn/modules/parallel.py).
+
+        Parameters:
+            ranges (list of tuple): (r0, r1) ranges of rows to keep, in order
+
+        Returns:
+            RemapOperator: (sum of r1-r0, n_a) operator, with the source dims and components of this one
+        """
+        ranges = tuple((int(r0), int(r1)) for r0, r1 in ranges)
+        if ranges not in self._rows:
+            rows = np.concatenate([np.arange(r0, r1) for r0, r1 in ranges] + [np.zeros(0, dtype=int)])
+            self._rows[ranges] = RemapOperator(self.matrix[rows], self.src_dims, self.dst_dims, self.window, self.ncomp)
+
+        return self._rows[ranges]
+
+    def astype(self, dtype):
+        """ Operator with weights (and therefore remapped data) in `dtype`, e.g. float32 to halve
+            the memory traffic of the product. Returns this operator if it is already in `dtype`. """
+        dtype = np.dtype(dtype)
+        if dtype == self.dtype:
+            return self
+
+        if dtype not in self._astype:
+            S_cast = csr_matrix((cast_weights(self.matrix.data, dtype, self.entry_dir), self.matrix.indices,
+                                 self.matrix.indptr), shape=self.shape)
+            self._astype[dtype] = RemapOperator(S_cast, self.src_dims, self.dst_dims, self.window, self.ncomp,
+                                                self.entry_dir)
+
+        return self._astype[dtype]
+
+    def read_source(self, var, index):
+        """ Read the source points used by this operator.
+
+        Parameters:
+            var (netCDF4.Variable): Source variable with horizontal (ny, nx) trailing dimensions
+            index (tuple): Indices for the leading dimensions (e.g., `(t,)`)
+
+        Returns:
+            ndarray: Source data with horizontal dimensions flattened to n_a
+        """
+        if self.window is not None:
+            return self.window.read(var, index)
+
+        data_src = np.array(var[index])
+        return data_src.reshape(data_src.shape[:-2] + (-1,))
+
+    def source_points(self, arr):
+        """ Flatten a full (ny, nx) source-grid array (e.g., angles) to this operator's source points """
+        if self.window is not None:
+            return self.window.extract(arr)
+
+        return np.asarray(arr).ravel()
+
+class SourceWindow:
+    """ Set of rectangular source hyperslabs, stored as (j0, j1, i0, i1) bounds """
+    def __init__(self, slabs, src_shape):
+        self.slabs = slabs
+        self.src_shape = src_shape
+        self.size = sum((j1-j0)*(i1-i0) for j0, j1, i0, i1 in slabs)
+
+    @classmethod
+    def from_columns(cls, cols, src_shape, min_gap=None):
+        """ Bounding hyperslabs of the flattened source indices `cols`. Runs of used x-columns
+            separated by more than `min_gap` unused columns get separate hyperslabs. """
+        min_gap = WINDOW_MIN_GAP if min_gap is None else min_gap
+        if len(cols) == 0: # E.g., a rank without destination rows
+            return cls([(0, 0, 0, 0)], src_shape)
+        jj, ii = np.divmod(np.asarray(cols, dtype=np.int64), src_shape[1])
+
+        used_i = np.unique(ii)
+        breaks = np.flatnonzero(np.diff(used_i) > min_gap+1)
+        starts = np.concatenate(([used_i[0]], used_i[breaks+1]))
+        ends = np.concatenate((used_i[breaks], [used_i[-1]])) + 1
+
+        slabs = []
+        for i0, i1 in zip(starts, ends):
+            jsel = jj[(ii >= i0) & (ii < i1)]
+            slabs.append((int(jsel.min()), int(jsel.max())+1, int(i0), int(i1)))
+
+        return cls(slabs, src_shape)
+
+    def points(self):
+        """ Flattened full-grid indices of the window points, in window order """
+        nx = self.src_shape[1]
+        return np.concatenate([
+            (np.arange(j0, j1)[:, np.newaxis]*nx + np.arange(i0, i1)).ravel()
+            for j0, j1, i0, i1 in self.slabs
+        ])
+
+    def read(self, var, index):
+        """ Read the window from a netCDF variable, one hyperslab per slab """
+        lead = tuple(index) + (slice(None),) * (var.ndim - 2 - len(index))
+        parts = []
+        for j0, j1, i0, i1 in self.slabs:
+            part = np.array(var[lead + (slice(j0, j1), slice(i0, i1))])
+            parts.append(part.reshape(part.shape[:-2] + (-1,)))
+
+        return np.concatenate(parts, axis=-1)
+
+    def extract(self, arr):
+        """ Extract the window from an in-memory (..., ny, nx) array """
+        arr = np.asarray(arr)
+        parts = [arr[..., j0:j1, i0:i1].reshape(arr.shape[:-2] + (-1,)) for j0, j1, i0, i1 in self.slabs]
+
+        return np.concatenate(parts, axis=-1)
+
+##########################
+### ESMF Weight Files  ###
+##########################
+
+def read_esmf_weights(wgt_file):
+    """ Read a weight file generated by ESMF_RegridWeightGen into a CSR matrix.
+
+    Parameters:
+        wgt_file (str): Path to the ESMF weight file.
+
+    Returns:
+        S_mat (scipy.sparse.csr_matrix): (n_b, n_a) weight matrix with int32 indices.
+        meta (dict): Operator metadata (n_a, n_b, src_grid_dims, dst_grid_dims).
+    """
+    with Dataset(wgt_file, 'r') as wgt_grid:
+        na = len(wgt_grid.dimensions['n_a'])
+        nb = len(wgt_grid.dimensions['n_b'])
+        col = np.asarray(wgt_grid.variables['col'][:], dtype=np.int32)-1 # Convert to 0-base order
+        row = np.asarray(wgt_grid.variables['row'][:], dtype=np.int32)-1
+        S = np.asarray(wgt_grid.variables['S'][:], dtype=np.float64)
+
+        dst_dims = [int(d) for d in wgt_grid.variables['dst_grid_dims'][:]]
+        if 'src_grid_dims' in wgt_grid.variables:
+            src_dims = [int(d) for d in wgt_grid.variables['src_grid_dims'][:]]
+        else:
+            src_dims = None
+
+    S_mat = coo_matrix((S, (row, col)), shape=(nb, na)).tocsr()
+    S_mat.indices = S_mat.indices.astype(np.int32, copy=False)
+    S_mat.indptr = S_mat.indptr.astype(np.int32, copy=False)
+
+    meta = {'n_a': na, 'n_b': nb, 'src_grid_dims': src_dims, 'dst_grid_dims': dst_dims}
+
+    return S_mat, meta
+
+##########################
+###   Operator Cache   ###
+##########################
+
+def get_cache_dir(wgt_file):
+    """ Return the cache directory for a weight file, or None if caching is disabled """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(wgt_file)), CACHE_DIR_NAME)
+    elif cache_dir.lower() in ('', 'none', 'off'):
+        return None
+
+    return cache_dir
+
+def file_hash(fname, chunk_size=1<<23):
+    """ Content hash of a file, read in chunks """
+    h = hashlib.blake2b(digest_size=20)
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def _content_key(fname, cache_dir):
+    """ Content hash of a weight file. The hash is recorded against the file's
+        (path, size, mtime) so unchanged files are only hashed once. """
+    stat_key = hashlib.blake2b(repr(file_key(fname)).encode(), digest_size=20).hexdigest()
+    index_file = os.path.join(cache_dir, 'index', stat_key)
+
+    try:
+        with open(index_file, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        pass
+
+    key = file_hash(fname)
+    try:
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        _atomic_write_text(index_file, key)
+    except OSError:
+        pass
+
+    return key
+
+def _atomic_write_text(fname, text):
+    tmp = f"{fname}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, fname)
+
+def save_operator(entry_dir, S_mat, meta):
+    """ Write a CSR operator to `entry_dir` as memory-mappable .npy files.
+        Written to a temporary directory first so concurrent writers never expose a partial entry. """
+    tmp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    np.save(os.path.join(tmp_dir, 'indptr.npy'), np.asarray(S_mat.indptr, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, 'indices.npy'), np.asarray(S_mat.indices, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, 'data.npy'), np.asarray(S_mat.data))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(dict(meta, version=CACHE_VERSION), f)
+
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError: # Another process finished first
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+def cast_weights(data, dtype, entry_dir=None):
+    """ Weights `data` of a cached operator cast to `dtype`. The cast weights are stored beside
+        the entry's `data.npy` on first use (e.g., `data.float32.npy`) and memory-mapped, so the
+        pages of the compute dtype are shared between processes like the rest of the entry.
+        Casts in memory when there is no cache entry or it is not writable. """
+    dtype = np.dtype(dtype)
+    if entry_dir is not None:
+        data_file = os.path.join(entry_dir, f"data.{dtype.name}.npy")
+        try:
+            if not os.path.exists(data_file):
+                tmp = f"{data_file}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as f:
+                    np.save(f, np.asarray(data, dtype=dtype))
+                os.replace(tmp, data_file)
+            return np.load(data_file, mmap_mode='r')
+        except OSError:
+            pass
+
+    return np.asarray(data).astype(dtype)
+
+def load_operator(entry_dir):
+    """ Memory-map a cached CSR operator. Returns (S_mat, meta), or None if the entry is missing. """
+    try:
+        with open(os.path.join(entry_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('version') != CACHE_VERSION:
+        return None
+
+    indptr = np.load(os.path.join(entry_dir, 'indptr.npy'), mmap_mode='r')
+    indices = np.load(os.path.join(entry_dir, 'indices.npy'), mmap_mode='r')
+    data = np.load(os.path.join(entry_dir, 'data.npy'), mmap_mode='r')
+
+    S_mat = csr_matrix((data, indices, indptr), shape=(meta['n_b'], meta['n_a']), copy=False)
+    # Entries were written in canonical form; flag it so scipy never sorts the read-only arrays
+    S_mat.has_sorted_indices = True
+    S_mat.has_canonical_format = True
+
+    return S_mat, meta
+
+def load_weights(wgt_file):
+    """ Load an ESMF weight file as a CSR operator, using the on-disk cache when available.
+
+    Parameters:
+        wgt_file (str): Path to the ESMF weight file.
+
+    Returns:
+        S_mat (RemapOperator): (n_b, n_a) weight operator
+        dst_dims (ndarray): Destination grid dimensions (nx, ny)
+        nb (int): Number of destination points
+    """
+    S_mat, meta = load_weights_with_meta(wgt_file)
+
+    return S_mat, np.asarray(meta['dst_grid_dims']), meta['n_b']
+
+def load_weights_with_meta(wgt_file):
+    """ Same as `load_weights`, but returns the full metadata dictionary """
+    stat_key = file_key(wgt_file)
+    if stat_key in _loaded:
+        return _loaded[stat_key]
+
+    with profiling.stage('load_weights', weights=os.path.basename(wgt_file)) as stage:
+        cache_dir = get_cache_dir(wgt_file)
+        key = _content_key(wgt_file, cache_dir) if cache_dir is not None else None
+        S_mat, meta, entry_dir = _load_cached(cache_dir, key, lambda: read_esmf_weights(wgt_file))
+        stage.add(read=S_mat.data.nbytes + S_mat.indices.nbytes + S_mat.indptr.nbytes)
+
+    result = (RemapOperator(S_mat, meta['src_grid_dims'], meta['dst_grid_dims'], entry_dir=entry_dir), meta)
+    _loaded[stat_key] = result
+    _sources[stat_key] = (stat_key,)
+
+    return result
+
+def stack_operators(S_ops):
+    """ Stack operators that share a source grid row-wise into one operator, so a single read
+        of the source can be applied to every destination grid at once.
+
+    Parameters:
+        S_ops (list of RemapOperator): Operators with the same source grid
+
+    Returns:
+        S_stack (RemapOperator): Stacked operator; `dst_dims` lists the dims of each part
+        offsets (list of int): Row offset of each part in the stacked operator (plus the total)
+    """
+    key = ('stack',) + tuple(id(S_op) for S_op in S_ops)
+
+    if key not in _loaded:
+        S_mat = vstack([S_op.matrix for S_op in S_ops], format='csr')
+        S_mat.indices = S_mat.indices.astype(np.int32, copy=False)
+        S_mat.indptr = S_mat.indptr.astype(np.int32, copy=False)
+
+        offsets = np.concatenate(([0], np.cumsum([S_op.shape[0] for S_op in S_ops]))).tolist()
+        S_stack = RemapOperator(S_mat, S_ops[0].src_dims, [S_op.dst_dims for S_op in S_ops])
+        _loaded[key] = (S_stack, offsets, S_ops) # Keep parts referenced so their ids stay unique
+        _sources[key] = tuple(source for S_op in S_ops for source in _sources_of(S_op))
+
+    S_stack, offsets, __ = _loaded[key]
+
+    return S_stack, offsets
+
+def _sources_of(S_op):
+    """ (path, size, mtime) of the weight files a loaded operator was built from """
+    for key, entry in _loaded.items():
+        if entry[0] is S_op:
+            return _sources[key]
+
+    return ()
+
+def drop_stale():
+    """ Forget the loaded operators of weight files that changed or were removed since they were
+        loaded, with the stacked and fused operators built from them, so a long-lived process
+        (see ocn/remap_service.py) reloads them and does not keep the old ones in memory """
+    for key in [key for key, sources in _sources.items() if not all(is_current(source) for source in sources)]:
+        del _loaded[key], _sources[key]
+
+def _load_cached(cache_dir, key, build):
+    """ Load cache entry `key`, creating it with `build()` -> (S_mat, meta) on a miss.
+        Falls back to `build()` alone when caching is disabled or the cache is not writable.
+
+    Returns:
+        S_mat, meta: Operator and metadata
+        entry_dir (str): Cache entry the operator is mapped from, or None if it is in memory
+    """
+    if cache_dir is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            entry_dir = os.path.join(cache_dir, key)
+            result = load_operator(entry_dir)
+            if result is None:
+                S_mat, meta = build()
+                save_operator(entry_dir, S_mat, meta)
+                result = load_operator(entry_dir)
+                if result is None:
+                    return S_mat, meta, None
+            return result + (entry_dir,)
+        except OSError: # Read-only location; fall back to building the operator directly
+            pass
+
+    return build() + (None,)
+
+##########################
+###  Vector Operators  ###
+##########################
+
+def fuse_vector_operator(S_mats, src_angle, dst_angles, src_grid):
+    """ Fold source rotation, interpolation and destination rotation into one 2x2 block operator.
+
+    The fused operator maps the stacked source components [u; v] (2*n_a points) to the stacked
+    destination components. With one weight matrix (colocated u, v) the rows are [u; v] on the
+    same points. With two (staggered), the rows are u on the first grid and v on the second grid.
+
+    Parameters:
+        S_mats (list of csr_matrix): One (colocated) or two (u-, v-grid) weight matrices
+        src_angle (ndarray or None): Source grid angle at the n_a source points
+        dst_angles (list): Destination angle (or None) for each weight matrix
+        src_grid (str): Rotation applied on the source grid ('src' or 'dst', see `rotation_coefficients`)
+
+    Returns:
+        csr_matrix: (n_u + n_v, 2*n_a) fused operator
+    """
+    na = S_mats[0].shape[1]
+    a11, a12, a21, a22 = (diags(c) for c in rotation_coefficients(src_angle, src_grid, na))
+
+    if len(S_mats) == 1: # Both output components come from the same weights
+        rows = [(S_mats[0], dst_angles[0], 0), (S_mats[0], dst_angles[0], 1)]
+    else:
+        rows = [(S_mats[0], dst_angles[0], 0), (S_mats[1], dst_angles[1], 1)]
+
+    blocks = []
+    for S_mat, dst_angle, comp in rows:
+        b11, b12, b21, b22 = rotation_coefficients(dst_angle, 'dst', S_mat.shape[0])
+        bx1, bx2 = (diags(b11), diags(b12)) if comp == 0 else (diags(b21), diags(b22))
+
+        # out = Bx1 * S (A11 u + A12 v) + Bx2 * S (A21 u + A22 v)
+        S_u = bx1 @ S_mat @ a11 + bx2 @ S_mat @ a21
+        S_v = bx1 @ S_mat @ a12 + bx2 @ S_mat @ a22
+        blocks.append([S_u, S_v])
+
+    S_vec = bmat(blocks, format='csr')
+    S_vec.eliminate_zeros()
+    S_vec.indices = S_vec.indices.astype(np.int32, copy=False)
+    S_vec.indptr = S_vec.indptr.astype(np.int32, copy=False)
+
+    return S_vec
+
+def _array_digest(h, arr):
+    if arr is None:
+        h.update(b'none')
+    else:
+        arr = np.ascontiguousarray(np.asarray(arr, dtype=np.float64))
+        h.update(repr(arr.shape).encode())
+        h.update(arr.tobytes())
+
+def load_vector_operator(wgt_files, src_angle, dst_angles, src_grid):
+    """ Load (or build) the fused 2x2 block vector operator for the given weights and angles.
+        The fused operator is cached next to the weights, keyed by the weights' content hashes and the angles.
+
+    Parameters:
+        wgt_files (list of str): One (colocated) or two (u-, v-grid) ESMF weight files
+        src_angle, dst_angles, src_grid: See `fuse_vector_operator`
+
+    Returns:
+        S_vec (RemapOperator): Fused operator with two source components
+        dst_dims (list): Destination grid dimensions (nx, ny) of each output component
+    """
+    loaded = [load_weights_with_meta(wgt_file) for wgt_file in wgt_files]
+    metas = [meta for __, meta in loaded]
+
+    cache_dir = get_cache_dir(wgt_files[0])
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"vector:{src_grid}".encode())
+    for wgt_file in wgt_files:
+        h.update(_content_key(wgt_file, cache_dir).encode() if cache_dir is not None else repr(file_key(wgt_file)).encode())
+    _array_digest(h, src_angle)
+    for dst_angle in dst_angles:
+        _array_digest(h, dst_angle)
+    key = h.hexdigest()
+
+    if key not in _loaded:
+        def build():
+            S_vec = fuse_vector_operator([S_op.matrix for S_op, __ in loaded], src_angle, dst_angles, src_grid)
+            meta = {'n_a': S_vec.shape[1], 'n_b': S_vec.shape[0], 'ncomp': 2,
+                    'src_grid_dims': metas[0]['src_grid_dims'],
+                    'dst_grid_dims': [metas[i % len(metas)]['dst_grid_dims'] for i in range(2)]}
+            return S_vec, meta
+
+        S_vec, meta, entry_dir = _load_cached(cache_dir, f"vector-{key}", build)
+        _loaded[key] = (RemapOperator(S_vec, meta['src_grid_dims'], meta['dst_grid_dims'], ncomp=2,
+                                      entry_dir=entry_dir), meta)
+        _sources[key] = tuple(file_key(wgt_file) for wgt_file in wgt_files)
+
+    S_vec, meta = _loaded[key]
+
+    return S_vec, meta['dst_grid_dims']